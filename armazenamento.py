@@ -0,0 +1,450 @@
+"""
+Onde as vendas ficam guardadas: a planilha do Google Sheets (como sempre) ou um banco
+SQLite local. O SQLite calcula o cubo diário com GROUP BY no próprio banco, então o
+dashboard e a API só trazem para o pandas as linhas já agregadas.
+
+Espelhar a planilha no SQLite (uma vez ou a cada --intervalo segundos; se a planilha só
+recebeu linhas novas, só elas são inseridas):
+    python armazenamento.py --secrets .streamlit/secrets.toml --sqlite .cache/vendas.db
+    python armazenamento.py --secrets .streamlit/secrets.toml --sqlite .cache/vendas.db --intervalo 300
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import closing
+
+import pandas as pd
+
+from esquema import COLUNAS_DIMENSAO, concatenar_vendas, converter_colunas, normalizar_vendas
+from metricas import cronometrar
+from planilhas import (
+    CAMINHO_SNAPSHOT_PADRAO, abrir_worksheet, anexar_em_lotes, carregar_vendas, carregar_vendas_local, descartar_worksheet,
+    fontes_configuradas, incorporar_ao_snapshot, juntar_fontes, ler_segredos, linhas_para_planilha, ordenar_por_data,
+    versao_apos_anexar, versao_dados, versao_fontes, versoes_por_fonte,
+)
+from relatorios import AGREGADOS_CUBO, ESCALA_METRICAS, METRICAS_CUBO, construir_cubo
+
+logger = logging.getLogger(__name__)
+
+# Resultado de anexar(): a versão dos dados depois da gravação, o frame completo já com as linhas
+# novas (write-through) e só as linhas novas tratadas. `df` e `novos` ficam None quando não dá para
+# juntar com segurança (os dados mudaram por fora): quem chamou recarrega do armazenamento. Sem o
+# frame atual (estado agregado, só com o cubo), `df` fica None e `novos` basta para somar ao cubo.
+Gravacao = namedtuple("Gravacao", ["versao", "df", "novos"])
+
+
+class Armazenamento(ABC):
+    """
+    Interface comum dos armazenamentos de vendas.
+    carregar() -> (DataFrame normalizado e ordenado por 'Data', versão dos dados)
+    carregar_local() -> o mesmo a partir de uma cópia local, sem rede, ou None (para a partida rápida)
+    anexar(df_novos, df_atual, versao_atual) -> Gravacao
+    cubo(df=None) -> cubo diário no formato de relatorios.construir_cubo
+    Com `agrega_no_banco`, versao() e cubo() respondem sem trazer as linhas para a memória.
+    """
+    agrega_no_banco = False
+
+    @abstractmethod
+    def carregar(self):
+        ...
+
+    def carregar_local(self):
+        return None
+
+    @abstractmethod
+    def anexar(self, df_novos, df_atual=None, versao_atual=None):
+        ...
+
+    def so_anexou(self, versao_anterior, versao):
+        """
+        True se `versao` veio de `versao_anterior` só com linhas anexadas (sem carga completa no meio).
+        """
+        return False
+
+    def cubo(self, df=None):
+        # Sem agregação no armazenamento: monta o cubo a partir das linhas
+        return construir_cubo(self.carregar()[0] if df is None else df)
+
+
+class ArmazenamentoSheets(Armazenamento):
+    """
+    A planilha configurada em `segredos` (formato do st.secrets), com o snapshot local incremental.
+    Com várias fontes ([gsheets] fontes), as linhas novas vão para a fonte `fonte_gravacao` (padrão: a primeira).
+    """
+    def __init__(self, segredos):
+        self.segredos = segredos
+        config = segredos["gsheets"]
+        self.fontes = fontes_configuradas(segredos) if config.get("fontes") else None
+        if self.fontes:
+            nome = config.get("fonte_gravacao", self.fontes[0]["nome"])
+            self.destino = next(fonte for fonte in self.fontes if fonte["nome"] == nome)
+        else:
+            self.destino = {"nome": None, "url": config["url"], "worksheet_name": config["worksheet_name"],
+                            "snapshot_path": config.get("snapshot_path", CAMINHO_SNAPSHOT_PADRAO)}
+        self.planilha = (segredos["gcp_service_account"], self.destino["url"], self.destino["worksheet_name"])
+
+    def carregar(self):
+        return carregar_vendas(self.segredos)
+
+    def carregar_local(self):
+        return carregar_vendas_local(self.segredos)
+
+    def so_anexou(self, versao_anterior, versao):
+        # Versão da planilha: "geracao:linhas" (por fonte, com várias fontes)
+        anteriores, atuais = ((versoes_por_fonte(v) if self.fontes else {None: v}) for v in (versao_anterior, versao))
+        if anteriores.keys() != atuais.keys():
+            return False
+        for nome, atual in atuais.items():
+            geracao_anterior, linhas_anteriores = anteriores[nome].split(":")
+            geracao, linhas = atual.split(":")
+            if geracao != geracao_anterior or int(linhas) < int(linhas_anteriores):
+                return False
+        return True
+
+    def _versao(self, versoes):
+        return versao_fontes(versoes) if self.fontes else versoes[None]
+
+    @staticmethod
+    def _da_fonte(df, nome):
+        return df[(df['Fonte'] == nome).to_numpy()].drop(columns='Fonte')
+
+    def anexar(self, df_novos, df_atual=None, versao_atual=None):
+        linhas = linhas_para_planilha(df_novos)
+        try:
+            worksheet = abrir_worksheet(*self.planilha)
+            # Lotes limitados, com nova tentativa em erro de cota; o progresso permite retomar um envio interrompido
+            estatisticas = anexar_em_lotes(worksheet, linhas,
+                                           arquivo_progresso=self.segredos["gsheets"].get("progresso_path", ".cache/gravacao.progresso.json"))
+        except Exception:
+            descartar_worksheet(*self.planilha)
+            raise
+
+        nome = self.destino["nome"]
+        versoes = (versoes_por_fonte(versao_atual) if self.fontes else {None: versao_atual}) if versao_atual else {}
+        if nome not in versoes:
+            return Gravacao(None, None, None)
+
+        # Com várias fontes, o snapshot da fonte de destino só tem as linhas dela
+        incorporado = None
+        if df_atual is not None:
+            df_destino = self._da_fonte(df_atual, nome) if self.fontes else df_atual
+            incorporado = incorporar_ao_snapshot(df_destino, versoes[nome], linhas, estatisticas["primeira_linha"],
+                                                 self.destino["snapshot_path"])
+        if incorporado is None:
+            versoes[nome] = versao_apos_anexar(versoes[nome], len(linhas))
+            return Gravacao(self._versao(versoes), None, None)
+
+        df, meta, novos = incorporado
+        versoes[nome] = versao_dados(meta)
+        if self.fontes:
+            nomes = [fonte["nome"] for fonte in self.fontes]
+            df = juntar_fontes([df if outra == nome else self._da_fonte(df_atual, outra) for outra in nomes], nomes)
+            novos = novos.assign(Fonte=pd.Categorical([nome] * len(novos), categories=df['Fonte'].cat.categories))
+        return Gravacao(self._versao(versoes), df, novos)
+
+
+# --- SQLITE ---
+# A tabela guarda as linhas já normalizadas (sem lixo, com Hora/Minuto), a data como texto
+# AAAA-MM-DD e as dimensões como texto; as categorias de cada dimensão ficam na tabela meta.
+# 'Fonte' (aba/planilha de origem) fica NULL quando os dados vêm de uma fonte só.
+
+COLUNAS_SQLITE = {
+    "Invoice ID": "TEXT", "City": "TEXT", "Customer type": "TEXT", "Gender": "TEXT", "Product line": "TEXT",
+    "Unit price": "REAL", "Quantity": "INTEGER", "Total": "REAL", "Hora": "INTEGER", "Minuto": "INTEGER",
+    "Payment": "TEXT", "Rating": "REAL", "Data": "TEXT", "Fonte": "TEXT",
+}
+COLUNAS_CATEGORIA = COLUNAS_DIMENSAO + ['Fonte']
+
+
+def _coluna(nome):
+    return '"' + nome.replace('"', '""') + '"'
+
+
+class ArmazenamentoSQLite(Armazenamento):
+    """
+    Banco SQLite local com as vendas normalizadas. Uma conexão por operação, então pode ser usado de várias threads.
+    Com várias fontes no banco, as linhas anexadas sem 'Fonte' vão para `fonte_gravacao` (padrão: a primeira),
+    como no ArmazenamentoSheets.
+    """
+    agrega_no_banco = True
+
+    def __init__(self, caminho, fonte_gravacao=None):
+        self.caminho = caminho
+        self.fonte_gravacao = fonte_gravacao
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        with closing(self._conectar()) as conexao, conexao:
+            colunas = ", ".join(f"{_coluna(nome)} {tipo}" for nome, tipo in COLUNAS_SQLITE.items())
+            conexao.execute(f"CREATE TABLE IF NOT EXISTS vendas ({colunas})")
+            # Bancos criados antes de uma coluna existir ganham a coluna vazia
+            existentes = {linha[1] for linha in conexao.execute("PRAGMA table_info(vendas)")}
+            for nome, tipo in COLUNAS_SQLITE.items():
+                if nome not in existentes:
+                    conexao.execute(f"ALTER TABLE vendas ADD COLUMN {_coluna(nome)} {tipo}")
+            conexao.execute('CREATE INDEX IF NOT EXISTS vendas_data ON vendas ("Data")')
+            conexao.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def _meta(self, conexao):
+        meta = {chave: json.loads(valor) for chave, valor in conexao.execute("SELECT chave, valor FROM meta")}
+        meta.setdefault("geracao", 0)
+        meta.setdefault("linhas", 0)
+        meta.setdefault("categorias", {})
+        for col in COLUNAS_CATEGORIA:
+            meta["categorias"].setdefault(col, [])
+        return meta
+
+    def _gravar_meta(self, conexao, meta):
+        conexao.executemany("INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)",
+                            [(chave, json.dumps(valor, ensure_ascii=False)) for chave, valor in meta.items()])
+
+    @staticmethod
+    def _versao(meta):
+        return f"sqlite:{meta['geracao']}:{meta['linhas']}"
+
+    def versao(self):
+        with closing(self._conectar()) as conexao:
+            return self._versao(self._meta(conexao))
+
+    def meta(self):
+        with closing(self._conectar()) as conexao:
+            return self._meta(conexao)
+
+    @staticmethod
+    def _normalizar(df_novos):
+        # Aceita linhas cruas (colunas da planilha, com 'Time') ou já normalizadas
+        return converter_colunas(df_novos)[0] if 'Time' in df_novos.columns else normalizar_vendas(df_novos)
+
+    @staticmethod
+    def _para_tabela(df):
+        tabela = pd.DataFrame({col: df[col] for col in COLUNAS_SQLITE if col in df.columns})
+        for col in COLUNAS_CATEGORIA:
+            if col in tabela.columns:
+                tabela[col] = tabela[col].astype(str)
+        tabela['Data'] = df['Data'].dt.strftime('%Y-%m-%d')
+        return tabela
+
+    def _inserir(self, conexao, meta, tabela):
+        tabela.to_sql("vendas", conexao, if_exists="append", index=False, chunksize=50_000)
+        meta["linhas"] += len(tabela)
+        meta["categorias"] = {
+            col: sorted(set(meta["categorias"].get(col, [])) | set(tabela[col].unique() if col in tabela.columns else []))
+            for col in COLUNAS_CATEGORIA
+        }
+
+    @cronometrar("sqlite:anexar")
+    def anexar(self, df_novos, df_atual=None, versao_atual=None):
+        novos = self._normalizar(df_novos)
+        with closing(self._conectar()) as conexao, conexao:
+            # Trava de escrita já na leitura da versão: ninguém grava entre a comparação e o INSERT
+            conexao.execute("BEGIN IMMEDIATE")
+            meta = self._meta(conexao)
+            versao_anterior = self._versao(meta)
+            categorias_anteriores = meta["categorias"]
+            fontes = categorias_anteriores["Fonte"]
+            if fontes and 'Fonte' not in novos.columns:
+                fonte = self.fonte_gravacao or fontes[0]
+                novos = novos.assign(Fonte=pd.Categorical([fonte] * len(novos), categories=sorted({*fontes, fonte})))
+            self._inserir(conexao, meta, self._para_tabela(novos))
+            self._gravar_meta(conexao, meta)
+
+        if versao_anterior != versao_atual:
+            return Gravacao(self._versao(meta), None, None)
+        if df_atual is None:
+            # Estado agregado: as linhas novas somam ao cubo do banco se não trouxeram categoria nova
+            # (os níveis do cubo usam as categorias da tabela meta)
+            if meta["categorias"] != categorias_anteriores:
+                return Gravacao(self._versao(meta), None, None)
+            novos = novos.assign(**{col: pd.Categorical(novos[col].astype(str), categories=meta["categorias"][col])
+                                    for col in COLUNAS_CATEGORIA if col in novos.columns})
+            return Gravacao(self._versao(meta), None, novos)
+        if 'Fonte' in novos.columns and (
+                'Fonte' not in df_atual.columns or list(df_atual['Fonte'].cat.categories) != list(novos['Fonte'].cat.categories)):
+            # Fonte nova no banco: as categorias do frame mudam, então recarrega
+            return Gravacao(self._versao(meta), None, None)
+        # Mesma ordem do carregar() ("Data", rowid): as linhas novas entram depois das do mesmo dia
+        return Gravacao(self._versao(meta), ordenar_por_data(concatenar_vendas([df_atual, novos])), novos)
+
+    @cronometrar("sqlite:substituir")
+    def substituir(self, df_vendas, **extras_meta):
+        """
+        Troca todo o conteúdo do banco pelas linhas de `df_vendas` (nova geração dos dados).
+        """
+        tabela = self._para_tabela(self._normalizar(df_vendas))
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.execute("BEGIN IMMEDIATE")
+            meta = self._meta(conexao)
+            conexao.execute("DELETE FROM vendas")
+            meta.update(geracao=meta["geracao"] + 1, linhas=0, categorias={col: [] for col in COLUNAS_CATEGORIA}, **extras_meta)
+            self._inserir(conexao, meta, tabela)
+            self._gravar_meta(conexao, meta)
+        return self._versao(meta)
+
+    @cronometrar("sqlite:anexar_cauda")
+    def anexar_cauda(self, df_vendas, **extras_meta):
+        """
+        Anexa só as linhas de `df_vendas` (o histórico completo, ordenado por 'Data') que vieram depois das
+        que já estão no banco. Vale quando as linhas do banco são as primeiras de `df_vendas`, o que a
+        ordenação estável garante se todas as novas são de dias depois do último do banco. Retorna a
+        versão nova, ou None se não dá para garantir isso (aí quem chamou usa substituir).
+        """
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.execute("BEGIN IMMEDIATE")
+            meta = self._meta(conexao)
+            ultimo_dia = conexao.execute('SELECT MAX("Data") FROM vendas').fetchone()[0]
+            existentes = meta["linhas"]
+            if ultimo_dia is None or len(df_vendas) < existentes:
+                return None
+            ate_ultimo_dia = int((df_vendas['Data'] <= pd.Timestamp(ultimo_dia)).sum())
+            if ate_ultimo_dia != existentes:
+                return None
+            self._inserir(conexao, meta, self._para_tabela(self._normalizar(df_vendas.iloc[existentes:])))
+            meta.update(extras_meta)
+            self._gravar_meta(conexao, meta)
+        return self._versao(meta)
+
+    @cronometrar("sqlite:carregar")
+    def carregar(self):
+        with closing(self._conectar()) as conexao:
+            meta = self._meta(conexao)
+            df = pd.read_sql_query('SELECT * FROM vendas ORDER BY "Data", rowid', conexao)
+
+        df['Data'] = pd.to_datetime(df['Data']).astype('datetime64[ns]')
+        for col in ['Hora', 'Minuto']:
+            df[col] = df[col].astype('Int8')
+        if not meta["categorias"]["Fonte"]:
+            df = df.drop(columns='Fonte')
+        for col in COLUNAS_CATEGORIA:
+            if col in df.columns:
+                df[col] = pd.Categorical(df[col], categories=meta["categorias"][col] or None)
+        return normalizar_vendas(df).reset_index(drop=True), self._versao(meta)
+
+    @cronometrar("sqlite:cubo")
+    def cubo(self, df=None, inicio=None, fim=None, agregados=None, fonte=None):
+        """
+        Cubo diário calculado no banco (GROUP BY por dia e dimensões), opcionalmente só entre as datas `inicio` e `fim`
+        e só com as vendas da `fonte` (aba/planilha de origem).
+        """
+        filtros, parametros = [], []
+        if fonte is not None:
+            filtros.append('"Fonte" = ?')
+            parametros.append(fonte)
+        if inicio is not None:
+            filtros.append('"Data" >= ?')
+            parametros.append(pd.Timestamp(inicio).strftime('%Y-%m-%d'))
+        if fim is not None:
+            filtros.append('"Data" <= ?')
+            parametros.append(pd.Timestamp(fim).strftime('%Y-%m-%d'))
+        onde = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+
+        cubo = {}
+        with closing(self._conectar()) as conexao:
+            categorias = self._meta(conexao)["categorias"]
+            # O agregado por fonte só existe quando alguma linha veio com 'Fonte' (como em construir_cubo)
+            nomes = [nome for nome in (AGREGADOS_CUBO if agregados is None else ["dia", *agregados])
+                     if 'Fonte' not in AGREGADOS_CUBO[nome] or categorias['Fonte']]
+            # Como em relatorios.construir_cubo: somas exatas na menor unidade (ESCALA_METRICAS) se todos os
+            # valores caem nela, senão a soma em ponto flutuante
+            escalas = {"Total": ESCALA_METRICAS['Total'], "Rating": ESCALA_METRICAS['Soma Rating']}
+            desvios = conexao.execute("SELECT " + ", ".join(
+                f"MAX(ABS({_coluna(col)} * {escala} - ROUND({_coluna(col)} * {escala})))" for col, escala in escalas.items()
+            ) + " FROM vendas").fetchone()
+            somas = [
+                f"SUM(ROUND({_coluna(col)} * {escala})) / {escala}.0" if (desvio or 0) <= 1e-6 else f"SUM({_coluna(col)})"
+                for (col, escala), desvio in zip(escalas.items(), desvios)
+            ]
+            for nome in nomes:
+                chaves = ", ".join(_coluna(col) for col in ['Data'] + AGREGADOS_CUBO[nome])
+                consulta = (
+                    f'SELECT {chaves}, {somas[0]}, SUM("Quantity"), COUNT(*), COALESCE({somas[1]}, 0), COUNT("Rating") '
+                    f"FROM vendas {onde} GROUP BY {chaves} ORDER BY {chaves}"
+                )
+                linhas = conexao.execute(consulta, parametros).fetchall()
+                cubo[nome] = self._tabela_cubo(nome, linhas, categorias)
+        return cubo
+
+    @staticmethod
+    def _tabela_cubo(nome, linhas, categorias):
+        colunas = ['Data'] + AGREGADOS_CUBO[nome]
+        bruto = pd.DataFrame(linhas, columns=colunas + METRICAS_CUBO)
+
+        niveis = [pd.DatetimeIndex(pd.to_datetime(bruto['Data']).astype('datetime64[ns]'), name='Data')]
+        for col in AGREGADOS_CUBO[nome]:
+            if col == 'Hora':
+                niveis.append(pd.Index(bruto[col].astype('Int8'), name=col))
+            else:
+                niveis.append(pd.CategoricalIndex(bruto[col], categories=categorias.get(col), name=col))
+        indice = niveis[0] if len(niveis) == 1 else pd.MultiIndex.from_arrays(niveis)
+
+        return pd.DataFrame({
+            'Total': bruto['Total'].astype('float64').to_numpy(),
+            'Quantity': bruto['Quantity'].astype('int64').to_numpy(),
+            'Contagem': bruto['Contagem'].astype('int64').to_numpy(),
+            'Soma Rating': bruto['Soma Rating'].astype('float64').to_numpy(),
+            'Contagem Rating': bruto['Contagem Rating'].astype('int64').to_numpy(),
+        }, index=indice)
+
+
+def armazenamento_configurado(segredos):
+    """
+    Armazenamento escolhido em `segredos` (formato do st.secrets): [armazenamento] tipo = "sqlite" usa o banco
+    em `caminho`; sem essa seção, a planilha do Google Sheets.
+    """
+    config = segredos.get("armazenamento", {})
+    if config.get("tipo") == "sqlite":
+        fonte_gravacao = config.get("fonte_gravacao", segredos.get("gsheets", {}).get("fonte_gravacao"))
+        return ArmazenamentoSQLite(config.get("caminho", ".cache/vendas.db"), fonte_gravacao)
+    return ArmazenamentoSheets(segredos)
+
+
+def espelhar(origem, destino):
+    """
+    Copia os dados de `origem` para o ArmazenamentoSQLite `destino` quando a versão da origem mudou:
+    só as linhas novas se a origem apenas cresceu, ou tudo numa nova geração do banco.
+    Retorna a versão do destino.
+    """
+    df, versao_origem = origem.carregar()
+    versao_anterior = destino.meta().get("versao_origem")
+    if versao_anterior == versao_origem:
+        return destino.versao()
+    if versao_anterior is not None and origem.so_anexou(versao_anterior, versao_origem):
+        versao = destino.anexar_cauda(df, versao_origem=versao_origem)
+        if versao is not None:
+            logger.info("Espelhadas as linhas novas (versão %s da origem)", versao_origem)
+            return versao
+    logger.info("Espelhando %d linhas (versão %s da origem)", len(df), versao_origem)
+    return destino.substituir(df, versao_origem=versao_origem)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Espelha a planilha do Google Sheets em um banco SQLite local.")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--sqlite", default=".cache/vendas.db", help="caminho do banco")
+    parser.add_argument("--intervalo", type=int, default=0, help="repetir a cada N segundos (0 = uma vez)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    origem = ArmazenamentoSheets(ler_segredos(args.secrets))
+    destino = ArmazenamentoSQLite(args.sqlite)
+    while True:
+        try:
+            print(f"{args.sqlite}: versão {espelhar(origem, destino)}")
+        except Exception:
+            if not args.intervalo:
+                raise
+            logger.exception("Falha ao espelhar a planilha; nova tentativa em %ds", args.intervalo)
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from relatorios import atualizar_cubo, carregar_cubo, construir_cubo, construir_indice_dias, salvar_cubo
+
+logger = logging.getLogger(__name__)
+
+ESPERA_APOS_FALHA = 30  # segundos até tentar de novo uma recarga em segundo plano que falhou
+
+# --- ESTADO DOS DADOS COMPARTILHADO ENTRE THREADS ---
+#
+# Um EstadoDados é imutável: quando os dados mudam, montamos outro e trocamos a
+# referência. Quem já pegou o estado anterior continua com uma visão coerente
+# (frame, índice de dias e cubo da mesma versão).
+
+EstadoDados = namedtuple("EstadoDados", ["df", "versao", "indice_dias", "cubo"])
+
+
+def montar_estado(df, versao, pasta_cubo=None, construir=construir_cubo):
+    """
+    Monta o índice de dias e o cubo (reaproveitando o cubo persistido da mesma versão, se houver).
+    `construir` recebe o frame e devolve o cubo (ex.: Armazenamento.cubo, que pode agregar no banco).
+    """
+    cubo = carregar_cubo(pasta_cubo, versao) if pasta_cubo else None
+    if cubo is None:
+        cubo = construir(df)
+        if pasta_cubo:
+            salvar_cubo(cubo, versao, pasta_cubo)
+    return EstadoDados(df, versao, construir_indice_dias(df), cubo)
+
+
+def montar_estado_agregado(armazenamento, versao, pasta_cubo=None):
+    """
+    Estado só com o cubo, agregado no próprio armazenamento (ex.: ArmazenamentoSQLite): as linhas
+    não vêm para a memória. Serve às rotas da API, que com o cubo não leem o frame nem o índice de dias.
+    """
+    cubo = carregar_cubo(pasta_cubo, versao) if pasta_cubo else None
+    if cubo is None:
+        cubo = armazenamento.cubo()
+        if pasta_cubo:
+            salvar_cubo(cubo, versao, pasta_cubo)
+    return EstadoDados(None, versao, None, cubo)
+
+
+class BaseVendas:
+    """
+    Cache em processo dos dados de vendas, compartilhado pelas requisições concorrentes.
+    `carregar` é uma função sem argumentos que retorna (DataFrame, versão dos dados) e `montar`
+    recebe (DataFrame, versão, pasta_cubo) e devolve o EstadoDados.
+
+    `inicial` (opcional) retorna rápido, sem rede, a última cópia local no mesmo formato de `carregar`
+    (ou None se não houver). Com ela, a primeira chamada responde com essa cópia e as recargas por TTL
+    rodam em segundo plano: nenhuma requisição espera pela fonte de dados depois da partida. Depois de
+    invalidar() (ou de um incorporar() que não incorporou), a próxima chamada recarrega antes de responder.
+    """
+    def __init__(self, carregar, ttl=600, pasta_cubo=None, montar=montar_estado, inicial=None):
+        self.carregar = carregar
+        self.montar = montar
+        self.ttl = ttl
+        self.pasta_cubo = pasta_cubo
+        self.inicial = inicial
+        self._estado = None
+        self._carregado_em = 0.0
+        self._lock = threading.Lock()
+        self._atualizacao = None
+        self._invalidado = False
+
+    def _expirado(self):
+        return self._estado is None or self._invalidado or time.monotonic() - self._carregado_em >= self.ttl
+
+    def invalidar(self):
+        """
+        Força a próxima chamada de estado() a recarregar (a versão nova, se mudou, troca o estado).
+        """
+        with self._lock:
+            self._invalidado = True
+
+    def incorporar(self, versao_anterior, gravacao):
+        """
+        Write-through: troca o estado pelo frame já com as linhas recém-gravadas (armazenamento.Gravacao),
+        somando só essas linhas ao cubo, sem recarregar; no estado agregado (sem frame), só o cubo muda.
+        Se o estado atual não é `versao_anterior`, a gravação não trouxe as linhas novas (ou o frame
+        completo, quando o estado tem frame) ou as linhas novas não cobrem algum agregado do cubo,
+        invalida (a próxima chamada de estado() recarrega). Retorna True se incorporou.
+        """
+        with self._lock:
+            atual = self._estado
+            if (gravacao.novos is None or atual is None or atual.versao != versao_anterior
+                    or (gravacao.df is None) != (atual.df is None)):
+                self._invalidado = True
+                return False
+            cubo = atualizar_cubo(atual.cubo, gravacao.novos)
+            if cubo is None:
+                self._invalidado = True
+                return False
+            if self.pasta_cubo:
+                salvar_cubo(cubo, gravacao.versao, self.pasta_cubo)
+            indice_dias = None if gravacao.df is None else construir_indice_dias(gravacao.df)
+            self._estado = EstadoDados(gravacao.df, gravacao.versao, indice_dias, cubo)
+            self._carregado_em = time.monotonic()
+            return True
+
+    def _partir_da_copia_local(self):
+        with self._lock:
+            if self._estado is not None:
+                return
+            try:
+                carregado = self.inicial()
+            except Exception:
+                logger.exception("Cópia local dos dados ilegível; carregando da fonte")
+                return
+            if carregado is not None:
+                self._estado = self.montar(*carregado, self.pasta_cubo)
+                self._carregado_em = float("-inf")  # ainda falta conferir com a fonte
+
+    def _atualizar_em_segundo_plano(self):
+        with self._lock:
+            if self._atualizacao is not None and self._atualizacao.is_alive():
+                return
+            self._atualizacao = threading.Thread(target=self._recarregar, args=(self._estado,), name="base-vendas", daemon=True)
+            self._atualizacao.start()
+
+    def _recarregar(self, anterior):
+        try:
+            df, versao = self.carregar()
+            novo = anterior if versao == anterior.versao else self.montar(df, versao, self.pasta_cubo)
+        except Exception:
+            # Segue servindo a versão anterior e tenta de novo depois de ESPERA_APOS_FALHA, não a cada chamada
+            logger.exception("Falha ao recarregar os dados; mantida a versão %s", anterior.versao)
+            with self._lock:
+                if self._estado is anterior:
+                    self._carregado_em = time.monotonic() - self.ttl + min(self.ttl, ESPERA_APOS_FALHA)
+            return
+        with self._lock:
+            # Se um write-through (incorporar) trocou o estado no meio do caminho, ele é mais novo
+            if self._estado is anterior:
+                self._estado = novo
+                self._carregado_em = time.monotonic()
+
+    def estado(self):
+        if not self._expirado():
+            return self._estado
+
+        # A cópia local e o estado anterior só servem enquanto a recarga é por TTL: depois de invalidar(),
+        # quem chama espera a versão da fonte (ex.: o dashboard logo após gravar um dia)
+        if self.inicial is not None and not self._invalidado:
+            if self._estado is None:
+                self._partir_da_copia_local()
+            if self._estado is not None:
+                self._atualizar_em_segundo_plano()
+                return self._estado
+
+        # Só uma thread recarrega; as demais seguem com o estado anterior, se existir
+        if not self._lock.acquire(blocking=self._estado is None or self._invalidado):
+            return self._estado
+        try:
+            if self._expirado():
+                df, versao = self.carregar()
+                if self._estado is None or versao != self._estado.versao:
+                    self._estado = self.montar(df, versao, self.pasta_cubo)
+                self._carregado_em = time.monotonic()
+                self._invalidado = False
+            return self._estado
+        finally:
+            self._lock.release()
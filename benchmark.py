@@ -0,0 +1,217 @@
+"""
+Benchmark das etapas do pipeline com históricos sintéticos de 10 mil a 10 milhões de linhas.
+
+Cada etapa é medida separadamente (tempo de parede e pico de memória alocada) e o resultado
+vai para um JSON. Com --baseline, compara com uma execução anterior e sai com código 1 se
+alguma etapa piorou além dos limites.
+
+A grade da planilha (listas Python, como a API devolve) ocupa ~1,4 GB a cada milhão de linhas, então
+a carga da planilha é medida em no máximo LINHAS_MAX_CARGA_PLANILHA linhas (etapa carga_planilha:amostra
+acima disso); as demais etapas rodam no histórico inteiro, convertido direto do frame gerado.
+
+Exemplos:
+    python benchmark.py --escalas 10k 100k --saida .cache/benchmark.json
+    python benchmark.py --escalas 10k 100k 1m --baseline benchmark_base.json --limite-tempo 0.25
+    python benchmark.py --escalas 10k --salvar-baseline benchmark_base.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from gerador_dados import COLUNAS_VENDAS, gerar_vendas
+from planilhas import linhas_para_planilha, ordenar_por_data, sincronizar_planilha, tratar_tipos
+from relatorios import (
+    MAPEAMENTO_RELATORIOS, TABELAS_RELATORIO, alertas_do_dia, construir_cubo, construir_indice_dias, construir_tabela_alertas,
+    relatorio_por_dia_com_variacoes, resposta_get_report,
+)
+from tests.planilha_falsa import PlanilhaEmMemoria
+
+# Escala -> quantidade aproximada de linhas. O histórico tem até 10 anos; acima disso
+# cresce o número de vendas por dia.
+ESCALAS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+MAX_DIAS_HISTORICO = 3650
+ESCALAS_PADRAO = ["10k", "100k", "1m"]
+LINHAS_MAX_CARGA_PLANILHA = 1_000_000
+
+# Diferenças abaixo destes valores são ruído de medição, não regressão
+TOLERANCIA_SEGUNDOS = 0.005
+TOLERANCIA_MB = 1.0
+
+
+def gerar_historico(linhas, semente=0):
+    """
+    Histórico sintético com ~`linhas` vendas terminando ontem, no esquema do gerador_dados.
+    """
+    dias = max(1, min(linhas // 200, MAX_DIAS_HISTORICO))
+    por_dia = linhas // dias
+    inicio = datetime.date.today() - datetime.timedelta(days=dias)
+    return gerar_vendas(inicio, dias, semente, transacoes_por_dia=(por_dia // 2, por_dia + por_dia // 2))
+
+
+def grade_da_planilha(df_vendas):
+    # Mesma grade que o Google Sheets devolve: cabeçalho + linhas gravadas por linhas_para_planilha
+    return [COLUNAS_VENDAS] + linhas_para_planilha(df_vendas)
+
+
+def medir(funcao, repeticoes=1, memoria=True):
+    """
+    Retorna (resultado, segundos, pico em MB). O tempo é o menor entre as repetições; o pico de
+    memória vem de uma execução separada com tracemalloc, que deixaria o tempo mais lento.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+
+    pico_mb = None
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcao()
+            pico_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return resultado, min(tempos), pico_mb
+
+
+def executar_escala(nome_escala, semente=0, repeticoes=3, memoria=True):
+    """
+    Mede as etapas em uma escala e retorna a lista de resultados (um dicionário por etapa).
+    """
+    resultados = []
+
+    def registrar(etapa, funcao, vezes=repeticoes):
+        resultado, segundos, pico_mb = medir(funcao, vezes, memoria)
+        resultados.append({
+            "escala": nome_escala, "etapa": etapa, "segundos": round(segundos, 6),
+            "pico_mb": None if pico_mb is None else round(pico_mb, 3),
+        })
+        print(f"  {etapa:<44} {segundos * 1000:>10.1f} ms" + ("" if pico_mb is None else f" {pico_mb:>10.1f} MB"))
+        return resultado
+
+    df_gerado = gerar_historico(ESCALAS[nome_escala], semente)
+    print(f"{nome_escala}: {len(df_gerado)} linhas, {df_gerado['Data'].nunique()} dias")
+    amostra = len(df_gerado) > LINHAS_MAX_CARGA_PLANILHA
+
+    # Carga como no dashboard, com a planilha em memória no lugar da API
+    with tempfile.TemporaryDirectory() as pasta:
+        def carga_completa(grade=grade_da_planilha(df_gerado.iloc[:LINHAS_MAX_CARGA_PLANILHA])):
+            caminho = os.path.join(pasta, f"vendas-{time.perf_counter_ns()}.parquet")
+            return sincronizar_planilha(PlanilhaEmMemoria(grade), caminho)[0]
+        df = registrar("carga_planilha:amostra" if amostra else "carga_planilha", carga_completa, vezes=1)
+        del carga_completa  # libera a grade
+
+    if amostra:
+        # Mesma conversão e ordem da carga, sem passar pela grade
+        df = ordenar_por_data(tratar_tipos(df_gerado))
+    del df_gerado
+
+    indice_dias = registrar("indice_dias", lambda: construir_indice_dias(df))
+    cubo = registrar("cubo", lambda: construir_cubo(df), vezes=1)
+
+    dias = sorted(indice_dias)
+    for rotulo, dia in (("primeiro", dias[0]), ("meio", dias[len(dias) // 2]), ("ultimo", dias[-1])):
+        registrar(f"relatorio_dia:{rotulo}", lambda: relatorio_por_dia_com_variacoes(dia, df, indice_dias, cubo=cubo))
+    # Caminho sem cubo (agrupa as linhas do dia), usado quando o cubo não está disponível
+    registrar("relatorio_dia_linhas:ultimo", lambda: relatorio_por_dia_com_variacoes(dias[-1], df, indice_dias))
+
+    # As regras de alerta rodam no histórico inteiro de uma vez; cada dia só consulta a tabela
+    tabela_alertas = registrar("alertas:tabela", lambda: construir_tabela_alertas(cubo))
+    registrar("alertas:dia", lambda: [alertas_do_dia(tabela_alertas, dia) for dia in (dias[0], dias[len(dias) // 2], dias[-1])])
+
+    ultimo_dia = str(dias[-1])
+    # Relatórios de colunas que o histórico sintético não tem (ex.: 'Fonte') ficam de fora
+    for report_name in [nome for nome, (chave, _, _) in MAPEAMENTO_RELATORIOS.items() if TABELAS_RELATORIO[chave][2] in cubo]:
+        registrar(f"get_report:{report_name}",
+                  lambda: json.dumps(resposta_get_report(ultimo_dia, report_name, df, indice_dias, cubo=cubo), ensure_ascii=False, default=str))
+
+    return resultados
+
+
+def comparar_com_baseline(resultados, baseline, limite_tempo, limite_memoria):
+    """
+    Lista as etapas que pioraram mais que os limites relativos (ex.: 0.2 = 20%) em relação ao baseline.
+    """
+    anteriores = {(r["escala"], r["etapa"]): r for r in baseline["resultados"]}
+    regressoes = []
+    for atual in resultados:
+        anterior = anteriores.get((atual["escala"], atual["etapa"]))
+        if anterior is None:
+            continue
+        if (atual["segundos"] > anterior["segundos"] * (1 + limite_tempo)
+                and atual["segundos"] - anterior["segundos"] > TOLERANCIA_SEGUNDOS):
+            regressoes.append(f"{atual['escala']} {atual['etapa']}: tempo {anterior['segundos']:.4f}s -> {atual['segundos']:.4f}s")
+        if (atual["pico_mb"] is not None and anterior.get("pico_mb") is not None
+                and atual["pico_mb"] > anterior["pico_mb"] * (1 + limite_memoria)
+                and atual["pico_mb"] - anterior["pico_mb"] > TOLERANCIA_MB):
+            regressoes.append(f"{atual['escala']} {atual['etapa']}: memória {anterior['pico_mb']:.1f}MB -> {atual['pico_mb']:.1f}MB")
+    return regressoes
+
+
+def gravar_json(conteudo, caminho):
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(conteudo, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de carga, relatórios, alertas e API.")
+    parser.add_argument("--escalas", nargs="+", choices=list(ESCALAS), default=ESCALAS_PADRAO)
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--repeticoes", type=int, default=3, help="execuções por etapa (vale o menor tempo)")
+    parser.add_argument("--sem-memoria", action="store_true", help="não medir o pico de memória (mais rápido)")
+    parser.add_argument("--saida", default=".cache/benchmark.json", help="arquivo JSON com os resultados")
+    parser.add_argument("--baseline", default=None, help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--limite-tempo", type=float, default=0.2, help="piora relativa de tempo tolerada (0.2 = 20%%)")
+    parser.add_argument("--limite-memoria", type=float, default=0.2, help="piora relativa de memória tolerada")
+    parser.add_argument("--salvar-baseline", default=None, help="grava também os resultados como novo baseline")
+    args = parser.parse_args()
+
+    resultados = []
+    for escala in args.escalas:
+        resultados.extend(executar_escala(escala, args.semente, args.repeticoes, not args.sem_memoria))
+
+    conteudo = {
+        "meta": {
+            "data": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "semente": args.semente,
+            "repeticoes": args.repeticoes,
+        },
+        "resultados": resultados,
+    }
+    gravar_json(conteudo, args.saida)
+    print(f"Resultados gravados em {args.saida}")
+    if args.salvar_baseline:
+        gravar_json(conteudo, args.salvar_baseline)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressoes = comparar_com_baseline(resultados, json.load(f), args.limite_tempo, args.limite_memoria)
+        if regressoes:
+            print("Regressões em relação ao baseline:")
+            for regressao in regressoes:
+                print(f"  {regressao}")
+            sys.exit(1)
+        print("Sem regressões em relação ao baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# --- ESQUEMA DAS VENDAS EM MEMÓRIA ---
+#
+# Normalizado uma única vez na ingestão (planilha, snapshot, arquivo ou gerador):
+# dimensões como category com categorias em ordem alfabética, o horário "HH:MM"
+# trocado por Hora/Minuto inteiros e as métricas no menor tipo que não muda os
+# relatórios. As linhas de lixo (totais colados na planilha) também saem aqui,
+# então os relatórios não fazem nenhum trabalho com strings.
+
+VERSAO_ESQUEMA = 2
+COLUNAS_DIMENSAO = ['City', 'Customer type', 'Gender', 'Product line', 'Payment']
+VALORES_LIXO = {'total', 'quantity'}
+
+
+def _como_categoria(serie):
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.astype('category')  # categorias já saem ordenadas
+    serie = serie.cat.remove_unused_categories()
+    categorias = serie.cat.categories
+    if not categorias.is_monotonic_increasing:
+        serie = serie.cat.reorder_categories(categorias.sort_values())
+    return serie
+
+
+def _eh_lixo(serie):
+    # Compara só as categorias (poucas), não cada linha
+    lixo = [c for c in serie.cat.categories if str(c).lower() in VALORES_LIXO]
+    return serie.isin(lixo) if lixo else np.zeros(len(serie), dtype=bool)
+
+
+def _hora_e_minuto(horarios):
+    # Poucos horários distintos (no máximo 1440): converte os únicos e espalha pelos códigos
+    codigos, unicos = pd.factorize(horarios.astype(str))
+    partes = pd.Series(unicos).str.split(':')
+    horas = pd.to_numeric(partes.str[0], errors='coerce').astype('Int8').array
+    minutos = pd.to_numeric(partes.str[1], errors='coerce').astype('Int8').array
+    return horas.take(codigos, allow_fill=True), minutos.take(codigos, allow_fill=True)
+
+
+def _inteiro_compacto(serie, tipo='int16'):
+    limites = np.iinfo(tipo)
+    if serie.empty or (serie.min() >= limites.min and serie.max() <= limites.max):
+        return serie.astype(tipo)
+    return serie.astype('int64')
+
+
+def normalizar_vendas(df_vendas):
+    """
+    Converte o frame (com 'Data', 'Total' e 'Quantity' já válidos) para o esquema compacto usado nos relatórios.
+    Pode ser chamada de novo sobre um frame já normalizado.
+    """
+    df_vendas = df_vendas.copy()
+
+    for col in COLUNAS_DIMENSAO:
+        df_vendas[col] = _como_categoria(df_vendas[col])
+
+    lixo = np.zeros(len(df_vendas), dtype=bool)
+    for col in COLUNAS_DIMENSAO:
+        lixo |= np.asarray(_eh_lixo(df_vendas[col]))
+    if lixo.any():
+        df_vendas = df_vendas[~lixo]
+        for col in COLUNAS_DIMENSAO:
+            df_vendas[col] = df_vendas[col].cat.remove_unused_categories()
+
+    if 'Time' in df_vendas.columns:
+        hora, minuto = _hora_e_minuto(df_vendas['Time'])
+        posicao = df_vendas.columns.get_loc('Time')
+        df_vendas = df_vendas.drop(columns='Time')
+        df_vendas.insert(posicao, 'Hora', hora)
+        df_vendas.insert(posicao + 1, 'Minuto', minuto)
+
+    df_vendas['Quantity'] = _inteiro_compacto(df_vendas['Quantity'])
+    # Rating fica em float64: em float32 as médias arredondadas devolvidas à API mudam
+    df_vendas['Rating'] = pd.to_numeric(df_vendas['Rating'], errors='coerce').astype('float64')
+    if 'Unit price' in df_vendas.columns:
+        df_vendas['Unit price'] = pd.to_numeric(df_vendas['Unit price'], errors='coerce').astype('float32')
+    df_vendas['Total'] = df_vendas['Total'].astype('float64')
+
+    return df_vendas
+
+
+def concatenar_vendas(frames):
+    """
+    Concatena frames normalizados unindo as categorias (pd.concat viraria object se elas diferissem).
+    """
+    frames = [df for df in frames if not df.empty] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    resultado = pd.concat(frames, ignore_index=True)
+    for col in COLUNAS_DIMENSAO:
+        if not isinstance(resultado[col].dtype, pd.CategoricalDtype):
+            unido = union_categoricals([df[col] for df in frames], sort_categories=True)
+            resultado[col] = pd.Series(unido, index=resultado.index)
+    return resultado
+
+
+# --- CONVERSÃO DA GRADE DA PLANILHA ---
+#
+# A API devolve uma grade 2-D (valores não formatados: números como número e
+# datas como texto). Cada coluna é convertida uma vez, em vetor, segundo o tipo
+# declarado abaixo; linhas que não passam são descartadas e contadas por motivo.
+
+COLUNAS_PLANILHA = {
+    "Invoice ID": "texto",
+    "City": "categoria",
+    "Customer type": "categoria",
+    "Gender": "categoria",
+    "Product line": "categoria",
+    "Unit price": "numero",
+    "Quantity": "inteiro",
+    "Total": "numero",
+    "Time": "texto",
+    "Payment": "categoria",
+    "Rating": "numero",
+    "Data": "data",
+}
+
+# Data serial das planilhas (dias desde 30/12/1899)
+_EPOCA_PLANILHA = pd.Timestamp("1899-12-30")
+
+
+def _vazios(serie):
+    return (serie.isna() | (serie == '')).to_numpy() if serie.dtype == object else serie.isna().to_numpy()
+
+
+def _converter_data(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+
+    # Poucas datas distintas: converte só os valores únicos e espalha pelos códigos
+    codigos, unicos = pd.factorize(serie)
+    eh_serial = np.array([isinstance(v, (int, float)) and not isinstance(v, bool) for v in unicos], dtype=bool)
+
+    datas = np.full(len(unicos), np.datetime64('NaT'), dtype='datetime64[ns]')
+    if (~eh_serial).any():
+        datas[~eh_serial] = pd.to_datetime(pd.Series(unicos[~eh_serial], dtype=object).astype(str), errors='coerce').to_numpy()
+    if eh_serial.any():
+        datas[eh_serial] = (_EPOCA_PLANILHA + pd.to_timedelta(unicos[eh_serial].astype(float), unit='D')).to_numpy()
+
+    valores = datas.take(codigos) if len(datas) else np.full(len(serie), np.datetime64('NaT'), dtype='datetime64[ns]')
+    valores[codigos < 0] = np.datetime64('NaT')
+    return pd.Series(valores, index=serie.index)
+
+
+def _converter_coluna(serie, tipo):
+    if tipo == "data":
+        return _converter_data(serie)
+    if tipo in ("numero", "inteiro"):
+        return pd.to_numeric(serie, errors='coerce').astype('float64')
+    if tipo == "categoria":
+        return serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.fillna('').astype(str).astype('category')
+    return serie.fillna('') if serie.dtype == object else serie
+
+
+def converter_colunas(df_bruto):
+    """
+    Converte as colunas declaradas em COLUNAS_PLANILHA e descarta as linhas inválidas.
+    Retorna (DataFrame normalizado, {motivo: quantidade de linhas rejeitadas}).
+    """
+    colunas = {col: _converter_coluna(df_bruto[col], COLUNAS_PLANILHA.get(col, "texto")) for col in df_bruto.columns}
+    df_vendas = pd.DataFrame(colunas, index=df_bruto.index)
+
+    # Linha vazia também fica sem data: só essas precisam ser olhadas célula a célula
+    data_invalida = df_vendas['Data'].isna().to_numpy()
+    vazia = np.zeros(len(df_vendas), dtype=bool)
+    if data_invalida.any():
+        sem_data = df_bruto[data_invalida]
+        vazia[data_invalida] = np.logical_and.reduce([_vazios(sem_data[col]) for col in sem_data.columns])
+
+    quantidade = df_vendas['Quantity']
+    motivos = {
+        "linha_vazia": vazia,
+        "data_invalida": data_invalida,
+        "total_invalido": df_vendas['Total'].isna().to_numpy(),
+        "quantidade_invalida": (quantidade.isna() | (quantidade % 1 != 0)).to_numpy(),
+        "total_nao_positivo": (df_vendas['Total'] <= 0).to_numpy(),
+    }
+
+    # Cada linha conta só no primeiro motivo em que cai
+    rejeitadas = {}
+    descartar = np.zeros(len(df_vendas), dtype=bool)
+    for motivo, mascara in motivos.items():
+        novas = mascara & ~descartar
+        if novas.any():
+            rejeitadas[motivo] = int(novas.sum())
+            descartar |= novas
+
+    validas = df_vendas[~descartar]
+    validas = validas.assign(Quantity=validas['Quantity'].astype('int64'))
+    df_vendas = normalizar_vendas(validas)
+    if len(df_vendas) < len(validas):
+        rejeitadas["linha_de_total"] = len(validas) - len(df_vendas)
+
+    return df_vendas, rejeitadas
+
+
+def converter_grade(cabecalho, linhas):
+    """
+    Converte a grade de valores da planilha (sem o cabeçalho) sem montar um dicionário por linha.
+    Retorna (DataFrame normalizado, {motivo: quantidade de linhas rejeitadas}).
+    """
+    # A API omite as células vazias no fim de cada linha; o DataFrame completa com None
+    grade = pd.DataFrame(linhas, dtype=object)
+    largura = len(cabecalho)
+    grade = grade.iloc[:, :largura].reindex(columns=range(largura))
+    grade.columns = cabecalho
+    return converter_colunas(grade)
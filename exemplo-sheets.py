@@ -1,399 +1,145 @@
 import pandas as pd
 import streamlit as st
-import plotly.express as px
-import plotly
-import gspread
-from gspread.exceptions import WorksheetNotFound, APIError
-import datetime
-import numpy as np
-import random
+
+import metricas
+from armazenamento import armazenamento_configurado
+from base_dados import BaseVendas, montar_estado, montar_estado_agregado
+from gerador_dados import gerar_dados_proximo_dia
+from relatorios import (
+    PASTA_CUBO_PADRAO, CacheLRU, PreCarregador, RespostaBinaria, alertas_do_dia, construir_indice_dias,
+    cubo_da_fonte, relatorio_por_dia_com_variacoes, resposta_api, tabela_alertas_em_cache,
+    tamanho_relatorio,
+)
 
 # --- CONFIGURAÇÃO DA PÁGINA (Deve ser a primeira chamada Streamlit) ---
 st.set_page_config(layout="wide", page_title="Dashboard de Vendas")
 
+# [gsheets] é opcional: com [armazenamento] tipo = "sqlite" o dashboard roda só com o banco local
+config = st.secrets.get("gsheets", {})
+
+# Métricas por etapa (rota request_type=metrics e painel na barra lateral), desligadas por padrão
+if config.get("metricas", False):
+    metricas.ativar()
+
 # --- FUNÇÕES DE INTERAÇÃO E LÓGICA ---
 
-@st.cache_data(ttl=600)
-def load_data_from_gsheets():
+@st.cache_resource
+def obter_armazenamento():
+    # Google Sheets por padrão; com [armazenamento] tipo = "sqlite" nos secrets, o espelho local
+    # mantido por armazenamento.py (o cubo diário é agregado no próprio banco)
+    return armazenamento_configurado(st.secrets)
+
+@st.cache_resource
+def obter_base_vendas():
+    # Frame, índice de dias e cubo da versão atual, compartilhados entre reruns e sessões; recarrega
+    # depois do TTL e recebe por write-through as linhas gravadas pelo botão de simulação.
+    # A primeira sessão já abre com o último snapshot local (e o cubo persistido da mesma versão,
+    # ver servidor_api.py --aquecer); a sincronização com a planilha roda em segundo plano
+    armazenamento = obter_armazenamento()
+    pasta_cubo = config.get("cubo_path", PASTA_CUBO_PADRAO)
+    if armazenamento.agrega_no_banco:
+        # Só a versão e o cubo agregado no banco (como servidor_api.py --sqlite): as linhas não vêm para a memória
+        carregar = lambda: (None, armazenamento.versao())
+        montar = lambda df, versao, pasta: montar_estado_agregado(armazenamento, versao, pasta)
+        return BaseVendas(carregar, ttl=600, pasta_cubo=pasta_cubo, montar=montar)
+    montar = lambda df, versao, pasta: montar_estado(df, versao, pasta, construir=armazenamento.cubo)
+    return BaseVendas(armazenamento.carregar, ttl=600, pasta_cubo=pasta_cubo, montar=montar, inicial=armazenamento.carregar_local)
+
+def carregar_dados():
     try:
-        creds_dict = st.secrets["gcp_service_account"]
-        gsheets_url = st.secrets["gsheets"]["url"]
-        worksheet_name = st.secrets["gsheets"]["worksheet_name"]
-
-        gc = gspread.service_account_from_dict(creds_dict)
-        sh = gc.open_by_url(gsheets_url)
-        worksheet = sh.worksheet(worksheet_name)
-
-        data = worksheet.get_all_records()
-        df_sheet = pd.DataFrame.from_records(data)
-
-        df_sheet.dropna(how='all', inplace=True)
-        
-        try:
-            df_sheet['Data'] = pd.to_datetime(df_sheet['Data'], errors='coerce')
-        except Exception:
-             df_sheet['Data'] = pd.to_datetime(df_sheet['Data'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-            
-        df_sheet['Total'] = pd.to_numeric(df_sheet['Total'], errors='coerce')
-        df_sheet['Quantity'] = pd.to_numeric(df_sheet['Quantity'], errors='coerce').astype('Int64')
-        
-        # Converter Rating para número
-        df_sheet['Rating'] = pd.to_numeric(df_sheet['Rating'], errors='coerce') 
-
-        df_sheet.dropna(subset=['Data', 'Total', 'Quantity'], inplace=True)
-        df_sheet = df_sheet[df_sheet['Total'] > 0]
-        df_sheet.dropna(subset=['Data'], inplace=True)
-        
-        return df_sheet
-
+        return obter_base_vendas().estado()
     except Exception as e:
         st.error(f"Erro ao carregar dados: {e}")
         st.stop()
-        return pd.DataFrame()
 
-def salvar_dados_gsheets(df_novos_dados):
+def salvar_dados(df_novos_dados, estado):
     """
-    Recebe um DataFrame com novos dados e adiciona (append) na planilha do Google Sheets.
+    Recebe um DataFrame com novos dados e adiciona (append) no armazenamento configurado.
+    Retorna a Gravacao (versão nova e frame já com as linhas novas), ou None em caso de erro.
     """
     try:
-        creds_dict = st.secrets["gcp_service_account"]
-        gsheets_url = st.secrets["gsheets"]["url"]
-        worksheet_name = st.secrets["gsheets"]["worksheet_name"]
-
-        gc = gspread.service_account_from_dict(creds_dict)
-        sh = gc.open_by_url(gsheets_url)
-        worksheet = sh.worksheet(worksheet_name)
-
-        # Converte as datas para string antes de enviar
-        df_export = df_novos_dados.copy()
-        df_export['Data'] = df_export['Data'].dt.strftime('%Y-%m-%d')
-        
-        dados_lista = df_export.astype(object).values.tolist()
-        
-        worksheet.append_rows(dados_lista)
-        return True
+        return obter_armazenamento().anexar(df_novos_dados, estado.df, estado.versao)
     except Exception as e:
-        st.error(f"Erro ao salvar dados no Google Sheets: {e}")
-        return False
-
-def gerar_dados_proximo_dia(df_atual):
-    if df_atual.empty:
-        ultimo_dia = datetime.date.today()
-    else:
-        ultimo_dia = df_atual['Data'].max().date()
-    
-    proximo_dia = ultimo_dia + datetime.timedelta(days=1)
-    qtd_transacoes = random.randint(100, 300)
-    novas_linhas = []
-    
-    cidades = ['Rio de Janeiro', 'São Paulo', 'Manaus']
-    tipos_cliente = ['Normal', 'Membro']
-    generos = ['Homem', 'Mulher']
-    linhas_produto = ['Saude e Beleza', 'Acessorios Eletronicos', 'Casa e Estilo de Vida', 'Esportes e Viagens', 'Moda']
-    pagamentos = ['Pix', 'Cartao de Credito', 'Debito']
-    
-    for _ in range(qtd_transacoes):
-        invoice_id = f"{random.randint(100, 999)}-{random.randint(10, 99)}-{random.randint(1000, 9999)}"
-        city = random.choice(cidades)
-        customer_type = random.choice(tipos_cliente)
-        gender = random.choice(generos)
-        product_line = random.choice(linhas_produto)
-        
-        unit_price_float = random.uniform(10.00, 130.00)
-        unit_price_str = f"{unit_price_float:.2f}"
-        
-        quantity = random.randint(1, 15)
-        total_float = unit_price_float * quantity
-        total_str = f"{total_float:.2f}"
-        
-        hora = random.randint(7, 23)
-        minuto = random.randint(0, 59)
-        time_str = f"{hora:02d}:{minuto:02d}"
-        
-        payment = random.choice(pagamentos)
-        rating = round(random.uniform(3.0, 10.0), 1)
-        data_registro = pd.to_datetime(proximo_dia)
-        
-        linha = {
-            "Invoice ID": invoice_id, "City": city, "Customer type": customer_type,
-            "Gender": gender, "Product line": product_line, "Unit price": unit_price_str,
-            "Quantity": int(quantity), "Total": total_str, "Time": time_str,
-            "Payment": payment, "Rating": rating, "Data": data_registro
-        }
-        novas_linhas.append(linha)
-        
-    return pd.DataFrame(novas_linhas)
-
-# --- FUNÇÃO DE ALERTAS (MOVIMENTO PARA ESCOPO GLOBAL) ---
-def calcular_alertas_dia(relatorio):
-    """
-    Recebe o dicionário de relatórios e retorna listas de mensagens de alerta.
-    """
-    alertas_positivos = []
-    alertas_negativos = []
-
-    if not relatorio:
-        return {"alertas_positivos": [], "alertas_negativos": [], "total_alertas": 0}
-
-    # 1. Cidades acima de 30k
-    if 'total_por_cidade' in relatorio:
-        cidades_acima_30000 = relatorio['total_por_cidade'][relatorio['total_por_cidade']['Total'] > 30000]
-        if not cidades_acima_30000.empty:
-            cidades_str = ", ".join(cidades_acima_30000.index)
-            alertas_positivos.append(f"As cidades **{cidades_str}** ultrapassaram R$30.000 em vendas totais.")
-
-    # 2. Queda de 30% nas cidades
-    if 'total_por_cidade' in relatorio and 'variacao_cidade' in relatorio:
-        total_atual_cidade = relatorio['total_por_cidade']['Total']
-        variacao_cidade_abs = relatorio['variacao_cidade']['Total']
-        total_anterior_cidade = total_atual_cidade - variacao_cidade_abs
-        
-        valid_indices = total_anterior_cidade[total_anterior_cidade > 0].index
-        
-        if not valid_indices.empty:
-            variacao_percentual_cidade = (variacao_cidade_abs.loc[valid_indices] / total_anterior_cidade.loc[valid_indices]) * 100
-            cidades_queda = variacao_percentual_cidade[variacao_percentual_cidade < -30]
-            if not cidades_queda.empty:
-                cidades_str = ", ".join(cidades_queda.index)
-                alertas_negativos.append(f"As cidades **{cidades_str}** tiveram uma queda superior a 30% nas vendas.")
-
-    # 3. Aumento de Pix > 30%
-    if 'total_por_payment' in relatorio and 'variacao_payment' in relatorio:
-        if "Pix" in relatorio['total_por_payment'].index:
-            total_pix = relatorio['total_por_payment'].loc["Pix", "Total"]
-            if "Pix" in relatorio['variacao_payment'].index:
-                variacao_pix = relatorio['variacao_payment'].loc["Pix", "Total"]
-            else:
-                variacao_pix = 0
-                
-            if pd.notna(variacao_pix):
-                total_anterior_pix = total_pix - variacao_pix
-                if total_anterior_pix > 0:
-                    variacao_perc = (variacao_pix / total_anterior_pix) * 100
-                    if variacao_perc > 30:
-                        alertas_positivos.append(f"O método de pagamento **Pix** apresentou um aumento superior a 30% ({variacao_perc:.1f}%) nas vendas.")
-
-    # 4. Produtos > 400 vendas
-    if 'total_por_linha_produto' in relatorio:
-        produtos_acima_400 = relatorio['total_por_linha_produto'][relatorio['total_por_linha_produto']['Quantity'] > 400]
-        if not produtos_acima_400.empty:
-            produtos_str = ", ".join(produtos_acima_400.index)
-            alertas_positivos.append(f"Os produtos **{produtos_str}** tiveram mais de 400 vendas.")
-            
-    return {
-        "alertas_positivos": alertas_positivos,
-        "alertas_negativos": alertas_negativos,
-        "total_alertas": len(alertas_positivos) + len(alertas_negativos)
-    }
-
-def relatorio_por_dia_com_variacoes(dia, data_df):
-    if isinstance(dia, (pd.Timestamp, datetime.datetime)):
-        dia_date = dia.date()
-    else:
-        dia_date = dia
-
-    dia_timestamp = pd.to_datetime(dia_date)
-    dia_anterior_timestamp = dia_timestamp - pd.Timedelta(days=1)
-
-    df_dia = data_df[data_df['Data'].dt.date == dia_date].copy()
-    df_dia_anterior = data_df[data_df['Data'].dt.date == dia_anterior_timestamp.date()].copy()
-
-    if df_dia.empty:
-        return {}
-    
-    # Limpeza básica
-    for col in ['City', 'Customer type', 'Gender', 'Product line', 'Payment']:
-        if col in df_dia.columns:
-            df_dia = df_dia[~df_dia[col].astype(str).str.lower().isin(['total', 'quantity'])]
-        if col in df_dia_anterior.columns:
-            df_dia_anterior = df_dia_anterior[~df_dia_anterior[col].astype(str).str.lower().isin(['total', 'quantity'])]
-
-    if df_dia.empty:
-        return {}
-
-    is_first_day_with_data = df_dia_anterior.empty and not df_dia.empty
-
-    # --- HELPERS INTERNOS ---
-    def calcular_totais_e_variacao(df_atual, df_anterior, coluna_agrupadora):
-        total_atual = df_atual.groupby(coluna_agrupadora)[['Total', 'Quantity']].sum()
-        if is_first_day_with_data:
-            variacao = total_atual.copy()
-            variacao[:] = pd.NA 
-            return total_atual, variacao
-        else:
-            total_anterior = df_anterior.groupby(coluna_agrupadora)[['Total', 'Quantity']].sum()
-            base_index = total_atual.index.union(total_anterior.index)
-            total_atual_reindex = total_atual.reindex(base_index, fill_value=0)
-            total_anterior_reindex = total_anterior.reindex(base_index, fill_value=0)
-            variacao = total_atual_reindex - total_anterior_reindex
-            return total_atual_reindex, variacao
-
-    def calcular_crosstab_e_variacao(df_atual, df_anterior, index_cols, col_cols):
-        atual = df_atual.groupby(index_cols)[col_cols].value_counts().unstack(fill_value=0)
-        if is_first_day_with_data:
-            variacao = atual.applymap(lambda x: pd.NA)
-            return atual, variacao
-        else:
-            anterior = df_anterior.groupby(index_cols)[col_cols].value_counts().unstack(fill_value=0)
-            idx = atual.index.union(anterior.index)
-            cols = atual.columns.union(anterior.columns)
-            atual_reindex = atual.reindex(index=idx, columns=cols, fill_value=0)
-            anterior_reindex = anterior.reindex(index=idx, columns=cols, fill_value=0)
-            variacao = atual_reindex - anterior_reindex
-            return atual, variacao
-            
-    def calcular_media_e_variacao(df_atual, df_anterior, coluna_agrupadora, coluna_valor, nome_metrica):
-        media_atual = df_atual.groupby(coluna_agrupadora)[[coluna_valor]].mean()
-        media_atual.columns = [nome_metrica]
-        if is_first_day_with_data:
-            variacao = media_atual.copy()
-            variacao[:] = pd.NA
-            return media_atual, variacao
-        else:
-            media_anterior = df_anterior.groupby(coluna_agrupadora)[[coluna_valor]].mean()
-            media_anterior.columns = [nome_metrica]
-            base_index = media_atual.index.union(media_anterior.index)
-            media_atual_reindex = media_atual.reindex(base_index, fill_value=0)
-            media_anterior_reindex = media_anterior.reindex(base_index, fill_value=0)
-            variacao = media_atual_reindex - media_anterior_reindex
-            return media_atual_reindex, variacao
-
-    def extrair_hora_e_agrupar(df_in):
-        if df_in.empty: return pd.DataFrame()
-        df_temp = df_in.copy()
-        df_temp['Hora'] = df_temp['Time'].astype(str).str.split(':').str[0].astype(int)
-        return df_temp.groupby('Hora')[['Total']].sum()
-
-    # --- CÁLCULOS ---
-    total_por_cidade, variacao_cidade = calcular_totais_e_variacao(df_dia, df_dia_anterior, 'City')
-    total_por_tipo_cliente, variacao_tipo_cliente = calcular_totais_e_variacao(df_dia, df_dia_anterior, 'Customer type')
-    total_por_genero, variacao_genero = calcular_totais_e_variacao(df_dia, df_dia_anterior, 'Gender')
-    total_por_linha_produto, variacao_linha_produto = calcular_totais_e_variacao(df_dia, df_dia_anterior, 'Product line')
-    total_por_payment, variacao_payment = calcular_totais_e_variacao(df_dia, df_dia_anterior, 'Payment')
-
-    crosstab_cidade_tipo_cliente, variacao_cidade_tipo_cliente = calcular_crosstab_e_variacao(df_dia, df_dia_anterior, 'City', 'Customer type')
-    crosstab_cidade_genero, variacao_cidade_genero = calcular_crosstab_e_variacao(df_dia, df_dia_anterior, ['City', 'Gender'], 'Customer type')
-    crosstab_cidade_product, variacao_cidade_product = calcular_crosstab_e_variacao(df_dia, df_dia_anterior, 'City', 'Product line')
-    crosstab_cidade_payment, variacao_cidade_payment = calcular_crosstab_e_variacao(df_dia, df_dia_anterior, ['City', 'Payment'], 'Gender')
-
-    ticket_medio_cidade, var_ticket_medio_cidade = calcular_media_e_variacao(df_dia, df_dia_anterior, 'City', 'Total', 'Ticket Médio')
-    
-    vendas_hora_atual = extrair_hora_e_agrupar(df_dia)
-    if is_first_day_with_data:
-         var_vendas_hora = vendas_hora_atual.copy()
-         var_vendas_hora[:] = pd.NA
-    else:
-         vendas_hora_anterior = extrair_hora_e_agrupar(df_dia_anterior)
-         idx_h = vendas_hora_atual.index.union(vendas_hora_anterior.index)
-         atual_h = vendas_hora_atual.reindex(idx_h, fill_value=0)
-         ant_h = vendas_hora_anterior.reindex(idx_h, fill_value=0)
-         vendas_hora_atual = atual_h
-         var_vendas_hora = atual_h - ant_h
-
-    rating_produto, var_rating_produto = calcular_media_e_variacao(df_dia, df_dia_anterior, 'Product line', 'Rating', 'Média Rating')
-    rating_pagamento, var_rating_pagamento = calcular_media_e_variacao(df_dia, df_dia_anterior, 'Payment', 'Rating', 'Média Rating')
-
-    return {
-        "total_por_cidade": total_por_cidade, "variacao_cidade": variacao_cidade,
-        "total_por_tipo_cliente": total_por_tipo_cliente, "variacao_tipo_cliente": variacao_tipo_cliente,
-        "total_por_genero": total_por_genero, "variacao_genero": variacao_genero,
-        "total_por_linha_produto": total_por_linha_produto, "variacao_linha_produto": variacao_linha_produto,
-        "total_por_payment": total_por_payment, "variacao_payment": variacao_payment,
-        "crosstab_cidade_tipo_cliente": crosstab_cidade_tipo_cliente, "variacao_cidade_tipo_cliente": variacao_cidade_tipo_cliente,
-        "crosstab_cidade_genero": crosstab_cidade_genero, "variacao_cidade_genero": variacao_cidade_genero,
-        "crosstab_cidade_product": crosstab_cidade_product, "variacao_cidade_product": variacao_cidade_product,
-        "crosstab_cidade_payment": crosstab_cidade_payment, "variacao_cidade_payment": variacao_cidade_payment,
-        "ticket_medio_cidade": ticket_medio_cidade, "var_ticket_medio_cidade": var_ticket_medio_cidade,
-        "vendas_por_hora": vendas_hora_atual, "var_vendas_por_hora": var_vendas_hora,
-        "rating_produto": rating_produto, "var_rating_produto": var_rating_produto,
-        "rating_pagamento": rating_pagamento, "var_rating_pagamento": var_rating_pagamento
-    }
+        st.error(f"Erro ao salvar dados: {e}")
+        return None
 
 # -------------------------------------------------------------
 # CARREGAMENTO DE DADOS
 # -------------------------------------------------------------
-df = load_data_from_gsheets()
+estado = carregar_dados()
+df, versao_dados, indice_dias, cubo = estado
+
+@st.cache_resource
+def obter_cache_api():
+    return CacheLRU(max_itens=512, nome="api")
 
 # =================================================================
 # BLOCO DE API: INTERCEPTA O n8n E DEVOLVE DATA + VARIAÇÃO + ALERTAS
 # =================================================================
 
-if "request_type" in st.query_params:
-    request_type = st.query_params.get("request_type")
-    target_date = st.query_params.get("target_date")
-    report_name = st.query_params.get("report_name")
-
-    # ---------------------------------------------------------
-    # ROTA 1: BUSCAR RELATÓRIOS (TABELAS)
-    # ---------------------------------------------------------
-    if request_type == "get_report" and target_date and report_name:
-        relatorio_api = relatorio_por_dia_com_variacoes(pd.to_datetime(target_date), df)
-        
-        if not relatorio_api:
-            st.json({"erro": "Nenhum dado encontrado para a data informada."})
-            st.stop()
-
-        mapping = {
-            "total_por_cidade": ("total_por_cidade", "variacao_cidade", "sum"),
-            "total_por_linha_produto": ("total_por_linha_produto", "variacao_linha_produto", "sum"),
-            "total_por_tipo_cliente": ("total_por_tipo_cliente", "variacao_tipo_cliente", "sum"),
-            "total_por_payment": ("total_por_payment", "variacao_payment", "sum"),
-            "total_por_genero": ("total_por_genero", "variacao_genero", "sum"),
-            "vendas_por_hora": ("vendas_por_hora", "var_vendas_por_hora", "sum"),
-            "distribuicao_cidade_tipo": ("crosstab_cidade_tipo_cliente", "variacao_cidade_tipo_cliente", "cross"),
-            "distribuicao_cidade_genero_tipo": ("crosstab_cidade_genero", "variacao_cidade_genero", "cross"),
-            "ticket_medio_cidade": ("ticket_medio_cidade", "var_ticket_medio_cidade", "metric"),
-            "rating_produto": ("rating_produto", "var_rating_produto", "metric"),
-            "rating_pagamento": ("rating_pagamento", "var_rating_pagamento", "metric")
-        }
+if st.query_params.get("request_type") == "metrics":
+    # Mesmo conteúdo do /metrics do servidor_api.py (formato texto do Prometheus)
+    st.text(metricas.texto_prometheus())
+    st.stop()
 
-        if report_name in mapping:
-            key_data, key_var, report_type = mapping[report_name]
-            df_main = relatorio_api[key_data]
-            df_var = relatorio_api[key_var]
-
-            if report_type == "sum":
-                df_final = pd.concat([df_main, df_var.rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-            elif report_type == "metric":
-                df_final = pd.concat([df_main, df_var.add_prefix("Var. ")], axis=1)
-            else: # cross
-                df_final = pd.concat([df_main, df_var.add_suffix(" (Var)")], axis=1).fillna(0)
-
-            # Normalização (Arredondamento)
-            if report_type == "sum":
-                cols_money = [c for c in df_final.columns if "Total" in c]
-                df_final[cols_money] = df_final[cols_money].round(2)
-                cols_qty = [c for c in df_final.columns if "Quantity" in c]
-                df_final[cols_qty] = df_final[cols_qty].fillna(0).astype(int)
-            elif report_type == "metric":
-                is_rating = any("Rating" in c for c in df_final.columns)
-                decimals = 1 if is_rating else 2
-                df_final = df_final.round(decimals)
-            else:
-                df_final = df_final.fillna(0).astype(int)
-
-            st.json(df_final.fillna(0).reset_index().to_dict(orient="records"))
-            st.stop()
+if "request_type" in st.query_params:
+    # Mesmas rotas do servidor_api.py; resultados em cache por (versão dos dados, data, relatório)
+    # A API filtra pelo parâmetro fonte, não pela seleção da barra lateral
+    # No estado agregado (tipo = "sqlite") o cubo de cada fonte sai do banco, como no filtro da barra lateral
+    cubo_fonte = (lambda fonte: obter_armazenamento().cubo(fonte=fonte)) if obter_armazenamento().agrega_no_banco else None
+    resposta = resposta_api(st.query_params.to_dict(), estado.df, estado.versao, estado.indice_dias, estado.cubo, obter_cache_api(),
+                            cubo_fonte)
+    if isinstance(resposta, RespostaBinaria):
+        # O Streamlit não devolve o corpo cru: CSV/JSON vão como texto e Arrow como download
+        if resposta.tipo.startswith("application/vnd.apache.arrow"):
+            st.download_button("Baixar relatório (Arrow)", resposta.corpo, file_name=f"{st.query_params.get('report_name')}.arrow", mime=resposta.tipo)
         else:
-            st.json({"erro": f"Relatório '{report_name}' não encontrado no mapeamento."})
-            st.stop()
-
-    # ---------------------------------------------------------
-    # ROTA 2: BUSCAR ALERTAS
-    # ---------------------------------------------------------
-    elif request_type == "get_alerts" and target_date:
-        relatorio_api = relatorio_por_dia_com_variacoes(pd.to_datetime(target_date), df)
-        
-        if not relatorio_api:
-            st.json({"alertas_positivos": [], "alertas_negativos": [], "total_alertas": 0, "status": "sem_dados"})
-            st.stop()
-
-        resultado_alertas = calcular_alertas_dia(relatorio_api)
-        st.json(resultado_alertas)
+            st.text(resposta.corpo.decode("utf-8"))
+        st.stop()
+    if resposta is not None:
+        st.json(resposta)
         st.stop()
 
 # =================================================================
 
+# O plotly só é importado daqui para baixo: as chamadas da API acima não desenham gráficos
+import plotly.express as px
+
+# Daqui para baixo só o dashboard: filtro por fonte, tabela de alertas e cache/pré-carga de relatórios
+
+# Várias abas/planilhas ([gsheets] fontes): a barra lateral filtra relatórios e alertas por fonte
+fontes_disponiveis = list(cubo["fonte"].index.get_level_values('Fonte').categories) if "fonte" in cubo else []
+fonte_selecionada = st.session_state.get("fonte_selecionada", "Todas")
+
+@st.cache_resource(max_entries=8)
+def obter_dados_da_fonte(versao, fonte, _data_df):
+    if _data_df is None:
+        # Estado agregado (SQLite): o cubo da fonte também sai do banco
+        return None, None, obter_armazenamento().cubo(fonte=fonte)
+    df_fonte = _data_df[(_data_df['Fonte'] == fonte).to_numpy()].reset_index(drop=True)
+    return df_fonte, construir_indice_dias(df_fonte), cubo_da_fonte(_data_df, fonte)
+
+if fonte_selecionada in fontes_disponiveis:
+    df, indice_dias, cubo = obter_dados_da_fonte(estado.versao, fonte_selecionada, estado.df)
+    versao_dados = (estado.versao, fonte_selecionada)
+
+# Regras avaliadas em todo o histórico de uma vez (a mesma tabela da rota get_alerts, no cache da API);
+# trocar de dia só consulta a tabela
+tabela_alertas = tabela_alertas_em_cache(obter_cache_api(), versao_dados, cubo)
+
+@st.cache_resource
+def obter_cache_relatorios():
+    # Relatórios completos por (versão dos dados, dia), com orçamento de memória; o pré-carregador
+    # calcula em segundo plano os dias vizinhos e os mais recentes
+    max_mb = config.get("cache_relatorios_mb", 256)
+    cache = CacheLRU(max_itens=1000, max_bytes=max_mb * 1024 * 1024, tamanho=tamanho_relatorio, nome="relatorios")
+    return cache, PreCarregador(cache)
+
+cache_relatorios, pre_carregador = obter_cache_relatorios()
+
+def calculo_relatorio(dia):
+    return (versao_dados, dia), lambda: relatorio_por_dia_com_variacoes(dia, df, indice_dias, cubo)
+
 
 # --- BARRA LATERAL (AÇÕES E SELEÇÃO) ---
 
@@ -402,14 +148,19 @@ st.sidebar.title("Menu de Ações")
 # Botão de Gerar Dados
 st.sidebar.markdown("### 📅 Simulação")
 if st.sidebar.button("Gerar Próximo Dia de Vendas", type="primary"):
-    with st.spinner("Gerando dados e salvando no Google Sheets..."):
-        novos_dados = gerar_dados_proximo_dia(df)
-        sucesso = salvar_dados_gsheets(novos_dados)
-        if sucesso:
+    with st.spinner("Gerando e salvando os dados..."):
+        # No estado agregado não há linhas em memória: o último dia sai do cubo
+        novos_dados = gerar_dados_proximo_dia(estado.df if estado.df is not None else estado.cubo["dia"].reset_index())
+        gravacao = salvar_dados(novos_dados, estado)
+        if gravacao is not None:
+            # Write-through: as linhas gravadas entram no frame, no índice de dias e no cubo em memória
+            # (e no snapshot/cubo em disco) sem reler a planilha; se ela mudou por fora, recarrega
+            obter_base_vendas().incorporar(estado.versao, gravacao)
             st.sidebar.success(f"Sucesso! Dia {novos_dados['Data'].dt.date.iloc[0]} gerado.")
-            st.cache_data.clear()
             st.rerun()
         else:
+            # A gravação pode ter ido em parte: recarrega para mostrar o que está no armazenamento
+            obter_base_vendas().invalidar()
             st.sidebar.error("Falha ao salvar os dados.")
 st.sidebar.markdown("---")
 
@@ -418,29 +169,36 @@ st.sidebar.markdown("---")
 
 st.title("Relatório Diário de Vendas com Alertas no Whatsapp")
 
-if df.empty or 'Data' not in df.columns:
-    st.info("O DataFrame está vazio ou a coluna 'Data' não foi encontrada. Verifique sua planilha.")
+if cubo["dia"].empty:
+    st.info("Não há vendas nos dados carregados. Verifique sua planilha.")
     st.stop()
 
-# Seleção do dia na Sidebar
-dias_unicos = df['Data'].dt.date.unique()
-dias_unicos_ordenados = sorted(dias_unicos, reverse=True)
+# Seleção do dia na Sidebar (dias com vendas, do cubo: vale também para o estado agregado, sem linhas)
+dias_unicos_ordenados = [dia.date() for dia in cubo["dia"].index[::-1]]
 
 if not dias_unicos_ordenados:
     st.info("Não há datas válidas para seleção.")
     st.stop()
 
+if fontes_disponiveis:
+    st.sidebar.selectbox("Fonte (aba/planilha)", ["Todas", *fontes_disponiveis], key="fonte_selecionada")
 dia_selecionado = st.sidebar.selectbox("Selecione uma data para visualizar", dias_unicos_ordenados)
 primeiro_dia_disponivel = dias_unicos_ordenados[-1] 
 
-relatorio = relatorio_por_dia_com_variacoes(dia_selecionado, df)
+relatorio = cache_relatorios.obter(*calculo_relatorio(dia_selecionado))
+
+# Aquece os dias ao redor do selecionado (primeiro) e os mais recentes
+posicao = dias_unicos_ordenados.index(dia_selecionado)
+vizinhos = [dias_unicos_ordenados[i] for d in (1, 2, 3) for i in (posicao + d, posicao - d) if 0 <= i < len(dias_unicos_ordenados)]
+pre_carregador.agendar([calculo_relatorio(dia) for dia in vizinhos], prioritario=True)
+pre_carregador.agendar([calculo_relatorio(dia) for dia in dias_unicos_ordenados[:config.get("dias_pre_carregados", 14)]])
 
 if not relatorio:
     st.info(f"Não há dados de vendas para o dia {dia_selecionado}.")
     st.stop()
 
-# --- ALERTAS NA INTERFACE (Usando a mesma função da API) ---
-dict_alertas_ui = calcular_alertas_dia(relatorio)
+# --- ALERTAS NA INTERFACE (Usando a mesma tabela da API) ---
+dict_alertas_ui = alertas_do_dia(tabela_alertas, dia_selecionado)
 alertas_positivos = dict_alertas_ui["alertas_positivos"]
 alertas_negativos = dict_alertas_ui["alertas_negativos"]
 total_alertas = dict_alertas_ui["total_alertas"]
@@ -460,6 +218,11 @@ with st.expander("Alertas Importantes", expanded=True if total_alertas > 0 else
     if total_alertas == 0:
         st.info("Nenhum alerta foi gerado para o dia selecionado.")
 
+if metricas.ativo():
+    with st.sidebar.expander("⏱️ Desempenho"):
+        st.dataframe(pd.DataFrame(metricas.resumo_etapas()), hide_index=True, use_container_width=True)
+        st.dataframe(pd.DataFrame(metricas.resumo_contadores()), hide_index=True, use_container_width=True)
+
 st.subheader(f"Relatório Detalhado de Vendas para o dia {dia_selecionado}")
 st.markdown("---")
 
@@ -511,74 +274,96 @@ def plot_generic(df_main, df_var, id_col, val_col, title, color_main='rgb(50, 16
     fig.add_hline(y=0, line_dash="dash", line_color="gray")
     return fig
 
+def plot_vendas_por_hora(df_main, df_var):
+    fig = plot_generic(df_main, df_var, 'Hora', 'Total', "Vendas Totais por Hora do Dia", color_main='#00CC99', color_var='#009973')
+    fig.update_xaxes(dtick=1)
+    return fig
+
+def concat_totais(chave, chave_var):
+    return pd.concat([relatorio[chave].round(2), relatorio[chave_var].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
+
+def concat_metrica(chave, chave_var, col_name):
+    return pd.concat([relatorio[chave], relatorio[chave_var].rename(columns={col_name: f"Var. {col_name}"})], axis=1)
+
+# Tabelas e figuras ficam em cache por (versão dos dados, dia, componente): um rerun com a mesma
+# seleção não refaz concat/melt nem monta figuras de novo. O st.cache_data entrega uma cópia a cada
+# sessão (nada mutável é compartilhado); o Styler, barato, é montado a cada renderização
+
+@st.cache_data(max_entries=300)
+def componente_em_cache(versao, dia, id_componente, _construir):
+    return _construir()
+
+def mostrar_tabela(id_tabela, construir, estilo=None):
+    tabela = componente_em_cache(versao_dados, dia_selecionado, id_tabela, construir)
+    st.dataframe(tabela if estilo is None else estilo(tabela), use_container_width=True)
+
+def mostrar_grafico(titulo, id_grafico, construir):
+    # A figura só é montada quando a seção é aberta
+    if st.toggle(titulo, key=f"grafico_{id_grafico}"):
+        st.plotly_chart(componente_em_cache(versao_dados, dia_selecionado, id_grafico, construir), use_container_width=True)
+
+if 'total_por_fonte' in relatorio and fonte_selecionada not in fontes_disponiveis:
+    st.markdown("##### Total de Vendas por Fonte e Variação:")
+    mostrar_tabela("tabela_fonte", lambda: concat_totais('total_por_fonte', 'variacao_fonte'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Fonte", "grafico_fonte",
+                    lambda: plot_total_and_variation(relatorio['total_por_fonte'], relatorio['variacao_fonte'], 'Fonte', "Métricas por Fonte"))
+
 # --- DISTRIBUIÇÃO DAS COLUNAS ---
 col1, col2 = st.columns(2)
 
 with col1:
     st.markdown("##### Total de Vendas por Cidade e Variação:")
-    df_cidade_concat = pd.concat([relatorio['total_por_cidade'].round(2), relatorio['variacao_cidade'].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-    st.dataframe(style_dataframe(df_cidade_concat), use_container_width=True)
-    with st.expander("📊 Gráfico: Vendas por Cidade"):
-        st.plotly_chart(plot_total_and_variation(relatorio['total_por_cidade'], relatorio['variacao_cidade'], 'City', "Métricas por Cidade"), use_container_width=True)
+    mostrar_tabela("tabela_cidade", lambda: concat_totais('total_por_cidade', 'variacao_cidade'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Cidade", "grafico_cidade",
+                    lambda: plot_total_and_variation(relatorio['total_por_cidade'], relatorio['variacao_cidade'], 'City', "Métricas por Cidade"))
 
     st.markdown("##### Total de vendas por Tipo de Cliente:")
-    df_cliente_concat = pd.concat([relatorio['total_por_tipo_cliente'].round(2), relatorio['variacao_tipo_cliente'].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-    st.dataframe(style_dataframe(df_cliente_concat), use_container_width=True)
-    with st.expander("📊 Gráfico: Vendas por Tipo de Cliente"):
-        st.plotly_chart(plot_total_and_variation(relatorio['total_por_tipo_cliente'], relatorio['variacao_tipo_cliente'], 'Customer type', "Métricas por Tipo"), use_container_width=True)
+    mostrar_tabela("tabela_tipo_cliente", lambda: concat_totais('total_por_tipo_cliente', 'variacao_tipo_cliente'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Tipo de Cliente", "grafico_tipo_cliente",
+                    lambda: plot_total_and_variation(relatorio['total_por_tipo_cliente'], relatorio['variacao_tipo_cliente'], 'Customer type', "Métricas por Tipo"))
 
     st.markdown("##### Total de vendas por Gênero:")
-    df_genero_concat = pd.concat([relatorio['total_por_genero'].round(2), relatorio['variacao_genero'].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-    st.dataframe(style_dataframe(df_genero_concat), use_container_width=True)
-    with st.expander("📊 Gráfico: Vendas por Gênero"):
-        st.plotly_chart(plot_total_and_variation(relatorio['total_por_genero'], relatorio['variacao_genero'], 'Gender', "Métricas por Gênero"), use_container_width=True)
+    mostrar_tabela("tabela_genero", lambda: concat_totais('total_por_genero', 'variacao_genero'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Gênero", "grafico_genero",
+                    lambda: plot_total_and_variation(relatorio['total_por_genero'], relatorio['variacao_genero'], 'Gender', "Métricas por Gênero"))
 
     st.markdown("---")
     
     st.markdown("##### 💵 Ticket Médio por Cidade")
-    df_ticket = pd.concat([relatorio['ticket_medio_cidade'], relatorio['var_ticket_medio_cidade'].rename(columns={'Ticket Médio': 'Var. Ticket Médio'})], axis=1)
-    st.dataframe(style_generic(df_ticket, "Ticket Médio", "R${:.2f}"), use_container_width=True)
-    with st.expander("📊 Gráfico: Ticket Médio por Cidade"):
-        st.plotly_chart(plot_generic(relatorio['ticket_medio_cidade'], relatorio['var_ticket_medio_cidade'], 'City', 'Ticket Médio', "Ticket Médio por Cidade", color_main='#FF9900', color_var='#CC7A00'), use_container_width=True)
+    mostrar_tabela("tabela_ticket", lambda: concat_metrica('ticket_medio_cidade', 'var_ticket_medio_cidade', 'Ticket Médio'), lambda tabela: style_generic(tabela, "Ticket Médio", "R${:.2f}"))
+    mostrar_grafico("📊 Gráfico: Ticket Médio por Cidade", "grafico_ticket",
+                    lambda: plot_generic(relatorio['ticket_medio_cidade'], relatorio['var_ticket_medio_cidade'], 'City', 'Ticket Médio', "Ticket Médio por Cidade", color_main='#FF9900', color_var='#CC7A00'))
 
     st.markdown("##### ⭐ Qualidade e Satisfação")
-    df_rating_prod = pd.concat([relatorio['rating_produto'], relatorio['var_rating_produto'].rename(columns={'Média Rating': 'Var. Média Rating'})], axis=1)
-    st.dataframe(style_generic(df_rating_prod, "Média Rating", "{:.1f}"), use_container_width=True)
-    with st.expander("📊 Gráfico: Rating por Produto"):
-        st.plotly_chart(plot_generic(relatorio['rating_produto'], relatorio['var_rating_produto'], 'Product line', 'Média Rating', "Média de Avaliação por Produto", color_main='#9900FF', color_var='#7A00CC'), use_container_width=True)
+    mostrar_tabela("tabela_rating_produto", lambda: concat_metrica('rating_produto', 'var_rating_produto', 'Média Rating'), lambda tabela: style_generic(tabela, "Média Rating", "{:.1f}"))
+    mostrar_grafico("📊 Gráfico: Rating por Produto", "grafico_rating_produto",
+                    lambda: plot_generic(relatorio['rating_produto'], relatorio['var_rating_produto'], 'Product line', 'Média Rating', "Média de Avaliação por Produto", color_main='#9900FF', color_var='#7A00CC'))
 
 with col2:
     st.markdown("##### Total de vendas por Linha de Produto:")
-    df_produto_concat = pd.concat([relatorio['total_por_linha_produto'].round(2), relatorio['variacao_linha_produto'].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-    st.dataframe(style_dataframe(df_produto_concat), use_container_width=True)
-    with st.expander("📊 Gráfico: Vendas por Produto"):
-        st.plotly_chart(plot_total_and_variation(relatorio['total_por_linha_produto'], relatorio['variacao_linha_produto'], 'Product line', "Métricas por Linha de Produto"), use_container_width=True)
+    mostrar_tabela("tabela_linha_produto", lambda: concat_totais('total_por_linha_produto', 'variacao_linha_produto'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Produto", "grafico_linha_produto",
+                    lambda: plot_total_and_variation(relatorio['total_por_linha_produto'], relatorio['variacao_linha_produto'], 'Product line', "Métricas por Linha de Produto"))
 
     st.markdown("##### Total de vendas por Método de Pagamento:")
-    df_payment_concat = pd.concat([relatorio['total_por_payment'].round(2), relatorio['variacao_payment'].round(2).rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
-    st.dataframe(style_dataframe(df_payment_concat), use_container_width=True)
-    with st.expander("📊 Gráfico: Vendas por Pagamento"):
-        st.plotly_chart(plot_total_and_variation(relatorio['total_por_payment'], relatorio['variacao_payment'], 'Payment', "Métricas por Pagamento"), use_container_width=True)
+    mostrar_tabela("tabela_payment", lambda: concat_totais('total_por_payment', 'variacao_payment'), style_dataframe)
+    mostrar_grafico("📊 Gráfico: Vendas por Pagamento", "grafico_payment",
+                    lambda: plot_total_and_variation(relatorio['total_por_payment'], relatorio['variacao_payment'], 'Payment', "Métricas por Pagamento"))
 
     st.markdown("##### Distribuição: Clientes por Cidade e Tipo:")
-    st.dataframe(pd.concat([relatorio["crosstab_cidade_tipo_cliente"], relatorio["variacao_cidade_tipo_cliente"].add_suffix(" (Var)")], axis=1).fillna(0).astype(int), use_container_width=True)
-    with st.expander("📊 Gráfico: Distribuição Cruzada"):
-        df_plot = relatorio["crosstab_cidade_tipo_cliente"].reset_index().melt(id_vars="City")
-        st.plotly_chart(px.bar(df_plot, x="City", y="value", color="Customer type", barmode="group", title="Distribuição de Clientes", labels={'value': 'Clientes'}), use_container_width=True)
+    mostrar_tabela("tabela_cidade_tipo", lambda: pd.concat([relatorio["crosstab_cidade_tipo_cliente"], relatorio["variacao_cidade_tipo_cliente"].add_suffix(" (Var)")], axis=1).fillna(0).astype(int))
+    mostrar_grafico("📊 Gráfico: Distribuição Cruzada", "grafico_cidade_tipo",
+                    lambda: px.bar(relatorio["crosstab_cidade_tipo_cliente"].reset_index().melt(id_vars="City"), x="City", y="value", color="Customer type", barmode="group", title="Distribuição de Clientes", labels={'value': 'Clientes'}))
     
     st.markdown("---")
     st.markdown("#### ⏳ Análise Temporal e Eficiência")
 
     st.markdown("##### ⏰ Análise Temporal por Hora")
-    df_hora = pd.concat([relatorio['vendas_por_hora'], relatorio['var_vendas_por_hora'].rename(columns={'Total': 'Var. Total'})], axis=1)
-    st.dataframe(style_generic(df_hora, "Total", "R${:.2f}"), use_container_width=True)
-    with st.expander("📊 Gráfico: Horários de Pico"):
-        fig_hora = plot_generic(relatorio['vendas_por_hora'], relatorio['var_vendas_por_hora'], 'Hora', 'Total', "Vendas Totais por Hora do Dia", color_main='#00CC99', color_var='#009973')
-        fig_hora.update_xaxes(dtick=1)
-        st.plotly_chart(fig_hora, use_container_width=True)
+    mostrar_tabela("tabela_hora", lambda: concat_metrica('vendas_por_hora', 'var_vendas_por_hora', 'Total'), lambda tabela: style_generic(tabela, "Total", "R${:.2f}"))
+    mostrar_grafico("📊 Gráfico: Horários de Pico", "grafico_hora",
+                    lambda: plot_vendas_por_hora(relatorio['vendas_por_hora'], relatorio['var_vendas_por_hora']))
 
     st.markdown("##### 💳 Eficiência de Pagamento (Rating por Método)")
-    df_rating_pay = pd.concat([relatorio['rating_pagamento'], relatorio['var_rating_pagamento'].rename(columns={'Média Rating': 'Var. Média Rating'})], axis=1)
-    st.dataframe(style_generic(df_rating_pay, "Média Rating", "{:.1f}"), use_container_width=True)
-    with st.expander("📊 Gráfico: Rating por Pagamento"):
-        st.plotly_chart(plot_generic(relatorio['rating_pagamento'], relatorio['var_rating_pagamento'], 'Payment', 'Média Rating', "Satisfação por Forma de Pagamento", color_main='#FF3366', color_var='#CC0033'), use_container_width=True)
+    mostrar_tabela("tabela_rating_pagamento", lambda: concat_metrica('rating_pagamento', 'var_rating_pagamento', 'Média Rating'), lambda tabela: style_generic(tabela, "Média Rating", "{:.1f}"))
+    mostrar_grafico("📊 Gráfico: Rating por Pagamento", "grafico_rating_pagamento",
+                    lambda: plot_generic(relatorio['rating_pagamento'], relatorio['var_rating_pagamento'], 'Payment', 'Média Rating', "Satisfação por Forma de Pagamento", color_main='#FF3366', color_var='#CC0033'))
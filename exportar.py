@@ -0,0 +1,221 @@
+"""
+Exporta todos os relatórios do mapeamento (os mesmos do get_report) e os alertas de cada dia do
+histórico, em partes por intervalo de dias calculadas em paralelo num pool de processos.
+
+O processo principal monta o cubo e a tabela de alertas uma vez e grava em Arrow IPC sem compressão;
+cada processo abre esses arquivos mapeados em memória e só converte para pandas as linhas dos seus
+dias (mais o dia anterior, para as variações), então o histórico não é copiado para os processos.
+Cada dia calcula o relatório completo uma vez e tira dele todas as tabelas do mapeamento.
+
+Saída com --formato jsonl:
+    <saida>/relatorios/parte-00000.jsonl   {"data": ..., "relatorio": ..., "linhas": [...]}
+    <saida>/alertas/parte-00000.jsonl      {"data": ..., "alertas_positivos": [...], ...}
+Saída com --formato parquet (partições no estilo Hive):
+    <saida>/relatorios/relatorio=total_por_cidade/parte-00000.parquet   (coluna Data + colunas do relatório)
+    <saida>/alertas/parte-00000.parquet
+
+Cada parte é gravada de forma atômica e registrada em <saida>/progresso.json: rodar de novo com os
+mesmos dados e parâmetros pula as partes prontas.
+
+Exemplos:
+    python exportar.py --secrets .streamlit/secrets.toml --saida export/
+    python exportar.py --sqlite .cache/vendas.db --saida export/ --formato parquet --processos 8
+    python exportar.py --sintetico 3650 --saida /tmp/export --dias-por-parte 60
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from base_dados import BaseVendas
+from relatorios import (
+    AGREGADOS_CUBO, MAPEAMENTO_RELATORIOS, alertas_do_dia, construir_tabela_alertas, relatorio_por_dia_com_variacoes,
+    tabela_relatorio_api,
+)
+from servidor_api import adicionar_argumentos_fonte, fonte_dos_argumentos
+
+FORMATOS_EXPORTACAO = ["jsonl", "parquet"]
+DIAS_POR_PARTE_PADRAO = 31
+PASTA_ENTRADA = "_entrada"  # dentro da pasta de saída, apagada no fim
+
+# Tabelas Arrow mapeadas em memória, abertas uma vez em cada processo do pool
+_entrada = {}
+
+
+def _gravar_atomico(caminho, gravar):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    gravar(caminho + ".tmp")
+    os.replace(caminho + ".tmp", caminho)
+
+
+def gravar_entrada(cubo, tabela_alertas, pasta):
+    """
+    Grava os agregados do cubo e a tabela de alertas em Arrow IPC sem compressão (legíveis com memory map).
+    """
+    tabelas = {**{f"cubo.{nome}": tabela for nome, tabela in cubo.items()}, "alertas": tabela_alertas}
+    for nome, tabela in tabelas.items():
+        _gravar_atomico(os.path.join(pasta, f"{nome}.arrow"),
+                        lambda caminho: feather.write_feather(tabela.reset_index(), caminho, compression="uncompressed"))
+    return list(tabelas)
+
+
+def _abrir_entrada(pasta, nomes):
+    for nome in nomes:
+        _entrada[nome] = feather.read_table(os.path.join(pasta, f"{nome}.arrow"), memory_map=True)
+
+
+def _fatia(nome, inicio, fim):
+    # slice() sobre a tabela mapeada não copia nada; só a fatia vira pandas
+    return _entrada[nome].slice(inicio, fim - inicio).to_pandas()
+
+
+def _limites(tabela, inicio, fim):
+    # As tabelas do cubo e a de alertas estão ordenadas por 'Data'
+    datas = tabela.index.get_level_values('Data')
+    return int(datas.searchsorted(inicio, side='left')), int(datas.searchsorted(fim, side='right'))
+
+
+def _linhas_jsonl(registros):
+    return "".join(json.dumps(registro, ensure_ascii=False, default=str) + "\n" for registro in registros)
+
+
+def _gravar_jsonl(caminho, registros):
+    def gravar(temporario):
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(_linhas_jsonl(registros))
+    _gravar_atomico(caminho, gravar)
+
+
+def exportar_parte(indice, dias, limites, saida, formato):
+    """
+    Calcula e grava os relatórios e alertas dos `dias` de uma parte (executada num processo do pool).
+    `limites` traz, por tabela de entrada, o intervalo de linhas [início, fim) que cobre a parte.
+    Retorna (índice da parte, quantidade de dias, quantidade de tabelas de relatório gravadas).
+    """
+    cubo = {}
+    for nome, colunas in AGREGADOS_CUBO.items():
+        if f"cubo.{nome}" in limites:
+            cubo[nome] = _fatia(f"cubo.{nome}", *limites[f"cubo.{nome}"]).set_index(['Data'] + colunas)
+    tabela_alertas = _fatia("alertas", *limites["alertas"]).set_index('Data')
+
+    relatorios, alertas = {}, []
+    for dia in dias:
+        relatorio = relatorio_por_dia_com_variacoes(dia, None, cubo=cubo)
+        for report_name, (key_data, key_var, report_type) in MAPEAMENTO_RELATORIOS.items():
+            if key_data in relatorio:
+                tabela = tabela_relatorio_api(relatorio[key_data], relatorio[key_var], report_type)
+                relatorios.setdefault(report_name, []).append((dia, tabela))
+        alertas.append({"data": dia, **alertas_do_dia(tabela_alertas, dia)})
+
+    arquivo = f"parte-{indice:05d}"
+    if formato == "jsonl":
+        _gravar_jsonl(os.path.join(saida, "relatorios", f"{arquivo}.jsonl"), (
+            {"data": dia, "relatorio": report_name, "linhas": tabela.to_dict(orient="records")}
+            for report_name, tabelas in relatorios.items() for dia, tabela in tabelas
+        ))
+        _gravar_jsonl(os.path.join(saida, "alertas", f"{arquivo}.jsonl"), alertas)
+    else:
+        for report_name, tabelas in relatorios.items():
+            tabela = pd.concat([t.assign(Data=pd.Timestamp(dia)) for dia, t in tabelas], ignore_index=True)
+            tabela = tabela[['Data', *[c for c in tabela.columns if c != 'Data']]]
+            tabela.columns = [str(c) for c in tabela.columns]
+            _gravar_atomico(os.path.join(saida, "relatorios", f"relatorio={report_name}", f"{arquivo}.parquet"),
+                            lambda caminho: tabela.to_parquet(caminho, index=False))
+        tabela_dias = pd.DataFrame(alertas).assign(data=lambda t: pd.to_datetime(t["data"])).rename(columns={"data": "Data"})
+        _gravar_atomico(os.path.join(saida, "alertas", f"{arquivo}.parquet"),
+                        lambda caminho: tabela_dias.to_parquet(caminho, index=False))
+
+    return indice, len(dias), sum(len(tabelas) for tabelas in relatorios.values())
+
+
+def _ler_progresso(saida):
+    try:
+        with open(os.path.join(saida, "progresso.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_progresso(saida, progresso):
+    def gravar(temporario):
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(progresso, f, ensure_ascii=False)
+    _gravar_atomico(os.path.join(saida, "progresso.json"), gravar)
+
+
+def exportar(cubo, versao, saida, formato="jsonl", processos=None, dias_por_parte=DIAS_POR_PARTE_PADRAO, tabela_alertas=None):
+    """
+    Exporta relatórios e alertas de todos os dias do cubo para `saida`, retomando de progresso.json
+    quando a versão dos dados e os parâmetros são os mesmos. Retorna um resumo da execução.
+    """
+    dias = [dia.date() for dia in cubo["dia"].index]
+    partes = [dias[i:i + dias_por_parte] for i in range(0, len(dias), dias_por_parte)]
+
+    chave = {"versao": versao, "formato": formato, "dias_por_parte": dias_por_parte, "partes": len(partes)}
+    progresso = _ler_progresso(saida)
+    if {k: progresso.get(k) for k in chave} != chave:
+        # Outros dados ou parâmetros: as partes antigas não valem mais
+        for pasta in ("relatorios", "alertas"):
+            shutil.rmtree(os.path.join(saida, pasta), ignore_errors=True)
+        progresso = {**chave, "concluidas": []}
+    concluidas = set(progresso["concluidas"])
+    pendentes = [indice for indice in range(len(partes)) if indice not in concluidas]
+
+    inicio_relogio = time.monotonic()
+    if pendentes:
+        if tabela_alertas is None:
+            tabela_alertas = construir_tabela_alertas(cubo)
+        pasta_entrada = os.path.join(saida, PASTA_ENTRADA)
+        nomes = gravar_entrada(cubo, tabela_alertas, pasta_entrada)
+
+        def limites(parte):
+            # O dia anterior ao primeiro entra para as variações
+            inicio, fim = pd.Timestamp(parte[0]) - pd.Timedelta(days=1), pd.Timestamp(parte[-1])
+            return {**{f"cubo.{nome}": _limites(tabela, inicio, fim) for nome, tabela in cubo.items()},
+                    "alertas": _limites(tabela_alertas, pd.Timestamp(parte[0]), fim)}
+
+        try:
+            with ProcessPoolExecutor(max_workers=processos, initializer=_abrir_entrada, initargs=(pasta_entrada, nomes)) as pool:
+                futuros = [pool.submit(exportar_parte, indice, partes[indice], limites(partes[indice]), saida, formato)
+                           for indice in pendentes]
+                for futuro in as_completed(futuros):
+                    indice, quantidade_dias, _ = futuro.result()
+                    concluidas.add(indice)
+                    _gravar_progresso(saida, {**progresso, "concluidas": sorted(concluidas)})
+                    print(f"parte {indice:05d}: {quantidade_dias} dias ({len(concluidas)}/{len(partes)})")
+        finally:
+            shutil.rmtree(pasta_entrada, ignore_errors=True)
+
+    return {
+        "dias": len(dias), "partes": len(partes), "exportadas": len(pendentes),
+        "retomadas": len(partes) - len(pendentes), "segundos": round(time.monotonic() - inicio_relogio, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta relatórios e alertas de todos os dias do histórico.")
+    adicionar_argumentos_fonte(parser)
+    parser.add_argument("--saida", required=True, help="pasta de saída")
+    parser.add_argument("--formato", choices=FORMATOS_EXPORTACAO, default="jsonl")
+    parser.add_argument("--processos", type=int, default=None, help="processos do pool (padrão: um por núcleo)")
+    parser.add_argument("--dias-por-parte", type=int, default=DIAS_POR_PARTE_PADRAO, help="dias em cada arquivo/tarefa")
+    parser.add_argument("--pasta-cubo", default=None, help="reaproveitar o cubo persistido da mesma versão")
+    args = parser.parse_args()
+
+    carregar, montar = fonte_dos_argumentos(args)
+    estado = BaseVendas(carregar, pasta_cubo=args.pasta_cubo, montar=montar).estado()
+    # Só o cubo segue adiante: as linhas saem da memória antes de criar os processos
+    cubo, versao = estado.cubo, estado.versao
+    del estado
+
+    resumo = exportar(cubo, versao, args.saida, args.formato, args.processos, args.dias_por_parte)
+    print(json.dumps(resumo, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# --- GERAÇÃO DE VENDAS SINTÉTICAS ---
+#
+# Tudo é sorteado em vetores NumPy (um sorteio por coluna, não por linha), então
+# gerar anos de histórico com milhões de linhas leva segundos. As distribuições
+# são as mesmas do gerador original linha a linha.
+
+COLUNAS_VENDAS = [
+    "Invoice ID", "City", "Customer type", "Gender", "Product line", "Unit price",
+    "Quantity", "Total", "Time", "Payment", "Rating", "Data",
+]
+
+CIDADES = ['Rio de Janeiro', 'São Paulo', 'Manaus']
+TIPOS_CLIENTE = ['Normal', 'Membro']
+GENEROS = ['Homem', 'Mulher']
+LINHAS_PRODUTO = ['Saude e Beleza', 'Acessorios Eletronicos', 'Casa e Estilo de Vida', 'Esportes e Viagens', 'Moda']
+PAGAMENTOS = ['Pix', 'Cartao de Credito', 'Debito']
+
+# "HH:MM" de todos os minutos do dia, indexado por hora * 60 + minuto
+_HORARIOS = np.array([f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)], dtype=object)
+
+
+def _sortear_categoria(rng, valores, n):
+    # Categorias em ordem alfabética, como os relatórios ordenam os grupos
+    categorias = sorted(valores)
+    return pd.Categorical.from_codes(rng.integers(0, len(categorias), n), categories=categorias)
+
+
+def gerar_vendas(inicio, dias=1, semente=None, transacoes_por_dia=(100, 300)):
+    """
+    Gera `dias` dias consecutivos de vendas a partir de `inicio`, com o mesmo esquema da planilha.
+    As colunas já saem tipadas (categorias, float, int, datetime); `semente` torna o resultado reprodutível.
+    """
+    rng = np.random.default_rng(semente)
+    minimo, maximo = transacoes_por_dia
+
+    qtd_por_dia = rng.integers(minimo, maximo + 1, size=dias)
+    n = int(qtd_por_dia.sum())
+
+    primeiro_dia = np.datetime64(inicio, 'D')
+    datas = np.repeat(primeiro_dia + np.arange(dias), qtd_por_dia).astype('datetime64[ns]')
+
+    invoice_id = (
+        pd.Series(rng.integers(100, 1000, n)).astype(str) + "-"
+        + pd.Series(rng.integers(10, 100, n)).astype(str) + "-"
+        + pd.Series(rng.integers(1000, 10000, n)).astype(str)
+    )
+
+    unit_price = rng.uniform(10.00, 130.00, n)
+    quantity = rng.integers(1, 16, n)
+    total = unit_price * quantity
+    horario = rng.integers(7, 24, n) * 60 + rng.integers(0, 60, n)
+
+    return pd.DataFrame({
+        "Invoice ID": invoice_id,
+        "City": _sortear_categoria(rng, CIDADES, n),
+        "Customer type": _sortear_categoria(rng, TIPOS_CLIENTE, n),
+        "Gender": _sortear_categoria(rng, GENEROS, n),
+        "Product line": _sortear_categoria(rng, LINHAS_PRODUTO, n),
+        "Unit price": unit_price.round(2),
+        "Quantity": quantity,
+        "Total": total.round(2),
+        "Time": _HORARIOS[horario],
+        "Payment": _sortear_categoria(rng, PAGAMENTOS, n),
+        "Rating": rng.uniform(3.0, 10.0, n).round(1),
+        "Data": datas,
+    }, columns=COLUNAS_VENDAS)
+
+
+def gerar_dados_proximo_dia(df_atual, semente=None):
+    if df_atual.empty:
+        ultimo_dia = datetime.date.today()
+    else:
+        ultimo_dia = df_atual['Data'].max().date()
+
+    proximo_dia = ultimo_dia + datetime.timedelta(days=1)
+    return gerar_vendas(proximo_dia, dias=1, semente=semente)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um histórico sintético de vendas (backfill, testes de carga e demos).")
+    parser.add_argument("--inicio", required=True, type=datetime.date.fromisoformat, help="primeiro dia (AAAA-MM-DD)")
+    periodo = parser.add_mutually_exclusive_group(required=True)
+    periodo.add_argument("--dias", type=int, help="quantidade de dias a partir de --inicio")
+    periodo.add_argument("--fim", type=datetime.date.fromisoformat, help="último dia, inclusive (AAAA-MM-DD)")
+    parser.add_argument("--semente", type=int, default=None)
+    parser.add_argument("--saida", required=True, help="arquivo .parquet ou .csv")
+    args = parser.parse_args()
+
+    dias = args.dias if args.dias is not None else (args.fim - args.inicio).days + 1
+    df_vendas = gerar_vendas(args.inicio, dias, args.semente)
+
+    if args.saida.endswith(".parquet"):
+        df_vendas.to_parquet(args.saida, index=False)
+    else:
+        df_vendas.to_csv(args.saida, index=False)
+    print(f"{len(df_vendas)} linhas ({dias} dias) gravadas em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
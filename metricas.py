@@ -0,0 +1,156 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+# --- MÉTRICAS DE DESEMPENHO EM PROCESSO ---
+#
+# Histogramas de latência por etapa (busca na planilha, conversão, fatia do dia,
+# agregação, alertas, JSON...) e contadores (acertos/faltas dos caches), expostos no
+# formato texto do Prometheus. Desligadas por padrão: cada ponto instrumentado custa
+# só a leitura de um booleano. Liga com ativar() ou VENDAS_METRICAS=1.
+
+PREFIXO = "vendas"
+
+# Limites (em segundos) dos baldes dos histogramas, como os padrões do Prometheus
+BALDES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_ativo = os.environ.get("VENDAS_METRICAS", "") not in ("", "0")
+_lock = threading.Lock()
+_histogramas = {}  # etapa -> [contagens por balde, soma, quantidade, máximo]
+_contadores = {}   # (nome, rótulos ordenados) -> valor
+_SEM_MEDICAO = nullcontext()
+
+
+def ativar(ligado=True):
+    global _ativo
+    _ativo = ligado
+
+
+def ativo():
+    return _ativo
+
+
+def registrar_duracao(etapa, segundos):
+    with _lock:
+        histograma = _histogramas.get(etapa)
+        if histograma is None:
+            histograma = _histogramas[etapa] = [[0] * (len(BALDES_SEGUNDOS) + 1), 0.0, 0, 0.0]
+        histograma[0][bisect.bisect_left(BALDES_SEGUNDOS, segundos)] += 1
+        histograma[1] += segundos
+        histograma[2] += 1
+        histograma[3] = max(histograma[3], segundos)
+
+
+class _Cronometro:
+    __slots__ = ("etapa", "inicio")
+
+    def __init__(self, etapa):
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        registrar_duracao(self.etapa, time.perf_counter() - self.inicio)
+        return False
+
+
+def medir(etapa):
+    """
+    Context manager que registra a duração do bloco no histograma da etapa (nada faz se desligado).
+    """
+    return _Cronometro(etapa) if _ativo else _SEM_MEDICAO
+
+
+def cronometrar(etapa):
+    """
+    Decorador equivalente a `with medir(etapa)` em volta da função.
+    """
+    def decorador(funcao):
+        @wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if not _ativo:
+                return funcao(*args, **kwargs)
+            with _Cronometro(etapa):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def contar(nome, valor=1, **rotulos):
+    if not _ativo:
+        return
+    chave = (nome, tuple(sorted(rotulos.items())))
+    with _lock:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+
+def limpar():
+    with _lock:
+        _histogramas.clear()
+        _contadores.clear()
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(pares):
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{_escapar(valor)}"' for chave, valor in pares) + "}"
+
+
+def texto_prometheus():
+    """
+    Histogramas e contadores no formato de exposição em texto do Prometheus (versão 0.0.4).
+    """
+    with _lock:
+        histogramas = {etapa: (list(h[0]), h[1], h[2]) for etapa, h in _histogramas.items()}
+        contadores = dict(_contadores)
+
+    linhas = [
+        f"# HELP {PREFIXO}_etapa_segundos Duração de cada etapa do pipeline.",
+        f"# TYPE {PREFIXO}_etapa_segundos histogram",
+    ]
+    for etapa in sorted(histogramas):
+        baldes, soma, quantidade = histogramas[etapa]
+        acumulado = 0
+        for limite, contagem in zip([*map(repr, BALDES_SEGUNDOS), "+Inf"], baldes):
+            acumulado += contagem
+            linhas.append(f"{PREFIXO}_etapa_segundos_bucket{_rotulos([('etapa', etapa), ('le', limite)])} {acumulado}")
+        linhas.append(f"{PREFIXO}_etapa_segundos_sum{_rotulos([('etapa', etapa)])} {soma!r}")
+        linhas.append(f"{PREFIXO}_etapa_segundos_count{_rotulos([('etapa', etapa)])} {quantidade}")
+
+    for nome in sorted({nome for nome, _ in contadores}):
+        linhas.append(f"# TYPE {PREFIXO}_{nome}_total counter")
+        for (nome_contador, pares), valor in sorted(contadores.items()):
+            if nome_contador == nome:
+                linhas.append(f"{PREFIXO}_{nome}_total{_rotulos(pares)} {valor}")
+
+    return "\n".join(linhas) + "\n"
+
+
+def resumo_etapas():
+    """
+    Lista de dicionários (etapa, chamadas, média e máximo em ms, total em s) para o painel do dashboard.
+    """
+    with _lock:
+        itens = [(etapa, h[1], h[2], h[3]) for etapa, h in _histogramas.items()]
+    return [
+        {"Etapa": etapa, "Chamadas": quantidade, "Média (ms)": round(soma / quantidade * 1000, 2),
+         "Máximo (ms)": round(maximo * 1000, 2), "Total (s)": round(soma, 3)}
+        for etapa, soma, quantidade, maximo in sorted(itens)
+    ]
+
+
+def resumo_contadores():
+    with _lock:
+        return [
+            {"Contador": nome, **dict(pares), "Valor": valor}
+            for (nome, pares), valor in sorted(_contadores.items())
+        ]
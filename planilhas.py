@@ -0,0 +1,660 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from esquema import VERSAO_ESQUEMA, concatenar_vendas, converter_colunas, converter_grade
+from metricas import cronometrar, medir
+
+logger = logging.getLogger(__name__)
+
+# --- SNAPSHOT LOCAL E SINCRONIZAÇÃO INCREMENTAL DA PLANILHA ---
+#
+# A planilha só cresce via append_rows, então guardamos em disco (Parquet) o
+# DataFrame já tratado e a quantidade de linhas sincronizadas. A cada carga
+# buscamos apenas as linhas depois dessa posição; se o cabeçalho mudar ou a
+# última linha sincronizada não bater mais, refazemos a carga completa.
+
+CAMINHO_SNAPSHOT_PADRAO = ".cache/vendas.parquet"
+
+# Grade bruta: números sem formatação (sem depender da localidade) e datas como texto
+# (valores de gspread.utils.ValueRenderOption.unformatted e DateTimeOption.formatted_string)
+OPCOES_LEITURA = {
+    "value_render_option": "UNFORMATTED_VALUE",
+    "date_time_render_option": "FORMATTED_STRING",
+}
+
+# O gspread e o google-auth só são importados na primeira chamada à API (abrir_worksheet e
+# afins): a API servida do snapshot, o SQLite e os scripts locais não pagam essa importação.
+
+
+# --- LIMITE DE LEITURAS ---
+#
+# Várias abas carregadas em paralelo dividem a mesma cota de leitura da API
+# (por usuário e por minuto). Toda leitura passa por um balde de fichas
+# compartilhado entre as threads e, se mesmo assim a API devolver erro de cota,
+# é repetida com backoff exponencial + jitter, como a gravação em lotes.
+
+LEITURAS_POR_MINUTO = 60
+MAX_TENTATIVAS_LEITURA = 5
+
+
+class LimiteDeTaxa:
+    """
+    Balde de fichas seguro entre threads: no máximo `por_minuto` chamadas por minuto, com rajadas de até `rajada`.
+    """
+    def __init__(self, por_minuto=LEITURAS_POR_MINUTO, rajada=None, relogio=time.monotonic, dormir=time.sleep):
+        self.intervalo = 60.0 / por_minuto
+        self.rajada = rajada or max(1, por_minuto // 6)
+        self.relogio = relogio
+        self.dormir = dormir
+        self._fichas = float(self.rajada)
+        self._atualizado_em = relogio()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        with self._lock:
+            agora = self.relogio()
+            self._fichas = min(self.rajada, self._fichas + (agora - self._atualizado_em) / self.intervalo)
+            self._atualizado_em = agora
+            self._fichas -= 1
+            espera = -self._fichas * self.intervalo if self._fichas < 0 else 0.0
+        if espera:
+            self.dormir(espera)
+
+
+limite_leituras = LimiteDeTaxa()
+
+
+def _buscar(chamada, *args, **kwargs):
+    for tentativa in range(MAX_TENTATIVAS_LEITURA):
+        limite_leituras.aguardar()
+        try:
+            with medir("planilha:busca"):
+                return chamada(*args, **kwargs)
+        except Exception as e:  # só APIError de cota ou indisponibilidade é repetido (_eh_erro_temporario)
+            if not _eh_erro_temporario(e) or tentativa == MAX_TENTATIVAS_LEITURA - 1:
+                raise
+            espera = min(64.0, 2 ** tentativa) * random.uniform(0.5, 1.0)
+            logger.warning("Limite da API ao ler a planilha (%s); nova tentativa em %.1fs", e, espera)
+            time.sleep(espera)
+
+
+def versao_dados(meta):
+    """
+    Identificador da versão dos dados sincronizados (muda a cada linha nova ou carga completa).
+    """
+    return f"{meta.get('geracao', 0)}:{meta.get('linhas_sincronizadas', 0)}"
+
+
+def versao_apos_anexar(versao, quantidade_linhas):
+    """
+    Versão que a próxima sincronização vai produzir depois de anexarmos `quantidade_linhas` à planilha.
+    """
+    geracao, linhas = versao.split(":")
+    return f"{geracao}:{int(linhas) + quantidade_linhas}"
+
+
+def ordenar_por_data(df_sheet):
+    # Os relatórios fatiam o histórico por posição, então o frame fica sempre ordenado por 'Data'
+    if df_sheet.empty or df_sheet['Data'].is_monotonic_increasing:
+        return df_sheet.reset_index(drop=True)
+    return df_sheet.sort_values('Data', kind='stable', ignore_index=True)
+
+
+def tratar_tipos(df_sheet):
+    """
+    Converte as colunas da planilha para o esquema compacto dos relatórios e descarta linhas inválidas.
+    """
+    return converter_colunas(df_sheet)[0]
+
+
+@cronometrar("planilha:conversao")
+def _converter_linhas(cabecalho, linhas):
+    df_sheet, rejeitadas = converter_grade(cabecalho, linhas)
+    if rejeitadas:
+        logger.warning("%d linhas da planilha descartadas: %s", sum(rejeitadas.values()), rejeitadas)
+    return df_sheet, rejeitadas
+
+
+def _somar_rejeitadas(anteriores, novas):
+    return {motivo: anteriores.get(motivo, 0) + novas.get(motivo, 0) for motivo in {**anteriores, **novas}}
+
+
+def _valor_celula(valor):
+    # Como a API devolve a célula com UNFORMATTED_VALUE: o 5.0 gravado volta como 5
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _assinatura_linha(linha):
+    # Mesma assinatura para a linha que gravamos (valores Python) e para a que a API devolve
+    valores = [str(_valor_celula(v)) for v in linha]
+    while valores and valores[-1] == '':
+        valores.pop()
+    return valores
+
+
+# Os metadados vão no próprio Parquet (metadados do esquema): um único os.replace troca frame e
+# metadados juntos, e quem lê nunca vê o frame novo com a contagem de linhas antiga.
+CHAVE_META_SNAPSHOT = b"proposta_sheets.snapshot"
+
+
+@cronometrar("planilha:leitura_snapshot")
+def carregar_snapshot(caminho_snapshot):
+    """
+    Lê o snapshot local e seus metadados. Retorna (None, None) se não existir ou estiver corrompido.
+    """
+    try:
+        # Esquema e dados do mesmo arquivo aberto, mesmo que outro processo troque o snapshot no meio
+        with open(caminho_snapshot, "rb") as f:
+            meta = json.loads(pq.read_schema(f).metadata[CHAVE_META_SNAPSHOT])
+            f.seek(0)
+            df_snapshot = pd.read_parquet(f)
+    except (OSError, ValueError, KeyError, TypeError, pa.ArrowException):
+        return None, None
+    return df_snapshot, meta
+
+
+def carregar_meta_snapshot(caminho_snapshot):
+    """
+    Só os metadados do snapshot (rodapé do Parquet, sem ler as colunas). Retorna None se não existir ou estiver corrompido.
+    """
+    try:
+        return json.loads(pq.read_schema(caminho_snapshot).metadata[CHAVE_META_SNAPSHOT])
+    except (OSError, ValueError, KeyError, TypeError, pa.ArrowException):
+        return None
+
+
+@cronometrar("planilha:gravacao_snapshot")
+def salvar_snapshot(df_snapshot, meta, caminho_snapshot):
+    """
+    Grava o snapshot e os metadados de forma atômica (arquivo temporário + os.replace).
+    """
+    pasta = os.path.dirname(caminho_snapshot)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    tabela = pa.Table.from_pandas(df_snapshot, preserve_index=False)
+    metadados = {**(tabela.schema.metadata or {}), CHAVE_META_SNAPSHOT: json.dumps(meta, ensure_ascii=False).encode("utf-8")}
+    pq.write_table(tabela.replace_schema_metadata(metadados), caminho_snapshot + ".tmp")
+    os.replace(caminho_snapshot + ".tmp", caminho_snapshot)
+
+
+def _sincronizacao_completa(worksheet, caminho_snapshot, meta_anterior):
+    valores = _buscar(worksheet.get_all_values, **OPCOES_LEITURA)
+    cabecalho, linhas = ([str(c) for c in valores[0]], valores[1:]) if valores else ([], [])
+
+    df_sheet, rejeitadas = _converter_linhas(cabecalho, linhas) if cabecalho else (pd.DataFrame(), {})
+    meta = {
+        "cabecalho": cabecalho,
+        "linhas_sincronizadas": len(linhas),
+        "ultima_linha": _assinatura_linha(linhas[-1]) if linhas else [],
+        "geracao": (meta_anterior or {}).get("geracao", 0) + 1,
+        "esquema": VERSAO_ESQUEMA,
+        "linhas_rejeitadas": rejeitadas,
+    }
+    df_sheet = ordenar_por_data(df_sheet)
+    salvar_snapshot(df_sheet, meta, caminho_snapshot)
+    return df_sheet, meta
+
+
+def sincronizar_planilha(worksheet, caminho_snapshot=CAMINHO_SNAPSHOT_PADRAO):
+    """
+    Atualiza o snapshot local buscando só as linhas novas da planilha e retorna (DataFrame, metadados).
+    Faz a carga completa quando não há snapshot ou quando cabeçalho/quantidade de linhas não batem.
+    """
+    from gspread.utils import rowcol_to_a1
+
+    df_snapshot, meta = carregar_snapshot(caminho_snapshot)
+    cabecalho = _buscar(worksheet.row_values, 1)
+
+    if (df_snapshot is None or not cabecalho or meta.get("cabecalho") != cabecalho
+            or meta.get("esquema") != VERSAO_ESQUEMA):
+        return _sincronizacao_completa(worksheet, caminho_snapshot, meta)
+
+    sincronizadas = meta["linhas_sincronizadas"]
+    ultima_coluna = rowcol_to_a1(1, len(cabecalho)).rstrip("0123456789")
+
+    # Relemos a última linha já sincronizada (linha 1 é o cabeçalho) para
+    # detectar linhas removidas ou editadas desde a última carga.
+    primeira_linha = sincronizadas + 1 if sincronizadas else 2
+    cauda = _buscar(worksheet.get, f"A{primeira_linha}:{ultima_coluna}", **OPCOES_LEITURA)
+
+    if sincronizadas:
+        if not cauda or _assinatura_linha(cauda[0]) != meta["ultima_linha"]:
+            return _sincronizacao_completa(worksheet, caminho_snapshot, meta)
+        cauda = cauda[1:]
+
+    if not cauda:
+        return df_snapshot, meta
+
+    df_novos, rejeitadas = _converter_linhas(cabecalho, cauda)
+    df_sheet = ordenar_por_data(concatenar_vendas([df_snapshot, df_novos]))
+
+    meta = dict(meta)
+    meta["linhas_sincronizadas"] = sincronizadas + len(cauda)
+    meta["ultima_linha"] = _assinatura_linha(cauda[-1])
+    meta["linhas_rejeitadas"] = _somar_rejeitadas(meta.get("linhas_rejeitadas", {}), rejeitadas)
+    salvar_snapshot(df_sheet, meta, caminho_snapshot)
+    return df_sheet, meta
+
+
+def incorporar_ao_snapshot(df_atual, versao_atual, linhas, primeira_linha, caminho_snapshot=CAMINHO_SNAPSHOT_PADRAO):
+    """
+    Write-through depois de um append: junta ao frame em memória (da versão `versao_atual`) e ao
+    snapshot as `linhas` que acabamos de gravar a partir de `primeira_linha`, sem relê-las da planilha.
+    Retorna (DataFrame completo, metadados, DataFrame só com as linhas novas), ou None se o snapshot
+    não é mais dessa versão ou se a planilha mudou no meio (aí vale a sincronização normal).
+    """
+    # O frame em memória já é o snapshot dessa versão: do arquivo só interessam os metadados
+    meta = carregar_meta_snapshot(caminho_snapshot)
+    if meta is None or versao_dados(meta) != versao_atual or not linhas:
+        return None
+    # Linha 1 é o cabeçalho: as sincronizadas ocupam 2..n+1, então o append tinha que começar em n+2
+    if primeira_linha != meta["linhas_sincronizadas"] + 2:
+        return None
+
+    # As mesmas células que a sincronização leria de volta (gravação RAW), com a mesma conversão
+    df_novos, rejeitadas = _converter_linhas(meta["cabecalho"], linhas)
+    df_sheet = ordenar_por_data(concatenar_vendas([df_atual, df_novos]))
+
+    meta = dict(meta)
+    meta["linhas_sincronizadas"] += len(linhas)
+    meta["ultima_linha"] = _assinatura_linha(linhas[-1])
+    meta["linhas_rejeitadas"] = _somar_rejeitadas(meta.get("linhas_rejeitadas", {}), rejeitadas)
+    salvar_snapshot(df_sheet, meta, caminho_snapshot)
+    return df_sheet, meta, df_novos
+
+
+# --- ACESSO À PLANILHA (STREAMLIT E SERVIDOR DA API) ---
+
+def ler_segredos(caminho=".streamlit/secrets.toml"):
+    """
+    Lê o mesmo arquivo de segredos do Streamlit, para uso fora dele (servidor da API, scripts).
+    """
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import tomli as tomllib
+
+    with open(caminho, "rb") as f:
+        return tomllib.load(f)
+
+
+# --- POOL DE CLIENTES E WORKSHEETS ---
+#
+# O cliente (com o token OAuth) e os handles de worksheet ficam no nível do
+# módulo: sobrevivem aos reruns do Streamlit e ao st.cache_data.clear(), e são
+# compartilhados pelo carregamento, pela gravação e pelas threads do servidor.
+# O lock global só protege os dicionários; chamadas de rede (token, abrir a
+# planilha) usam um lock por chave, então fontes diferentes abrem em paralelo.
+
+VALIDADE_WORKSHEET = 3600  # segundos até reabrir a worksheet (metadados da planilha)
+
+_clientes = {}
+_worksheets = {}
+_locks_por_chave = {}
+_lock_pool = threading.Lock()
+
+
+def _lock_da_chave(chave):
+    with _lock_pool:
+        return _locks_por_chave.setdefault(chave, threading.Lock())
+
+
+def _chave_credencial(creds_dict):
+    return creds_dict.get("client_email"), creds_dict.get("private_key_id")
+
+
+def _obter_cliente(creds_dict):
+    import gspread
+    from google.auth.transport.requests import Request
+
+    chave = _chave_credencial(creds_dict)
+    with _lock_da_chave(("cliente", chave)):
+        cliente = _clientes.get(chave)
+        if cliente is None:
+            cliente = gspread.service_account_from_dict(dict(creds_dict))
+            _clientes[chave] = cliente
+
+        # Renova o token aqui, com o lock da credencial, para as threads não renovarem ao mesmo tempo
+        credenciais = cliente.http_client.auth
+        if not credenciais.valid:
+            credenciais.refresh(Request())
+    return cliente
+
+
+def abrir_worksheet(creds_dict, gsheets_url, worksheet_name):
+    """
+    Retorna a worksheet do pool do processo, abrindo-a só na primeira vez (ou depois de VALIDADE_WORKSHEET).
+    """
+    cliente = _obter_cliente(creds_dict)
+    chave = (_chave_credencial(creds_dict), gsheets_url, worksheet_name)
+
+    with _lock_da_chave(chave):
+        worksheet, aberta_em = _worksheets.get(chave, (None, 0.0))
+        if worksheet is None or time.monotonic() - aberta_em > VALIDADE_WORKSHEET:
+            # Leituras de metadados: passam pelo limite de leituras, como as das linhas
+            planilha = _buscar(cliente.open_by_url, gsheets_url)
+            worksheet = _buscar(planilha.worksheet, worksheet_name)
+            with _lock_pool:
+                _worksheets[chave] = (worksheet, time.monotonic())
+    return worksheet
+
+
+def descartar_worksheet(creds_dict, gsheets_url, worksheet_name):
+    """
+    Remove a worksheet do pool (ex.: depois de um erro da API), para a próxima chamada reabri-la.
+    """
+    with _lock_pool:
+        _worksheets.pop((_chave_credencial(creds_dict), gsheets_url, worksheet_name), None)
+
+
+def _carregar_planilha(creds_dict, gsheets_url, worksheet_name, caminho_snapshot):
+    from gspread.exceptions import APIError
+
+    planilha = (creds_dict, gsheets_url, worksheet_name)
+    worksheet = abrir_worksheet(*planilha)
+
+    # Busca só as linhas novas desde o último snapshot local
+    try:
+        df_sheet, meta = sincronizar_planilha(worksheet, caminho_snapshot)
+    except APIError:
+        descartar_worksheet(*planilha)
+        raise
+    return df_sheet, versao_dados(meta)
+
+
+@cronometrar("carga")
+def carregar_vendas(segredos):
+    """
+    Sincroniza a planilha configurada em `segredos` (formato do st.secrets) e retorna (DataFrame, versão dos dados).
+    Com `fontes` em [gsheets], carrega todas as abas/planilhas listadas (ver carregar_fontes).
+    """
+    if segredos["gsheets"].get("fontes"):
+        return carregar_fontes(segredos)
+    return _carregar_planilha(segredos["gcp_service_account"], segredos["gsheets"]["url"], segredos["gsheets"]["worksheet_name"],
+                              segredos["gsheets"].get("snapshot_path", CAMINHO_SNAPSHOT_PADRAO))
+
+
+# --- VÁRIAS ABAS / PLANILHAS ---
+#
+# Uma aba por loja ou por mês: [gsheets] fontes = ["Loja Centro", "Loja Norte"]
+# (abas da planilha de `url`) ou tabelas {nome, url, worksheet_name}. Cada fonte
+# tem seu próprio snapshot incremental e as fontes são buscadas em paralelo, num
+# pool limitado (max_paralelo) que divide o limite de leituras da API. O frame
+# final marca a origem de cada linha na coluna categórica 'Fonte'.
+
+MAX_PARALELO_FONTES = 4
+SEPARADOR_VERSOES = "|"
+
+
+def fontes_configuradas(segredos):
+    """
+    Lista de dicionários {nome, url, worksheet_name, snapshot_path}, um por fonte de `segredos["gsheets"]["fontes"]`.
+    """
+    config = segredos["gsheets"]
+    base, extensao = os.path.splitext(config.get("snapshot_path", CAMINHO_SNAPSHOT_PADRAO))
+    fontes = []
+    for item in config["fontes"]:
+        item = {"worksheet_name": item} if isinstance(item, str) else dict(item)
+        nome = item.get("nome", item["worksheet_name"])
+        sufixo = re.sub(r"[^\w.-]+", "_", nome)
+        fontes.append({
+            "nome": nome,
+            "url": item.get("url", config.get("url")),
+            "worksheet_name": item["worksheet_name"],
+            "snapshot_path": item.get("snapshot_path", f"{base}.{sufixo}{extensao}"),
+        })
+    return fontes
+
+
+def juntar_fontes(frames, nomes):
+    """
+    Concatena os frames de cada fonte (na ordem de `nomes`) marcando a coluna 'Fonte' e ordena por 'Data'.
+    """
+    categorias = sorted(nomes)
+    marcados = [
+        df.assign(Fonte=pd.Categorical.from_codes(np.full(len(df), categorias.index(nome)), categories=categorias))
+        for nome, df in zip(nomes, frames)
+    ]
+    return ordenar_por_data(concatenar_vendas(marcados))
+
+
+def versao_fontes(versoes):
+    return SEPARADOR_VERSOES.join(f"{nome}={versao}" for nome, versao in versoes.items())
+
+
+def versoes_por_fonte(versao):
+    return dict(parte.rsplit("=", 1) for parte in versao.split(SEPARADOR_VERSOES))
+
+
+@cronometrar("carga:fontes")
+def carregar_fontes(segredos):
+    """
+    Sincroniza todas as fontes em paralelo e retorna (DataFrame com a coluna 'Fonte', versão combinada).
+    A latência é a da fonte mais lenta, não a soma de todas.
+    """
+    fontes = fontes_configuradas(segredos)
+    creds_dict = segredos["gcp_service_account"]
+    max_paralelo = min(segredos["gsheets"].get("max_paralelo", MAX_PARALELO_FONTES), len(fontes))
+
+    with ThreadPoolExecutor(max_workers=max_paralelo, thread_name_prefix="fonte") as pool:
+        resultados = list(pool.map(
+            lambda fonte: _carregar_planilha(creds_dict, fonte["url"], fonte["worksheet_name"], fonte["snapshot_path"]), fontes))
+
+    nomes = [fonte["nome"] for fonte in fontes]
+    df_vendas = juntar_fontes([df for df, _ in resultados], nomes)
+    return df_vendas, versao_fontes({nome: versao for nome, (_, versao) in zip(nomes, resultados)})
+
+
+def _snapshot_valido(caminho_snapshot):
+    df_snapshot, meta = carregar_snapshot(caminho_snapshot)
+    if df_snapshot is None or meta.get("esquema") != VERSAO_ESQUEMA:
+        return None
+    return df_snapshot, versao_dados(meta)
+
+
+@cronometrar("carga:snapshot")
+def carregar_vendas_local(segredos):
+    """
+    Os dados do último snapshot local de cada fonte de `segredos`, sem chamar a API: (DataFrame, versão)
+    no mesmo formato de carregar_vendas, ou None se faltar o snapshot de alguma fonte. Serve para responder
+    logo na partida enquanto a sincronização com a planilha roda em segundo plano.
+    """
+    if not segredos["gsheets"].get("fontes"):
+        return _snapshot_valido(segredos["gsheets"].get("snapshot_path", CAMINHO_SNAPSHOT_PADRAO))
+
+    fontes = fontes_configuradas(segredos)
+    snapshots = [_snapshot_valido(fonte["snapshot_path"]) for fonte in fontes]
+    if any(snapshot is None for snapshot in snapshots):
+        return None
+    nomes = [fonte["nome"] for fonte in fontes]
+    return juntar_fontes([df for df, _ in snapshots], nomes), versao_fontes({nome: versao for nome, (_, versao) in zip(nomes, snapshots)})
+
+
+# --- GRAVAÇÃO EM LOTES ---
+#
+# Backfills grandes são divididos em lotes limitados em linhas e em bytes, cada
+# lote é repetido com backoff exponencial + jitter quando a API devolve erro de
+# cota, e o progresso fica gravado em disco para retomar do último lote aceito.
+
+# Códigos da API que valem nova tentativa. Leituras repetem também na indisponibilidade (5xx);
+# o append_rows não é idempotente (um 5xx pode ter gravado as linhas), então só repete na cota.
+CODIGOS_COTA = {429}
+CODIGOS_INDISPONIVEL = {500, 502, 503, 504}
+
+
+def linhas_para_planilha(df_novos_dados):
+    """
+    Converte o DataFrame para a lista de linhas enviada ao append_rows, no formato que a planilha sempre usou.
+    """
+    df_export = df_novos_dados.copy()
+
+    # Converte as datas para string antes de enviar
+    df_export['Data'] = df_export['Data'].dt.strftime('%Y-%m-%d')
+    # Preço e total seguem gravados como texto com duas casas, como sempre foram
+    for col in ['Unit price', 'Total']:
+        df_export[col] = np.char.mod('%.2f', df_export[col].to_numpy(dtype=float))
+
+    return df_export.astype(object).values.tolist()
+
+
+def _eh_erro_de_cota(erro):
+    from gspread.exceptions import APIError
+
+    if not isinstance(erro, APIError):
+        return False
+    return erro.code in CODIGOS_COTA or erro.error.get("status") == "RESOURCE_EXHAUSTED"
+
+
+def _eh_erro_temporario(erro):
+    from gspread.exceptions import APIError
+
+    if not isinstance(erro, APIError):
+        return False
+    return _eh_erro_de_cota(erro) or erro.code in CODIGOS_INDISPONIVEL or erro.error.get("status") == "UNAVAILABLE"
+
+
+def _dividir_em_lotes(linhas, max_linhas, max_bytes):
+    inicio, tamanho = 0, 0
+    for i, linha in enumerate(linhas):
+        tamanho_linha = sum(len(str(valor)) + 4 for valor in linha)
+        if i > inicio and (i - inicio >= max_linhas or tamanho + tamanho_linha > max_bytes):
+            yield inicio, i
+            inicio, tamanho = i, 0
+        tamanho += tamanho_linha
+    if inicio < len(linhas):
+        yield inicio, len(linhas)
+
+
+def _id_tarefa(linhas):
+    return hashlib.sha1(json.dumps(linhas, default=str).encode("utf-8")).hexdigest()
+
+
+def _ler_progresso(arquivo_progresso, id_tarefa):
+    try:
+        with open(arquivo_progresso, encoding="utf-8") as f:
+            progresso = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return progresso.get("linhas_gravadas", 0) if progresso.get("id_tarefa") == id_tarefa else 0
+
+
+def _gravar_progresso(arquivo_progresso, id_tarefa, linhas_gravadas):
+    pasta = os.path.dirname(arquivo_progresso)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    with open(arquivo_progresso + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"id_tarefa": id_tarefa, "linhas_gravadas": linhas_gravadas}, f)
+    os.replace(arquivo_progresso + ".tmp", arquivo_progresso)
+
+
+def _linha_inicial(resposta):
+    # A API responde com o intervalo gravado, ex.: {"updates": {"updatedRange": "'Vendas'!A102:L301"}}
+    intervalo = ((resposta or {}).get("updates") or {}).get("updatedRange", "")
+    encontrado = re.search(r"!\$?[A-Z]+\$?(\d+)", intervalo)
+    return int(encontrado.group(1)) if encontrado else None
+
+
+def anexar_em_lotes(worksheet, linhas, max_linhas=5000, max_bytes=2_000_000, max_tentativas=6,
+                    espera_inicial=1.0, espera_maxima=64.0, arquivo_progresso=None, dormir=time.sleep):
+    """
+    Anexa `linhas` à planilha em lotes limitados por quantidade de linhas e por tamanho aproximado.
+    Erros de cota (429) são repetidos com backoff exponencial e jitter; outros erros sobem, inclusive 5xx:
+    o lote pode ter sido gravado mesmo assim, e repetir duplicaria as linhas (a próxima sincronização confere).
+    Com `arquivo_progresso`, uma nova chamada com as mesmas linhas retoma depois do último lote gravado.
+    Retorna estatísticas da gravação (linhas, lotes, novas tentativas, segundos e linhas/s) e a linha da
+    planilha onde as linhas começaram ('primeira_linha'), ou None se a API não informou ou se os lotes
+    não ficaram contíguos (outra gravação entrou no meio).
+    """
+    id_tarefa = _id_tarefa(linhas) if arquivo_progresso else None
+    ja_gravadas = _ler_progresso(arquivo_progresso, id_tarefa) if arquivo_progresso else 0
+
+    inicio_relogio = time.monotonic()
+    gravadas, lotes, novas_tentativas = ja_gravadas, 0, 0
+    primeira_linha = proxima_linha = None
+    contiguas = True
+
+    for inicio, fim in _dividir_em_lotes(linhas, max_linhas, max_bytes):
+        if fim <= ja_gravadas:
+            continue
+
+        for tentativa in range(max_tentativas):
+            try:
+                resposta = worksheet.append_rows(linhas[max(inicio, ja_gravadas):fim])
+                break
+            except Exception as e:  # só o APIError de cota é repetido (_eh_erro_de_cota)
+                if not _eh_erro_de_cota(e) or tentativa == max_tentativas - 1:
+                    raise
+                novas_tentativas += 1
+                espera = min(espera_maxima, espera_inicial * 2 ** tentativa)
+                espera *= random.uniform(0.5, 1.0)
+                logger.warning("Limite da API ao gravar linhas %d-%d (%s); nova tentativa em %.1fs", inicio, fim, e, espera)
+                dormir(espera)
+
+        linha_inicial = _linha_inicial(resposta)
+        if linha_inicial is None or (proxima_linha is not None and linha_inicial != proxima_linha):
+            contiguas = False
+        elif primeira_linha is None:
+            primeira_linha = linha_inicial
+        proxima_linha = None if linha_inicial is None else linha_inicial + fim - max(inicio, ja_gravadas)
+
+        gravadas, lotes = fim, lotes + 1
+        if arquivo_progresso:
+            _gravar_progresso(arquivo_progresso, id_tarefa, gravadas)
+
+    if arquivo_progresso and os.path.exists(arquivo_progresso):
+        os.remove(arquivo_progresso)
+
+    segundos = time.monotonic() - inicio_relogio
+    linhas_nesta_execucao = gravadas - ja_gravadas
+    estatisticas = {
+        "linhas": linhas_nesta_execucao,
+        "retomado_de": ja_gravadas,
+        "lotes": lotes,
+        "novas_tentativas": novas_tentativas,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(linhas_nesta_execucao / segundos, 1) if segundos > 0 else None,
+        "primeira_linha": primeira_linha if contiguas and not ja_gravadas else None,
+    }
+    logger.info("Gravação em lotes concluída: %s", estatisticas)
+    return estatisticas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Anexa um arquivo de vendas (backfill) à planilha em lotes.")
+    parser.add_argument("arquivo", help=".parquet ou .csv com as colunas da planilha (ex.: saída do gerador_dados.py)")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--max-linhas", type=int, default=5000, help="linhas por lote")
+    parser.add_argument("--progresso", default=None, help="arquivo de progresso para retomar (padrão: <arquivo>.progresso.json)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    segredos = ler_segredos(args.secrets)
+    df_novos = pd.read_parquet(args.arquivo) if args.arquivo.endswith(".parquet") else pd.read_csv(args.arquivo, parse_dates=['Data'])
+    worksheet = abrir_worksheet(segredos["gcp_service_account"], segredos["gsheets"]["url"], segredos["gsheets"]["worksheet_name"])
+
+    estatisticas = anexar_em_lotes(
+        worksheet, linhas_para_planilha(df_novos), max_linhas=args.max_linhas,
+        arquivo_progresso=args.progresso or args.arquivo + ".progresso.json",
+    )
+    print(f"{estatisticas['linhas']} linhas em {estatisticas['segundos']}s ({estatisticas['linhas_por_segundo']} linhas/s, "
+          f"{estatisticas['lotes']} lotes, {estatisticas['novas_tentativas']} novas tentativas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1018 @@
+import datetime
+import json
+import operator
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from esquema import COLUNAS_DIMENSAO
+from metricas import contar, cronometrar, medir
+
+# Lógica dos relatórios diários e dos alertas, sem dependência do Streamlit:
+# usada pelo dashboard (exemplo-sheets.py) e pelo servidor da API (servidor_api.py).
+
+
+# --- ÍNDICE DE DIAS ---
+def construir_indice_dias(data_df):
+    """
+    Recebe o DataFrame ordenado por 'Data' e retorna um dicionário dia -> (início, fim) com as posições das linhas de cada dia.
+    """
+    if data_df.empty:
+        return {}
+
+    dias = data_df['Data'].values.astype('datetime64[D]')
+    quebras = np.flatnonzero(dias[1:] != dias[:-1]) + 1
+    inicios = np.concatenate(([0], quebras))
+    fins = np.concatenate((quebras, [len(dias)]))
+
+    return {dia.item(): (int(inicio), int(fim)) for dia, inicio, fim in zip(dias[inicios], inicios, fins)}
+
+
+def fatia_do_dia(data_df, indice_dias, dia_date):
+    """
+    Retorna as linhas do dia como uma fatia posicional (sem varrer o histórico).
+    """
+    inicio, fim = indice_dias.get(dia_date, (0, 0))
+    return data_df.iloc[inicio:fim]
+
+
+# --- CUBO DIÁRIO DE RESUMO ---
+# Somas e contagens por dia x dimensão; as médias são derivadas (soma / contagem).
+PASTA_CUBO_PADRAO = ".cache/cubo"
+METRICAS_CUBO = ['Total', 'Quantity', 'Contagem', 'Soma Rating', 'Contagem Rating']
+AGREGADOS_CUBO = {
+    "dia": [],
+    "cidade": ['City'],
+    "tipo_cliente": ['Customer type'],
+    "genero": ['Gender'],
+    "linha_produto": ['Product line'],
+    "pagamento": ['Payment'],
+    "hora": ['Hora'],
+    "cidade_tipo_cliente": ['City', 'Customer type'],
+    "cidade_genero_tipo_cliente": ['City', 'Gender', 'Customer type'],
+    "cidade_linha_produto": ['City', 'Product line'],
+    "cidade_pagamento_genero": ['City', 'Payment', 'Gender'],
+    # Só quando as vendas vêm de várias abas/planilhas (coluna 'Fonte', ver planilhas.carregar_fontes)
+    "fonte": ['Fonte'],
+}
+COLUNAS_CUBO = COLUNAS_DIMENSAO + ['Hora', 'Fonte']
+
+# Tabela do relatório -> (tabela de variação, tipo de cálculo, agregado do cubo usado)
+TABELAS_RELATORIO = {
+    "total_por_cidade": ("variacao_cidade", "totais", "cidade"),
+    "total_por_tipo_cliente": ("variacao_tipo_cliente", "totais", "tipo_cliente"),
+    "total_por_genero": ("variacao_genero", "totais", "genero"),
+    "total_por_linha_produto": ("variacao_linha_produto", "totais", "linha_produto"),
+    "total_por_payment": ("variacao_payment", "totais", "pagamento"),
+    "crosstab_cidade_tipo_cliente": ("variacao_cidade_tipo_cliente", "crosstab", "cidade_tipo_cliente"),
+    "crosstab_cidade_genero": ("variacao_cidade_genero", "crosstab", "cidade_genero_tipo_cliente"),
+    "crosstab_cidade_product": ("variacao_cidade_product", "crosstab", "cidade_linha_produto"),
+    "crosstab_cidade_payment": ("variacao_cidade_payment", "crosstab", "cidade_pagamento_genero"),
+    "ticket_medio_cidade": ("var_ticket_medio_cidade", "ticket_medio", "cidade"),
+    "vendas_por_hora": ("var_vendas_por_hora", "hora", "hora"),
+    "rating_produto": ("var_rating_produto", "rating", "linha_produto"),
+    "rating_pagamento": ("var_rating_pagamento", "rating", "pagamento"),
+    "total_por_fonte": ("variacao_fonte", "totais", "fonte"),
+}
+
+
+def _codigos(data_df, coluna):
+    # Código inteiro de cada linha (-1 = vazio) e os valores de cada código, em ordem
+    if coluna == 'Data':
+        return pd.factorize(data_df['Data'].dt.normalize(), sort=True)
+    serie = data_df[coluna]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = serie.cat.categories
+        return serie.cat.codes.to_numpy(dtype=np.int64), pd.Categorical.from_codes(np.arange(len(categorias)), categories=categorias)
+    return pd.factorize(serie, sort=True)
+
+
+# Menor unidade das métricas em ponto flutuante: o Total vem em centavos e o Rating em décimos.
+# Somadas como inteiros dessa unidade, as somas são exatas, então o relatório do dia, o de um
+# período e o cubo agregado no SQLite chegam ao mesmo valor.
+ESCALA_METRICAS = {'Total': 100, 'Soma Rating': 10}
+
+
+def _em_unidades(valores, escala):
+    """
+    Os valores em inteiros da menor unidade (ex.: centavos), ou None se algum não cai nessa grade.
+    """
+    unidades = np.rint(valores * escala)
+    if np.any(np.abs(valores * escala - unidades) > 1e-6 * np.maximum(1.0, np.abs(unidades))):
+        return None
+    return unidades
+
+
+def _somar_por_celula(celula, valores, total_celulas, escala=None):
+    unidades = _em_unidades(valores, escala) if escala else None
+    if unidades is not None:
+        # Inteiros somados em float64 são exatos até 2**53
+        return np.bincount(celula, weights=unidades, minlength=total_celulas) / escala
+
+    # Fora da grade: np.bincount soma em sequência e acumula erro de arredondamento, o que muda médias que caem
+    # exatamente na casa de arredondamento. Cada valor é separado numa parte alta (inteiro escalado
+    # por potência de 2, somado sem erro) e num resto pequeno, como a soma compensada do groupby.
+    maximo = np.abs(valores).max() if len(valores) else 0.0
+    if not maximo:
+        return np.bincount(celula, weights=valores, minlength=total_celulas)
+    escala = 2.0 ** (26 - np.ceil(np.log2(maximo)))
+    alto = np.round(valores * escala)
+    resto = valores - alto / escala
+    return (np.bincount(celula, weights=alto, minlength=total_celulas) / escala
+            + np.bincount(celula, weights=resto, minlength=total_celulas))
+
+
+def agregados_disponiveis(data_df, agregados=None):
+    """
+    Nomes de AGREGADOS_CUBO (ou só os de `agregados`) cujas colunas existem no frame; "dia" sempre entra.
+    """
+    nomes = AGREGADOS_CUBO if agregados is None else ["dia", *agregados]
+    return [nome for nome in dict.fromkeys(nomes) if all(col in data_df.columns for col in AGREGADOS_CUBO[nome])]
+
+
+def _indice_cubo(colunas, codigos_celulas, valores):
+    niveis = [valores[col].take(codigos) for col, codigos in zip(colunas, codigos_celulas)]
+    if len(colunas) == 1:
+        return pd.Index(niveis[0], name=colunas[0])
+    return pd.MultiIndex.from_arrays(niveis, names=colunas)
+
+
+@cronometrar("cubo")
+def construir_cubo(data_df, agregados=None):
+    """
+    Monta o cubo dia x dimensão sem groupby: cada coluna vira códigos inteiros uma única vez e
+    cada agregado sai de alguns np.bincount sobre o espaço fixo de códigos (dias x categorias).
+    `agregados` limita o cubo a alguns nomes de AGREGADOS_CUBO ("dia" sempre entra); agregados de
+    colunas que o frame não tem (ex.: 'Fonte' com uma aba só) ficam de fora.
+    """
+    nomes = agregados_disponiveis(data_df, agregados)
+    colunas_usadas = ['Data'] + [col for col in COLUNAS_CUBO if any(col in AGREGADOS_CUBO[nome] for nome in nomes)]
+
+    codigos, valores = {}, {}
+    for col in colunas_usadas:
+        codigos[col], valores[col] = _codigos(data_df, col)
+
+    # As linhas já vêm no esquema de esquema.normalizar_vendas (sem lixo, com 'Hora')
+    rating = data_df['Rating'].to_numpy(dtype=np.float64)
+    tem_rating = ~np.isnan(rating)
+    pesos = {
+        'Total': data_df['Total'].to_numpy(dtype=np.float64),
+        'Quantity': data_df['Quantity'].to_numpy(dtype=np.float64),
+        'Soma Rating': np.where(tem_rating, rating, 0.0),
+        'Contagem Rating': tem_rating.astype(np.float64),
+    }
+
+    cubo = {}
+    for nome in nomes:
+        colunas = ['Data'] + AGREGADOS_CUBO[nome]
+        tamanhos = [len(valores[col]) for col in colunas]
+        matriz = np.stack([codigos[col] for col in colunas])
+        validas = (matriz >= 0).all(axis=0)
+        celula = np.ravel_multi_index(matriz[:, validas], tamanhos) if validas.any() else np.zeros(0, dtype=np.int64)
+        total_celulas = int(np.prod(tamanhos))
+
+        contagem = np.bincount(celula, minlength=total_celulas)
+        ocupadas = np.flatnonzero(contagem)
+        somas = {metrica: _somar_por_celula(celula, peso[validas], total_celulas, ESCALA_METRICAS.get(metrica))[ocupadas]
+                 for metrica, peso in pesos.items()}
+
+        cubo[nome] = pd.DataFrame({
+            'Total': somas['Total'],
+            'Quantity': somas['Quantity'].round().astype(np.int64),
+            'Contagem': contagem[ocupadas].astype(np.int64),
+            'Soma Rating': somas['Soma Rating'],
+            'Contagem Rating': somas['Contagem Rating'].round().astype(np.int64),
+        }, index=_indice_cubo(colunas, np.unravel_index(ocupadas, tamanhos), valores))
+
+    return cubo
+
+
+def atualizar_cubo(cubo, df_novos_dados):
+    """
+    Soma ao cubo apenas a fatia das linhas novas e retorna um novo cubo (o original não é alterado).
+    Retorna None se as linhas novas não têm as colunas de algum agregado do cubo (ex.: sem 'Fonte'):
+    quem chamou monta o cubo de novo a partir dos dados.
+    """
+    cubo_novos = construir_cubo(df_novos_dados)
+    if any(nome not in cubo_novos for nome in cubo):
+        return None
+    dias_novos = cubo_novos["dia"].index
+
+    cubo_atualizado = {}
+    for nome, tabela in cubo.items():
+        sobrepostos = tabela.index.get_level_values('Data').isin(dias_novos)
+        if sobrepostos.any():
+            combinado = pd.concat([tabela[sobrepostos], cubo_novos[nome]]).groupby(level=tabela.index.names, observed=True).sum()
+            tabela = pd.concat([tabela[~sobrepostos], combinado])
+        else:
+            tabela = pd.concat([tabela, cubo_novos[nome]])
+        cubo_atualizado[nome] = tabela if tabela.index.is_monotonic_increasing else tabela.sort_index()
+
+    return cubo_atualizado
+
+
+# Cada arquivo do cubo leva a versão dos dados nos metadados do Parquet: os agregados são trocados
+# um a um, então quem lê no meio de uma gravação confere a versão de cada arquivo e, se alguma não
+# bater, trata o cubo como ausente em vez de misturar agregados de duas versões.
+CHAVE_VERSAO_CUBO = b"proposta_sheets.versao_dados"
+
+
+def _gravar_atomico(caminho, gravar):
+    gravar(caminho + ".tmp")
+    os.replace(caminho + ".tmp", caminho)
+
+
+def salvar_cubo(cubo, versao, pasta=PASTA_CUBO_PADRAO):
+    """
+    Persiste cada agregado do cubo em Parquet, junto com a versão dos dados que ele representa.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(pasta, exist_ok=True)
+    versao_json = json.dumps(versao).encode("utf-8")
+    for nome, tabela in cubo.items():
+        arrow = pa.Table.from_pandas(tabela.reset_index(), preserve_index=False)
+        arrow = arrow.replace_schema_metadata({**(arrow.schema.metadata or {}), CHAVE_VERSAO_CUBO: versao_json})
+        _gravar_atomico(os.path.join(pasta, f"{nome}.parquet"), lambda caminho: pq.write_table(arrow, caminho))
+
+    def gravar_meta(caminho):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({"versao_dados": versao, "agregados": list(cubo)}, f)
+    _gravar_atomico(os.path.join(pasta, "meta.json"), gravar_meta)
+
+
+def _ler_agregado(caminho, versao):
+    import pyarrow.parquet as pq
+
+    # Versão e dados do mesmo arquivo aberto, mesmo que outra gravação o troque no meio
+    with open(caminho, "rb") as f:
+        metadados = pq.read_schema(f).metadata or {}
+        if json.loads(metadados.get(CHAVE_VERSAO_CUBO, b"null")) != versao:
+            return None
+        f.seek(0)
+        return pd.read_parquet(f)
+
+
+def carregar_cubo(pasta, versao):
+    """
+    Lê o cubo persistido. Retorna None se não existir ou se for de outra versão dos dados.
+    """
+    try:
+        with open(os.path.join(pasta, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("versao_dados") != versao:
+            return None
+        cubo = {}
+        for nome in meta.get("agregados", AGREGADOS_CUBO):
+            tabela = _ler_agregado(os.path.join(pasta, f"{nome}.parquet"), versao)
+            if tabela is None:
+                return None
+            cubo[nome] = tabela.set_index(['Data'] + AGREGADOS_CUBO[nome])
+        return cubo
+    except (OSError, ValueError):
+        return None
+
+
+def dia_tem_vendas(cubo, dia):
+    return pd.to_datetime(dia).normalize() in cubo["dia"].index
+
+
+def consultar_cubo(cubo, dia_timestamp, agregados=None):
+    """
+    Retorna os agregados de um dia (sem o nível 'Data') ou None se o dia não tem vendas.
+    """
+    if dia_timestamp not in cubo["dia"].index:
+        return None
+
+    resultado = {}
+    for nome in (agregados if agregados is not None else cubo):
+        if nome == "dia" or nome not in cubo:
+            continue
+        tabela = cubo[nome]
+        try:
+            resultado[nome] = tabela.xs(dia_timestamp, level='Data')
+        except KeyError:
+            resultado[nome] = tabela.iloc[0:0].droplevel('Data')
+    return resultado
+
+
+def cubo_dos_dois_dias(dia_date, data_df, indice_dias=None, agregados=None):
+    """
+    Cubo só com o dia e o dia anterior, para quando não há o cubo do histórico. Retorna None se o dia não tem vendas.
+    """
+    dia_anterior = dia_date - datetime.timedelta(days=1)
+    with medir("relatorio:fatia_dia"):
+        if indice_dias is not None:
+            df_dia = fatia_do_dia(data_df, indice_dias, dia_date)
+            df_dia_anterior = fatia_do_dia(data_df, indice_dias, dia_anterior)
+        else:
+            dias = data_df['Data'].values.astype('datetime64[D]')
+            df_dia = data_df[dias == np.datetime64(dia_date, 'D')]
+            df_dia_anterior = data_df[dias == np.datetime64(dia_anterior, 'D')]
+
+    if df_dia.empty:
+        return None
+    return construir_cubo(pd.concat([df_dia_anterior, df_dia]), agregados)
+
+
+def _tabelas_pedidas(tabelas):
+    pedidas = {chave: spec for chave, spec in TABELAS_RELATORIO.items() if tabelas is None or chave in tabelas}
+    return pedidas, list(dict.fromkeys(agregado for _, _, agregado in pedidas.values()))
+
+
+@cronometrar("relatorio")
+def relatorio_por_dia_com_variacoes(dia, data_df, indice_dias=None, cubo=None, tabelas=None):
+    """
+    Monta as tabelas do dia e suas variações em relação ao dia anterior.
+    `tabelas` restringe o cálculo a algumas chaves de TABELAS_RELATORIO (cada uma vem com sua variação).
+    """
+    if isinstance(dia, (pd.Timestamp, datetime.datetime)):
+        dia_date = dia.date()
+    else:
+        dia_date = dia
+
+    dia_timestamp = pd.to_datetime(dia_date)
+    dia_anterior_timestamp = dia_timestamp - pd.Timedelta(days=1)
+
+    pedidas, agregados_usados = _tabelas_pedidas(tabelas)
+
+    if cubo is None:
+        cubo = cubo_dos_dois_dias(dia_date, data_df, indice_dias, agregados_usados)
+        if cubo is None:
+            return {}
+
+    agregados_dia = consultar_cubo(cubo, dia_timestamp, agregados_usados)
+    agregados_anterior = consultar_cubo(cubo, dia_anterior_timestamp, agregados_usados)
+
+    if agregados_dia is None:
+        return {}
+    return _montar_relatorio(pedidas, agregados_dia, agregados_anterior)
+
+
+@cronometrar("relatorio:tabelas")
+def _montar_relatorio(pedidas, agregados_dia, agregados_anterior):
+    # Tabelas e variações a partir dos agregados do período e do período de comparação (None = sem dados)
+    is_first_day_with_data = agregados_anterior is None
+
+    # --- HELPERS INTERNOS ---
+    def sem_variacao(tabela):
+        # Primeiro dia com dados: a variação fica toda vazia, com o mesmo formato da tabela
+        return pd.DataFrame(np.nan, index=tabela.index, columns=tabela.columns)
+
+    def calcular_totais_e_variacao(nome_agregado):
+        total_atual = agregados_dia[nome_agregado][['Total', 'Quantity']]
+        if is_first_day_with_data:
+            return total_atual, sem_variacao(total_atual)
+        else:
+            total_anterior = agregados_anterior[nome_agregado][['Total', 'Quantity']]
+            base_index = total_atual.index.union(total_anterior.index)
+            total_atual_reindex = total_atual.reindex(base_index, fill_value=0)
+            total_anterior_reindex = total_anterior.reindex(base_index, fill_value=0)
+            variacao = total_atual_reindex - total_anterior_reindex
+            return total_atual_reindex, variacao
+
+    def calcular_crosstab_e_variacao(nome_agregado):
+        atual = agregados_dia[nome_agregado]['Contagem'].unstack(fill_value=0)
+        if is_first_day_with_data:
+            variacao = pd.DataFrame(pd.NA, index=atual.index, columns=atual.columns, dtype=object)
+            return atual, variacao
+        else:
+            anterior = agregados_anterior[nome_agregado]['Contagem'].unstack(fill_value=0)
+            idx = atual.index.union(anterior.index)
+            cols = atual.columns.union(anterior.columns)
+            atual_reindex = atual.reindex(index=idx, columns=cols, fill_value=0)
+            anterior_reindex = anterior.reindex(index=idx, columns=cols, fill_value=0)
+            variacao = atual_reindex - anterior_reindex
+            return atual, variacao
+
+    def media(agregados, nome_agregado, coluna_soma, coluna_contagem, nome_metrica):
+        tabela = agregados[nome_agregado]
+        return (tabela[coluna_soma] / tabela[coluna_contagem]).to_frame(nome_metrica)
+
+    def calcular_media_e_variacao(nome_agregado, coluna_soma, coluna_contagem, nome_metrica):
+        media_atual = media(agregados_dia, nome_agregado, coluna_soma, coluna_contagem, nome_metrica)
+        if is_first_day_with_data:
+            return media_atual, sem_variacao(media_atual)
+        else:
+            media_anterior = media(agregados_anterior, nome_agregado, coluna_soma, coluna_contagem, nome_metrica)
+            base_index = media_atual.index.union(media_anterior.index)
+            media_atual_reindex = media_atual.reindex(base_index, fill_value=0)
+            media_anterior_reindex = media_anterior.reindex(base_index, fill_value=0)
+            variacao = media_atual_reindex - media_anterior_reindex
+            return media_atual_reindex, variacao
+
+    def vendas_por_hora(agregados):
+        tabela = agregados["hora"][['Total']]
+        tabela.index = tabela.index.astype(int)
+        return tabela
+
+    def calcular_vendas_por_hora(nome_agregado):
+        vendas_hora_atual = vendas_por_hora(agregados_dia)
+        if is_first_day_with_data:
+            return vendas_hora_atual, sem_variacao(vendas_hora_atual)
+        else:
+            vendas_hora_anterior = vendas_por_hora(agregados_anterior)
+            idx_h = vendas_hora_atual.index.union(vendas_hora_anterior.index)
+            atual_h = vendas_hora_atual.reindex(idx_h, fill_value=0)
+            ant_h = vendas_hora_anterior.reindex(idx_h, fill_value=0)
+            return atual_h, atual_h - ant_h
+
+    calculos = {
+        "totais": calcular_totais_e_variacao,
+        "crosstab": calcular_crosstab_e_variacao,
+        "ticket_medio": lambda nome: calcular_media_e_variacao(nome, 'Total', 'Contagem', 'Ticket Médio'),
+        "rating": lambda nome: calcular_media_e_variacao(nome, 'Soma Rating', 'Contagem Rating', 'Média Rating'),
+        "hora": calcular_vendas_por_hora,
+    }
+
+    # --- CÁLCULOS (só as tabelas pedidas e cujo agregado existe no cubo) ---
+    relatorio = {}
+    for chave, (chave_variacao, tipo, agregado) in pedidas.items():
+        if agregado not in agregados_dia:
+            continue
+        relatorio[chave], relatorio[chave_variacao] = calculos[tipo](agregado)
+    return relatorio
+
+
+# --- PERÍODOS (SOMAS ACUMULADAS POR DIA) ---
+# Para cada agregado do cubo, uma matriz (dias do calendário + 1) x células com a soma acumulada de cada
+# métrica: o total de qualquer intervalo [início, fim] sai de uma subtração de duas linhas.
+# As somas ficam em int64 na menor unidade da métrica (ESCALA_METRICAS): em float, a subtração de
+# duas somas longas perde casas e o período de um dia diverge do relatório diário.
+AcumuladosCubo = namedtuple("AcumuladosCubo", ["calendario", "celulas", "somas"])
+
+PERIODOS_RELATORIO = ["dia", "semana", "mes", "7d", "30d"]
+COMPARACOES_RELATORIO = ["anterior", "semana", "mes"]
+
+
+@cronometrar("periodo:acumulados")
+def construir_acumulados(cubo):
+    """
+    Monta as somas acumuladas por dia de cada agregado do cubo (dias sem vendas entram com zero).
+    """
+    dias = cubo["dia"].index
+    if dias.empty:
+        calendario = pd.DatetimeIndex([], name='Data')
+    else:
+        calendario = pd.date_range(dias.min(), dias.max(), freq='D', name='Data')
+
+    celulas, somas = {}, {}
+    for nome, tabela in cubo.items():
+        posicoes = calendario.get_indexer(tabela.index.get_level_values('Data')) + 1
+        if AGREGADOS_CUBO[nome]:
+            chaves = tabela.index.droplevel('Data')
+            celulas[nome] = chaves.unique().sort_values()
+            codigos = celulas[nome].get_indexer(chaves)
+        else:
+            codigos, celulas[nome] = np.zeros(len(tabela), dtype=np.int64), None
+        total_celulas = 1 if celulas[nome] is None else len(celulas[nome])
+
+        somas[nome] = {}
+        for metrica in METRICAS_CUBO:
+            valores = tabela[metrica].to_numpy()
+            if metrica in ESCALA_METRICAS:
+                unidades = _em_unidades(valores, ESCALA_METRICAS[metrica])
+                # Fora da grade (dados fora do padrão) a soma fica em float
+                valores = valores if unidades is None else unidades.astype(np.int64)
+            matriz = np.zeros((len(calendario) + 1, total_celulas), dtype=valores.dtype)
+            matriz[posicoes, codigos] = valores
+            somas[nome][metrica] = np.cumsum(matriz, axis=0, out=matriz)
+
+    return AcumuladosCubo(calendario, celulas, somas)
+
+
+def consultar_periodo(acumulados, inicio, fim, agregados=None):
+    """
+    Retorna os agregados somados no intervalo [inicio, fim] (mesmo formato de consultar_cubo) ou None se não houve vendas.
+    """
+    calendario = acumulados.calendario
+    i = calendario.searchsorted(pd.Timestamp(inicio), side='left')
+    j = calendario.searchsorted(pd.Timestamp(fim), side='right')
+    if i >= j or acumulados.somas["dia"]['Contagem'][j, 0] == acumulados.somas["dia"]['Contagem'][i, 0]:
+        return None
+
+    resultado = {}
+    for nome in (agregados if agregados is not None else acumulados.somas):
+        if nome == "dia" or nome not in acumulados.somas:
+            continue
+        somas = {metrica: acumulado[j] - acumulado[i] for metrica, acumulado in acumulados.somas[nome].items()}
+        for metrica, escala in ESCALA_METRICAS.items():
+            if somas[metrica].dtype == np.int64:
+                somas[metrica] = somas[metrica] / escala
+        ocupadas = somas['Contagem'] > 0
+        resultado[nome] = pd.DataFrame({metrica: soma[ocupadas] for metrica, soma in somas.items()},
+                                       index=acumulados.celulas[nome][ocupadas])
+    return resultado
+
+
+def janelas_periodo(dia, periodo="dia", comparar="anterior", data_inicio=None):
+    """
+    Retorna (início, fim, início da comparação, fim da comparação) do período que termina em `dia`.
+    periodo: "dia", "semana" (desde segunda), "mes" (desde o dia 1), "7d" ou "30d"; `data_inicio` fixa o início.
+    comparar: "anterior" (janela de mesmo tamanho logo antes), "semana" (7 dias antes) ou "mes" (um mês antes).
+    """
+    fim = pd.to_datetime(dia).normalize()
+    if data_inicio is not None:
+        inicio = pd.to_datetime(data_inicio).normalize()
+    elif periodo == "dia":
+        inicio = fim
+    elif periodo == "semana":
+        inicio = fim - pd.Timedelta(days=fim.weekday())
+    elif periodo == "mes":
+        inicio = fim.replace(day=1)
+    elif periodo in ("7d", "30d"):
+        inicio = fim - pd.Timedelta(days=int(periodo[:-1]) - 1)
+    else:
+        raise ValueError(f"Período '{periodo}' inválido. Use um de {PERIODOS_RELATORIO}.")
+    if inicio > fim:
+        raise ValueError("A data de início é posterior à data final.")
+
+    if comparar == "anterior":
+        duracao = fim - inicio + pd.Timedelta(days=1)
+        return inicio, fim, inicio - duracao, fim - duracao
+    if comparar == "semana":
+        return inicio, fim, inicio - pd.Timedelta(days=7), fim - pd.Timedelta(days=7)
+    if comparar == "mes":
+        return inicio, fim, inicio - pd.DateOffset(months=1), fim - pd.DateOffset(months=1)
+    raise ValueError(f"Comparação '{comparar}' inválida. Use uma de {COMPARACOES_RELATORIO}.")
+
+
+@cronometrar("relatorio_periodo")
+def relatorio_periodo_com_variacoes(inicio, fim, inicio_comparacao, fim_comparacao, acumulados, tabelas=None):
+    """
+    Mesmas tabelas de relatorio_por_dia_com_variacoes, somadas em [inicio, fim] e comparadas
+    com [inicio_comparacao, fim_comparacao]. O custo não depende do tamanho dos intervalos.
+    """
+    pedidas, agregados_usados = _tabelas_pedidas(tabelas)
+
+    agregados_periodo = consultar_periodo(acumulados, inicio, fim, agregados_usados)
+    if agregados_periodo is None:
+        return {}
+    agregados_comparacao = consultar_periodo(acumulados, inicio_comparacao, fim_comparacao, agregados_usados)
+    return _montar_relatorio(pedidas, agregados_periodo, agregados_comparacao)
+
+
+# --- ALERTAS ---
+# Cada regra compara uma métrica de um agregado do cubo, por categoria, com um limite:
+# pelo valor do dia ("valor") ou pela variação percentual contra o dia anterior ("variacao").
+RegraAlerta = namedtuple("RegraAlerta", ["agregado", "metrica", "comparacao", "operador", "limite", "categorias", "tipo", "mensagem"])
+
+OPERADORES_ALERTA = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le}
+
+REGRAS_ALERTA = {
+    "cidade_acima_30k": RegraAlerta("cidade", "Total", "valor", ">", 30000, None, "positivo",
+                                    "As cidades **{itens}** ultrapassaram R$30.000 em vendas totais."),
+    "queda_cidade": RegraAlerta("cidade", "Total", "variacao", "<", -30, None, "negativo",
+                                "As cidades **{itens}** tiveram uma queda superior a 30% nas vendas."),
+    "aumento_pix": RegraAlerta("pagamento", "Total", "variacao", ">", 30, ["Pix"], "positivo",
+                               "O método de pagamento **{itens}** apresentou um aumento superior a 30% ({valor:.1f}%) nas vendas."),
+    "produtos_acima_400": RegraAlerta("linha_produto", "Quantity", "valor", ">", 400, None, "positivo",
+                                      "Os produtos **{itens}** tiveram mais de 400 vendas."),
+}
+
+
+def _avaliar_regra(cubo, regra, calendario, tem_vendas):
+    # Matriz dia x categoria em todos os dias do calendário (0 onde não houve venda)
+    atual = cubo[regra.agregado][regra.metrica].unstack(fill_value=0).reindex(calendario, fill_value=0)
+    if regra.categorias is not None:
+        atual = atual.reindex(columns=regra.categorias, fill_value=0)
+    atual.columns = atual.columns.astype(str)
+
+    if regra.comparacao == "valor":
+        valores = atual.astype(float)
+        disparou = OPERADORES_ALERTA[regra.operador](valores, regra.limite)
+    else:
+        # Mesma conta do relatório: variação = atual - anterior e anterior = atual - variação
+        anterior_tem_vendas = np.zeros_like(tem_vendas)
+        anterior_tem_vendas[1:] = tem_vendas[:-1]
+        variacao = atual - atual.shift(1, fill_value=0)
+        anterior = atual - variacao
+        valida = (anterior > 0) & anterior_tem_vendas[:, None]
+        valores = (variacao / anterior.where(valida)) * 100
+        disparou = valida & OPERADORES_ALERTA[regra.operador](valores, regra.limite)
+
+    disparou = disparou[tem_vendas]
+    dia, categoria = np.nonzero(disparou.to_numpy())
+    return pd.DataFrame({
+        'Data': disparou.index[dia],
+        'categoria': disparou.columns[categoria],
+        'valor': valores[tem_vendas].to_numpy()[dia, categoria],
+    })
+
+
+@cronometrar("alertas:tabela")
+def construir_tabela_alertas(cubo, regras=None):
+    """
+    Avalia as regras em todos os dias do cubo de uma vez, comparando cada dia com o dia anterior do calendário.
+    Retorna uma linha por (dia, regra, categoria) que disparou, indexada e ordenada por 'Data'.
+    """
+    regras = REGRAS_ALERTA if regras is None else regras
+    dias_com_vendas = cubo["dia"].index
+    if dias_com_vendas.empty:
+        calendario = pd.DatetimeIndex([], name='Data')
+    else:
+        calendario = pd.date_range(dias_com_vendas.min(), dias_com_vendas.max(), freq='D', name='Data')
+    tem_vendas = calendario.isin(dias_com_vendas)
+
+    partes = []
+    for ordem, (nome, regra) in enumerate(regras.items()):
+        parte = _avaliar_regra(cubo, regra, calendario, tem_vendas)
+        partes.append(parte.assign(regra=nome, ordem=ordem))
+
+    tabela = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['Data', 'categoria', 'valor', 'regra', 'ordem'])
+    tabela = tabela.sort_values(['Data', 'ordem'], kind='stable')
+    return tabela[['Data', 'regra', 'categoria', 'valor']].set_index('Data')
+
+
+def alertas_por_dia(tabela_alertas, regras=None):
+    """
+    Tabela dia x regra com o número de categorias que dispararam (só os dias com algum alerta).
+    """
+    regras = REGRAS_ALERTA if regras is None else regras
+    return (pd.crosstab(tabela_alertas.index, tabela_alertas['regra'])
+            .reindex(columns=list(regras), fill_value=0)
+            .rename_axis(index='Data', columns=None))
+
+
+@cronometrar("alertas:dia")
+def alertas_do_dia(tabela_alertas, dia, regras=None):
+    """
+    Monta as mensagens de alerta de um dia a partir da tabela de alertas.
+    """
+    regras = REGRAS_ALERTA if regras is None else regras
+    dia_timestamp = pd.to_datetime(dia).normalize()
+    do_dia = tabela_alertas.loc[dia_timestamp:dia_timestamp]
+
+    alertas = {"positivo": [], "negativo": []}
+    for nome, disparos in do_dia.groupby('regra', sort=False):
+        regra = regras[nome]
+        itens = ", ".join(disparos['categoria'])
+        alertas[regra.tipo].append(regra.mensagem.format(itens=itens, valor=disparos['valor'].iloc[0]))
+
+    return {
+        "alertas_positivos": alertas["positivo"],
+        "alertas_negativos": alertas["negativo"],
+        "total_alertas": len(alertas["positivo"]) + len(alertas["negativo"])
+    }
+
+
+# --- RESPOSTAS DA API ---
+# report_name da API -> (tabela, tabela de variação, tipo de normalização)
+MAPEAMENTO_RELATORIOS = {
+    "total_por_cidade": ("total_por_cidade", "variacao_cidade", "sum"),
+    "total_por_linha_produto": ("total_por_linha_produto", "variacao_linha_produto", "sum"),
+    "total_por_tipo_cliente": ("total_por_tipo_cliente", "variacao_tipo_cliente", "sum"),
+    "total_por_payment": ("total_por_payment", "variacao_payment", "sum"),
+    "total_por_genero": ("total_por_genero", "variacao_genero", "sum"),
+    "vendas_por_hora": ("vendas_por_hora", "var_vendas_por_hora", "sum"),
+    "distribuicao_cidade_tipo": ("crosstab_cidade_tipo_cliente", "variacao_cidade_tipo_cliente", "cross"),
+    "distribuicao_cidade_genero_tipo": ("crosstab_cidade_genero", "variacao_cidade_genero", "cross"),
+    "ticket_medio_cidade": ("ticket_medio_cidade", "var_ticket_medio_cidade", "metric"),
+    "rating_produto": ("rating_produto", "var_rating_produto", "metric"),
+    "rating_pagamento": ("rating_pagamento", "var_rating_pagamento", "metric"),
+    "total_por_fonte": ("total_por_fonte", "variacao_fonte", "sum"),
+}
+
+ERRO_SEM_AGREGADO = "Relatório '{}' indisponível: os dados não têm a coluna usada por ele (ex.: 'Fonte' com uma aba só)."
+
+# Formatos da rota get_report: "records" (padrão, lista de dicionários usada pelo n8n) ou um corpo pronto
+# com seu Content-Type, gerado direto das colunas sem montar um objeto Python por linha
+FORMATOS_RESPOSTA = {
+    "records": "application/json; charset=utf-8",
+    "colunas": "application/json; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+RespostaBinaria = namedtuple("RespostaBinaria", ["corpo", "tipo"])
+
+
+def tabela_relatorio_api(df_main, df_var, report_type):
+    """
+    Junta a tabela com sua variação e normaliza (arredonda) no formato devolvido ao n8n.
+    """
+    if report_type == "sum":
+        df_final = pd.concat([df_main, df_var.rename(columns={"Total": "Var. Total", "Quantity": "Var. Quantity"})], axis=1)
+    elif report_type == "metric":
+        df_final = pd.concat([df_main, df_var.add_prefix("Var. ")], axis=1)
+    else: # cross
+        df_final = pd.concat([df_main, df_var.add_suffix(" (Var)")], axis=1).fillna(0)
+
+    # Normalização (Arredondamento)
+    if report_type == "sum":
+        cols_money = [c for c in df_final.columns if "Total" in c]
+        df_final[cols_money] = df_final[cols_money].round(2)
+        cols_qty = [c for c in df_final.columns if "Quantity" in c]
+        df_final[cols_qty] = df_final[cols_qty].fillna(0).astype(int)
+    elif report_type == "metric":
+        is_rating = any("Rating" in c for c in df_final.columns)
+        decimals = 1 if is_rating else 2
+        df_final = df_final.round(decimals)
+    else:
+        df_final = df_final.fillna(0).astype(int)
+
+    return df_final.fillna(0).reset_index()
+
+
+@cronometrar("api:formatacao")
+def formatar_relatorio_api(df_main, df_var, report_type, formato="records"):
+    """
+    Tabela final do relatório como lista de registros (formato "records") ou RespostaBinaria nos demais formatos.
+    """
+    tabela = tabela_relatorio_api(df_main, df_var, report_type)
+    if formato == "records":
+        return tabela.to_dict(orient="records")
+    return RespostaBinaria(serializar_tabela(tabela, formato), FORMATOS_RESPOSTA[formato])
+
+
+def serializar_tabela(tabela, formato):
+    """
+    Serializa o DataFrame em bytes: "colunas" (JSON compacto {"colunas": [...], "dados": {coluna: [valores]}}),
+    "csv" ou "arrow" (Arrow IPC em stream).
+    """
+    if formato == "colunas":
+        dados = {str(col): tabela[col].tolist() for col in tabela.columns}
+        return json.dumps({"colunas": list(dados), "dados": dados}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if formato == "csv":
+        return tabela.to_csv(index=False).encode("utf-8")
+    if formato == "arrow":
+        import pyarrow as pa  # só quem pede Arrow paga a importação
+
+        tabela_arrow = pa.Table.from_pandas(tabela, preserve_index=False)
+        saida = pa.BufferOutputStream()
+        with pa.ipc.new_stream(saida, tabela_arrow.schema) as escritor:
+            escritor.write_table(tabela_arrow)
+        return saida.getvalue().to_pybytes()
+    raise ValueError(f"Formato '{formato}' inválido. Use um de {list(FORMATOS_RESPOSTA)}.")
+
+
+def resposta_get_report(target_date, report_name, data_df, indice_dias=None, cubo=None, formato="records"):
+    """
+    Calcula só o relatório pedido (e sua variação) e devolve o JSON da rota get_report.
+    """
+    if report_name not in MAPEAMENTO_RELATORIOS:
+        if cubo is not None:
+            tem_vendas = dia_tem_vendas(cubo, target_date)
+        else:
+            tem_vendas = bool(relatorio_por_dia_com_variacoes(pd.to_datetime(target_date), data_df, indice_dias, tabelas=["total_por_cidade"]))
+        if not tem_vendas:
+            return {"erro": "Nenhum dado encontrado para a data informada."}
+        return {"erro": f"Relatório '{report_name}' não encontrado no mapeamento."}
+
+    key_data, key_var, report_type = MAPEAMENTO_RELATORIOS[report_name]
+    agregado = TABELAS_RELATORIO[key_data][2]
+    if agregado not in (cubo if cubo is not None else agregados_disponiveis(data_df, [agregado])):
+        return {"erro": ERRO_SEM_AGREGADO.format(report_name)}
+    relatorio_api = relatorio_por_dia_com_variacoes(pd.to_datetime(target_date), data_df, indice_dias, cubo, tabelas=[key_data])
+
+    if not relatorio_api:
+        return {"erro": "Nenhum dado encontrado para a data informada."}
+
+    return formatar_relatorio_api(relatorio_api[key_data], relatorio_api[key_var], report_type, formato)
+
+
+def resposta_get_report_periodo(target_date, report_name, acumulados, periodo="dia", comparar="anterior", data_inicio=None,
+                                formato="records"):
+    """
+    Relatório pedido somado no período que termina em target_date, com a variação contra a janela de comparação.
+    """
+    if report_name not in MAPEAMENTO_RELATORIOS:
+        return {"erro": f"Relatório '{report_name}' não encontrado no mapeamento."}
+    try:
+        janelas = janelas_periodo(target_date, periodo, comparar, data_inicio)
+    except ValueError as e:
+        return {"erro": str(e)}
+
+    key_data, key_var, report_type = MAPEAMENTO_RELATORIOS[report_name]
+    if TABELAS_RELATORIO[key_data][2] not in acumulados.somas:
+        return {"erro": ERRO_SEM_AGREGADO.format(report_name)}
+    relatorio_api = relatorio_periodo_com_variacoes(*janelas, acumulados, tabelas=[key_data])
+
+    if not relatorio_api:
+        return {"erro": "Nenhum dado encontrado para o período informado."}
+
+    return formatar_relatorio_api(relatorio_api[key_data], relatorio_api[key_var], report_type, formato)
+
+
+def resposta_get_alerts(target_date, data_df, indice_dias=None, cubo=None, tabela_alertas=None):
+    """
+    Lê os alertas do dia na tabela de alertas e devolve o JSON da rota get_alerts.
+    Sem a tabela, avalia as regras só no cubo (ou num cubo com o dia e o anterior).
+    """
+    dia_date = pd.to_datetime(target_date).date()
+    if cubo is None:
+        agregados = list(dict.fromkeys(regra.agregado for regra in REGRAS_ALERTA.values()))
+        cubo = cubo_dos_dois_dias(dia_date, data_df, indice_dias, agregados)
+
+    if cubo is None or not dia_tem_vendas(cubo, dia_date):
+        return {"alertas_positivos": [], "alertas_negativos": [], "total_alertas": 0, "status": "sem_dados"}
+
+    if tabela_alertas is None:
+        tabela_alertas = construir_tabela_alertas(cubo)
+    return alertas_do_dia(tabela_alertas, dia_date)
+
+
+def cubo_da_fonte(data_df, fonte):
+    """
+    Cubo só com as vendas de uma fonte (aba/planilha) da coluna 'Fonte'.
+    """
+    return construir_cubo(data_df[(data_df['Fonte'] == fonte).to_numpy()])
+
+
+def resposta_alertas_por_dia(tabela_alertas):
+    """
+    JSON da rota get_alerts sem target_date: para cada dia com algum alerta, quantas categorias
+    dispararam cada regra.
+    """
+    contagens = alertas_por_dia(tabela_alertas)
+    dias = [{"data": str(dia.date()), **{regra: int(n) for regra, n in linha.items()}} for dia, linha in contagens.iterrows()]
+    return {"regras": list(contagens.columns), "dias": dias, "total_dias": len(dias)}
+
+
+def tabela_alertas_em_cache(cache_api, versao, cubo):
+    """
+    Tabela de alertas de todo o histórico, avaliada uma vez por versão dos dados no cache da API
+    (o dashboard usa a mesma entrada que a rota get_alerts).
+    """
+    return cache_api.obter((versao, "tabela_alertas"), lambda: construir_tabela_alertas(cubo))
+
+
+# Parâmetros opcionais da rota get_report para relatórios de período
+PARAMETROS_PERIODO = ["periodo", "comparar", "data_inicio"]
+
+
+def resposta_api(parametros, data_df, versao, indice_dias, cubo, cache_api, cubo_fonte=None):
+    """
+    Resolve as rotas usadas pelo n8n (get_report e get_alerts) a partir dos parâmetros da URL.
+    get_alerts sem target_date devolve o resumo de alertas por dia de todo o histórico.
+    Com `fonte`, as duas rotas olham só as vendas daquela aba/planilha; sem as linhas em memória
+    (estado agregado), o cubo da fonte vem de `cubo_fonte(fonte)` (ex.: ArmazenamentoSQLite.cubo).
+    Retorna None quando os parâmetros não correspondem a nenhuma rota.
+    """
+    request_type = parametros.get("request_type")
+    target_date = parametros.get("target_date")
+    report_name = parametros.get("report_name")
+
+    fonte = parametros.get("fonte")
+    if fonte and request_type in ("get_report", "get_alerts"):
+        # Relatórios e alertas de uma fonte só: cubo próprio, em cache por versão; as chaves abaixo
+        # passam a incluir a fonte porque a versão vira (versão, fonte)
+        if data_df is not None:
+            if 'Fonte' not in data_df.columns:
+                return {"erro": "Filtro por fonte indisponível: os dados não têm a coluna 'Fonte'."}
+            fontes = list(data_df['Fonte'].cat.categories)
+            cubo_fonte = lambda fonte: cubo_da_fonte(data_df, fonte)
+        elif cubo_fonte is not None:
+            # As fontes do estado agregado são as do agregado 'fonte' do cubo (ausente com uma fonte só)
+            fontes = list(cubo["fonte"].index.get_level_values('Fonte').categories) if "fonte" in cubo else []
+        else:
+            return {"erro": "Filtro por fonte indisponível: o estado atual não tem as linhas nem o cubo por fonte."}
+        if fonte not in fontes:
+            return {"erro": f"Fonte '{fonte}' não encontrada. Use uma de {fontes}."}
+        cubo = cache_api.obter((versao, "cubo", fonte), lambda: cubo_fonte(fonte))
+        versao, indice_dias = (versao, fonte), None
+
+    # ---------------------------------------------------------
+    # ROTA 1: BUSCAR RELATÓRIOS (TABELAS)
+    # ---------------------------------------------------------
+    if request_type == "get_report" and target_date and report_name:
+        formato = parametros.get("format") or "records"
+        if formato not in FORMATOS_RESPOSTA:
+            return {"erro": f"Formato '{formato}' inválido. Use um de {list(FORMATOS_RESPOSTA)}."}
+
+        if any(parametros.get(p) for p in PARAMETROS_PERIODO):
+            # Períodos (periodo, comparar, data_inicio) saem das somas acumuladas, montadas uma vez por versão dos dados
+            periodo = {p: parametros[p] for p in PARAMETROS_PERIODO if parametros.get(p)}
+            chave = (versao, pd.to_datetime(target_date).date(), report_name, tuple(sorted(periodo.items())), formato)
+            acumulados = lambda: cache_api.obter((versao, "acumulados"), lambda: construir_acumulados(cubo))
+            with medir("api:get_report"):
+                return cache_api.obter(chave, lambda: resposta_get_report_periodo(target_date, report_name, acumulados(), **periodo, formato=formato))
+
+        chave = (versao, pd.to_datetime(target_date).date(), report_name) + (() if formato == "records" else (formato,))
+        with medir("api:get_report"):
+            return cache_api.obter(chave, lambda: resposta_get_report(target_date, report_name, data_df, indice_dias, cubo, formato))
+
+    # ---------------------------------------------------------
+    # ROTA 2: BUSCAR ALERTAS
+    # ---------------------------------------------------------
+    if request_type == "get_alerts" and target_date:
+        chave = (versao, pd.to_datetime(target_date).date(), "get_alerts")
+        with medir("api:get_alerts"):
+            return cache_api.obter(chave, lambda: resposta_get_alerts(
+                target_date, data_df, indice_dias, cubo, tabela_alertas_em_cache(cache_api, versao, cubo)))
+
+    if request_type == "get_alerts":
+        # Sem target_date: o resumo de alertas de todos os dias, tirado da mesma tabela
+        with medir("api:get_alerts"):
+            return cache_api.obter((versao, "get_alerts"), lambda: resposta_alertas_por_dia(
+                tabela_alertas_em_cache(cache_api, versao, cubo)))
+
+    return None
+
+
+# --- CACHE DE RESULTADOS ---
+class CacheLRU:
+    """
+    Cache limitado em número de itens e, opcionalmente, em bytes (medidos por `tamanho`);
+    descarta o usado há mais tempo. Seguro entre threads. Com `nome`, conta acertos e faltas nas métricas.
+    """
+    def __init__(self, max_itens=256, max_bytes=None, tamanho=None, nome=None):
+        self.nome = nome
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.tamanho = tamanho
+        self._itens = OrderedDict()
+        self._bytes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def contem(self, chave):
+        with self._lock:
+            return chave in self._itens
+
+    def obter(self, chave, calcular):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                if self.nome:
+                    contar("cache", cache=self.nome, resultado="acerto")
+                return self._itens[chave]
+
+        if self.nome:
+            contar("cache", cache=self.nome, resultado="falta")
+        valor = calcular()
+        bytes_valor = self.tamanho(valor) if self.tamanho is not None else 0
+
+        with self._lock:
+            self._total_bytes += bytes_valor - self._bytes.get(chave, 0)
+            self._itens[chave] = valor
+            self._bytes[chave] = bytes_valor
+            self._itens.move_to_end(chave)
+            # O item recém-calculado fica mesmo se sozinho passar do orçamento
+            while len(self._itens) > 1 and (len(self._itens) > self.max_itens
+                                            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+                antiga, _ = self._itens.popitem(last=False)
+                self._total_bytes -= self._bytes.pop(antiga)
+                if self.nome:
+                    contar("cache", cache=self.nome, resultado="descarte")
+        return valor
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes.clear()
+            self._total_bytes = 0
+
+
+def tamanho_relatorio(relatorio):
+    """
+    Bytes ocupados pelas tabelas de um relatório (para o orçamento do CacheLRU).
+    """
+    return int(sum(tabela.memory_usage(deep=True).sum() for tabela in relatorio.values()))
+
+
+class PreCarregador:
+    """
+    Calcula em segundo plano (uma thread) valores que provavelmente serão pedidos e os guarda no cache.
+    Pedidos prioritários passam na frente; quando a fila enche, descarta os menos prioritários.
+    """
+    def __init__(self, cache, max_pendentes=64):
+        self.cache = cache
+        self.max_pendentes = max_pendentes
+        self._pendentes = OrderedDict()
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def agendar(self, itens, prioritario=False):
+        """
+        `itens` são pares (chave, calcular), do mais para o menos provável.
+        """
+        itens = [(chave, calcular) for chave, calcular in itens if not self.cache.contem(chave)]
+        with self._condicao:
+            for chave, calcular in (reversed(itens) if prioritario else itens):
+                self._pendentes[chave] = calcular
+                if prioritario:
+                    self._pendentes.move_to_end(chave, last=False)
+            while len(self._pendentes) > self.max_pendentes:
+                self._pendentes.popitem(last=True)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._trabalhar, name="pre-carregador", daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+
+    def _trabalhar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+                chave, calcular = self._pendentes.popitem(last=False)
+            try:
+                self.cache.obter(chave, calcular)
+            except Exception:
+                # Quem pedir o valor de verdade recalcula e vê o erro
+                pass
@@ -0,0 +1,220 @@
+"""
+Servidor HTTP mínimo com as rotas usadas pelo n8n (get_report e get_alerts),
+sem passar por uma sessão do Streamlit.
+
+Exemplos:
+    python servidor_api.py --secrets .streamlit/secrets.toml
+    python servidor_api.py --arquivo vendas.parquet --porta 8600
+    python servidor_api.py --sintetico 90 --semente 42
+    python servidor_api.py --sqlite .cache/vendas.db   # espelho local (python armazenamento.py), também com fonte=
+
+    # Partida rápida num container novo: no build/deploy, sincroniza e grava o snapshot e o cubo...
+    python servidor_api.py --secrets .streamlit/secrets.toml --pasta-cubo .cache/cubo --aquecer
+    # ...e o servidor (ou o dashboard, com o mesmo cubo_path) responde com eles enquanto sincroniza em segundo plano
+    python servidor_api.py --secrets .streamlit/secrets.toml --pasta-cubo .cache/cubo
+
+    curl "http://localhost:8502/?request_type=get_report&target_date=2024-05-01&report_name=total_por_cidade"
+    curl "http://localhost:8502/?request_type=get_report&target_date=2024-05-15&report_name=total_por_cidade&periodo=mes&comparar=mes"
+    curl "http://localhost:8502/?request_type=get_report&target_date=2024-05-01&report_name=total_por_cidade&format=arrow" -o cidade.arrow
+    curl "http://localhost:8502/?request_type=get_alerts&target_date=2024-05-01&fonte=Loja%20Centro"   # com [gsheets] fontes
+    curl "http://localhost:8502/?request_type=get_alerts"   # alertas por dia e regra, de todo o histórico
+    curl "http://localhost:8502/metrics"   # com --metricas
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import metricas
+from armazenamento import ArmazenamentoSQLite
+from base_dados import BaseVendas, montar_estado, montar_estado_agregado
+from gerador_dados import gerar_vendas
+from planilhas import carregar_vendas, carregar_vendas_local, ler_segredos, tratar_tipos
+from relatorios import PASTA_CUBO_PADRAO, CacheLRU, RespostaBinaria, resposta_api
+
+# --- FONTES DE DADOS ---
+# Cada fonte é uma função sem argumentos que retorna (DataFrame tratado e ordenado, versão dos dados).
+
+def fonte_sheets(caminho_segredos):
+    segredos = ler_segredos(caminho_segredos)
+    return lambda: carregar_vendas(segredos)
+
+
+def copia_local_sheets(caminho_segredos):
+    """
+    Último snapshot local da planilha (sem rede), para o BaseVendas responder enquanto sincroniza.
+    """
+    segredos = ler_segredos(caminho_segredos)
+    return lambda: carregar_vendas_local(segredos)
+
+
+def fonte_arquivo(caminho):
+    """
+    Planilha exportada em Parquet ou CSV, com as mesmas colunas do Google Sheets.
+    """
+    def carregar():
+        info = os.stat(caminho)
+        df_bruto = pd.read_parquet(caminho) if caminho.endswith(".parquet") else pd.read_csv(caminho)
+        df = tratar_tipos(df_bruto).sort_values('Data', kind='stable', ignore_index=True)
+        return df, f"arquivo:{info.st_mtime_ns}:{info.st_size}"
+    return carregar
+
+
+def fonte_sintetica(dias, semente=None):
+    """
+    Histórico gerado localmente com `dias` dias de vendas, para testes de carga sem o Google.
+    """
+    def carregar():
+        inicio = datetime.date.today() - datetime.timedelta(days=dias)
+        df = tratar_tipos(gerar_vendas(inicio, dias, semente))
+        return df, f"sintetico:{dias}:{semente}"
+    return carregar
+
+
+def fonte_sqlite(caminho):
+    """
+    Banco SQLite local (espelho da planilha). Só consulta a versão; o cubo é agregado no banco
+    por montar_estado_agregado, sem trazer as linhas para o pandas.
+    Retorna (carregar, montar) para o BaseVendas.
+    """
+    armazenamento = ArmazenamentoSQLite(caminho)
+    carregar = lambda: (None, armazenamento.versao())
+    montar = lambda df, versao, pasta_cubo: montar_estado_agregado(armazenamento, versao, pasta_cubo)
+    return carregar, montar
+
+
+def adicionar_argumentos_fonte(parser):
+    fonte = parser.add_mutually_exclusive_group(required=True)
+    fonte.add_argument("--secrets", help="secrets.toml com gcp_service_account e gsheets (mesmo formato do Streamlit)")
+    fonte.add_argument("--arquivo", help="Parquet/CSV local com as colunas da planilha")
+    fonte.add_argument("--sintetico", type=int, metavar="DIAS", help="gera um histórico sintético com DIAS dias")
+    fonte.add_argument("--sqlite", help="banco SQLite local mantido por armazenamento.py (agregação no banco)")
+    parser.add_argument("--semente", type=int, default=None, help="semente do histórico sintético")
+
+
+def fonte_dos_argumentos(args):
+    """
+    (carregar, montar) para o BaseVendas a partir dos argumentos de adicionar_argumentos_fonte.
+    """
+    if args.secrets:
+        return fonte_sheets(args.secrets), montar_estado
+    if args.arquivo:
+        return fonte_arquivo(args.arquivo), montar_estado
+    if args.sqlite:
+        return fonte_sqlite(args.sqlite)
+    return fonte_sintetica(args.sintetico, args.semente), montar_estado
+
+
+def cubo_fonte_dos_argumentos(args):
+    # Com --sqlite o estado só tem o cubo: o cubo de cada fonte também é agregado no banco
+    if args.sqlite:
+        armazenamento = ArmazenamentoSQLite(args.sqlite)
+        return lambda fonte: armazenamento.cubo(fonte=fonte)
+    return None
+
+
+def copia_local_dos_argumentos(args):
+    # Só a planilha depende de rede; as outras fontes já são locais
+    return copia_local_sheets(args.secrets) if args.secrets else None
+
+
+# --- HTTP ---
+
+class ManipuladorAPI(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._enviar(200, metricas.texto_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        parametros = {chave: valores[-1] for chave, valores in parse_qs(url.query).items()}
+
+        try:
+            estado = self.server.base.estado()
+            resposta = resposta_api(parametros, estado.df, estado.versao, estado.indice_dias, estado.cubo, self.server.cache_api,
+                                    self.server.cubo_fonte)
+        except Exception as e:
+            self._enviar_json(500, {"erro": f"Erro ao processar a requisição: {e}"})
+            return
+
+        if resposta is None:
+            self._enviar_json(400, {"erro": "Parâmetros inválidos. Use request_type=get_report com target_date e report_name, ou request_type=get_alerts (target_date opcional)."})
+        elif isinstance(resposta, RespostaBinaria):
+            self._enviar(200, resposta.corpo, resposta.tipo)
+        else:
+            self._enviar_json(200, resposta)
+
+    def _enviar_json(self, status, conteudo):
+        with metricas.medir("api:json"):
+            corpo = json.dumps(conteudo, ensure_ascii=False, default=str).encode("utf-8")
+        self._enviar(status, corpo, "application/json; charset=utf-8")
+
+    def _enviar(self, status, corpo, tipo):
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        if not self.server.silencioso:
+            super().log_message(formato, *args)
+
+
+def criar_servidor(base, host="0.0.0.0", porta=8502, silencioso=False, cubo_fonte=None):
+    """
+    Cria o servidor (uma thread por requisição) compartilhando a mesma base de dados e o mesmo cache de respostas.
+    `cubo_fonte(fonte)` dá o cubo de uma fonte quando o estado não tem as linhas (ver resposta_api).
+    """
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorAPI)
+    servidor.daemon_threads = True
+    servidor.base = base
+    servidor.cache_api = CacheLRU(max_itens=512, nome="api")
+    servidor.silencioso = silencioso
+    servidor.cubo_fonte = cubo_fonte
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor da API de relatórios de vendas (rotas do n8n).")
+    adicionar_argumentos_fonte(parser)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--ttl", type=int, default=600, help="segundos até recarregar os dados")
+    parser.add_argument("--pasta-cubo", default=None, help=f"persistir o cubo diário (ex.: {PASTA_CUBO_PADRAO})")
+    parser.add_argument("--silencioso", action="store_true", help="não registrar cada requisição")
+    parser.add_argument("--metricas", action="store_true", help="medir as etapas e expor em /metrics (formato Prometheus)")
+    parser.add_argument("--aquecer", action="store_true",
+                        help=f"só sincroniza os dados e grava snapshot e cubo (padrão da pasta: {PASTA_CUBO_PADRAO}), depois sai")
+    args = parser.parse_args()
+
+    if args.metricas:
+        metricas.ativar()
+
+    carregar, montar = fonte_dos_argumentos(args)
+    if args.aquecer:
+        inicio = time.monotonic()
+        estado = BaseVendas(carregar, pasta_cubo=args.pasta_cubo or PASTA_CUBO_PADRAO, montar=montar).estado()
+        print(f"Dados da versão {estado.versao} sincronizados e cubo gravado em {time.monotonic() - inicio:.1f}s")
+        return
+
+    base = BaseVendas(carregar, ttl=args.ttl, pasta_cubo=args.pasta_cubo, montar=montar, inicial=copia_local_dos_argumentos(args))
+    base.estado()  # carrega (ou parte do snapshot local) antes de aceitar conexões
+
+    servidor = criar_servidor(base, args.host, args.porta, args.silencioso, cubo_fonte_dos_argumentos(args))
+    print(f"Servidor da API em http://{args.host}:{args.porta}/")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Planilha em memória no lugar do gspread.Worksheet, para os testes e o benchmark rodarem sem o Google.
+"""
+import re
+
+import planilhas
+
+
+class _RespostaFalsa:
+    def __init__(self, codigo, mensagem, status):
+        self.status_code = codigo
+        self.text = mensagem
+        self._erro = {"code": codigo, "message": mensagem, "status": status}
+
+    def json(self):
+        return {"error": self._erro}
+
+
+class PlanilhaEmMemoria:
+    """
+    Imita os métodos do gspread.Worksheet usados neste projeto, guardando os valores em memória.
+    Como a API com UNFORMATTED_VALUE, números voltam como número (5.0 gravado volta como 5) e texto como texto.
+    `falhas` é uma lista consumida a cada append_rows: um código HTTP (ex.: 429) faz a chamada
+    falhar com APIError; None deixa a chamada passar.
+    """
+    def __init__(self, valores=None, falhas=None):
+        self.valores = [[self._celula(v) for v in linha] for linha in (valores or [])]
+        self.falhas = list(falhas or [])
+        self.chamadas = []
+
+    @staticmethod
+    def _celula(valor):
+        if valor is None:
+            return ""
+        return planilhas._valor_celula(valor) if isinstance(valor, (int, float)) else str(valor)
+
+    def row_values(self, linha):
+        self.chamadas.append(("row_values", linha))
+        return list(self.valores[linha - 1]) if len(self.valores) >= linha else []
+
+    def get_all_values(self, **kwargs):
+        self.chamadas.append(("get_all_values",))
+        return [list(linha) for linha in self.valores]
+
+    def get(self, intervalo, **kwargs):
+        self.chamadas.append(("get", intervalo))
+        primeira_linha = int(re.match(r"[A-Z]+(\d+)", intervalo).group(1))
+        return [list(linha) for linha in self.valores[primeira_linha - 1:]]
+
+    def append_rows(self, linhas, **kwargs):
+        from gspread.exceptions import APIError
+        from gspread.utils import rowcol_to_a1
+
+        self.chamadas.append(("append_rows", len(linhas)))
+        codigo = self.falhas.pop(0) if self.falhas else None
+        if codigo is not None:
+            status = {429: "RESOURCE_EXHAUSTED"}.get(codigo, "UNAVAILABLE" if codigo >= 500 else "INVALID_ARGUMENT")
+            raise APIError(_RespostaFalsa(codigo, f"Erro {codigo} simulado", status))
+        primeira_linha = len(self.valores) + 1
+        self.valores.extend([[self._celula(v) for v in linha] for linha in linhas])
+        largura = rowcol_to_a1(1, max(len(linha) for linha in linhas)).rstrip("0123456789") if linhas else "A"
+        intervalo = f"'Planilha'!A{primeira_linha}:{largura}{primeira_linha + len(linhas) - 1}"
+        return {"updates": {"updatedRange": intervalo, "updatedRows": len(linhas)}}
@@ -0,0 +1,155 @@
+import json
+
+import pytest
+from gspread.exceptions import APIError
+
+from planilhas import anexar_em_lotes
+from tests.planilha_falsa import PlanilhaEmMemoria
+
+CABECALHO = ["Invoice ID", "Total"]
+
+
+def linhas_de_teste(quantidade, inicio=0):
+    return [[f"id-{i}", f"{i}.50"] for i in range(inicio, inicio + quantidade)]
+
+
+def planilha(falhas=None):
+    return PlanilhaEmMemoria([CABECALHO], falhas=falhas)
+
+
+def tamanhos_dos_appends(worksheet):
+    return [chamada[1] for chamada in worksheet.chamadas if chamada[0] == "append_rows"]
+
+
+def test_divide_em_lotes_por_quantidade_de_linhas():
+    worksheet, linhas = planilha(), linhas_de_teste(12)
+
+    estatisticas = anexar_em_lotes(worksheet, linhas, max_linhas=5)
+
+    assert tamanhos_dos_appends(worksheet) == [5, 5, 2]
+    assert worksheet.valores[1:] == linhas
+    assert estatisticas["lotes"] == 3
+    assert estatisticas["linhas"] == 12
+    assert estatisticas["primeira_linha"] == 2
+
+
+def test_divide_em_lotes_por_tamanho():
+    worksheet, linhas = planilha(), linhas_de_teste(6)
+    # Limite do tamanho de duas linhas (todas têm o mesmo tamanho aproximado): duas por lote
+    tamanho_linha = sum(len(str(valor)) + 4 for valor in linhas[0])
+
+    anexar_em_lotes(worksheet, linhas, max_bytes=2 * tamanho_linha)
+
+    assert tamanhos_dos_appends(worksheet) == [2, 2, 2]
+    assert worksheet.valores[1:] == linhas
+
+
+def test_linha_maior_que_o_limite_vai_sozinha():
+    worksheet, linhas = planilha(), linhas_de_teste(3)
+
+    anexar_em_lotes(worksheet, linhas, max_bytes=1)
+
+    assert tamanhos_dos_appends(worksheet) == [1, 1, 1]
+
+
+def test_repete_erro_de_cota_com_backoff():
+    worksheet, linhas = planilha(falhas=[429, 429]), linhas_de_teste(3)
+    esperas = []
+
+    estatisticas = anexar_em_lotes(worksheet, linhas, espera_inicial=1.0, dormir=esperas.append)
+
+    assert worksheet.valores[1:] == linhas
+    assert estatisticas["novas_tentativas"] == 2
+    assert len(esperas) == 2
+    # Backoff exponencial com jitter entre metade e o valor cheio
+    assert 0.5 <= esperas[0] <= 1.0
+    assert 1.0 <= esperas[1] <= 2.0
+
+
+def test_desiste_depois_do_maximo_de_tentativas():
+    worksheet = planilha(falhas=[429, 429, 429])
+
+    with pytest.raises(APIError):
+        anexar_em_lotes(worksheet, linhas_de_teste(2), max_tentativas=3, dormir=lambda _: None)
+
+    assert tamanhos_dos_appends(worksheet) == [2, 2, 2]
+    assert worksheet.valores == [CABECALHO]
+
+
+@pytest.mark.parametrize("codigo", [500, 503, 400])
+def test_nao_repete_erro_que_nao_e_de_cota(codigo):
+    # Num 5xx o lote pode ter sido gravado: repetir duplicaria as linhas
+    worksheet, esperas = planilha(falhas=[codigo]), []
+
+    with pytest.raises(APIError):
+        anexar_em_lotes(worksheet, linhas_de_teste(2), dormir=esperas.append)
+
+    assert tamanhos_dos_appends(worksheet) == [2]
+    assert esperas == []
+
+
+def test_retoma_do_arquivo_de_progresso(tmp_path):
+    arquivo_progresso = str(tmp_path / "gravacao.progresso.json")
+    linhas = linhas_de_teste(12)
+    worksheet = planilha(falhas=[None, 503])
+
+    with pytest.raises(APIError):
+        anexar_em_lotes(worksheet, linhas, max_linhas=5, arquivo_progresso=arquivo_progresso)
+    with open(arquivo_progresso, encoding="utf-8") as f:
+        assert json.load(f)["linhas_gravadas"] == 5
+
+    estatisticas = anexar_em_lotes(worksheet, linhas, max_linhas=5, arquivo_progresso=arquivo_progresso)
+
+    assert worksheet.valores[1:] == linhas
+    assert tamanhos_dos_appends(worksheet) == [5, 5, 5, 2]
+    assert estatisticas["retomado_de"] == 5
+    assert estatisticas["linhas"] == 7
+    # Retomado: as linhas da execução anterior não passam pelo write-through
+    assert estatisticas["primeira_linha"] is None
+    assert not (tmp_path / "gravacao.progresso.json").exists()
+
+
+def test_progresso_de_outras_linhas_e_ignorado(tmp_path):
+    arquivo_progresso = str(tmp_path / "gravacao.progresso.json")
+    worksheet = planilha(falhas=[None, 503])
+    with pytest.raises(APIError):
+        anexar_em_lotes(worksheet, linhas_de_teste(12), max_linhas=5, arquivo_progresso=arquivo_progresso)
+
+    outras = linhas_de_teste(3, inicio=100)
+    estatisticas = anexar_em_lotes(worksheet, outras, max_linhas=5, arquivo_progresso=arquivo_progresso)
+
+    assert estatisticas["retomado_de"] == 0
+    assert worksheet.valores[-3:] == outras
+    assert estatisticas["primeira_linha"] == 7
+
+
+def test_primeira_linha_sem_cabecalho():
+    worksheet = PlanilhaEmMemoria()
+
+    assert anexar_em_lotes(worksheet, linhas_de_teste(2))["primeira_linha"] == 1
+
+
+class PlanilhaCompartilhada(PlanilhaEmMemoria):
+    # Outra gravação entra na planilha logo depois do primeiro lote
+    def append_rows(self, linhas, **kwargs):
+        resposta = super().append_rows(linhas, **kwargs)
+        if len(self.chamadas) == 1:
+            self.valores.append(["intrusa", "0.00"])
+        return resposta
+
+
+def test_primeira_linha_nula_quando_os_lotes_nao_ficam_contiguos():
+    worksheet = PlanilhaCompartilhada([CABECALHO])
+
+    estatisticas = anexar_em_lotes(worksheet, linhas_de_teste(4), max_linhas=2)
+
+    assert estatisticas["primeira_linha"] is None
+
+
+def test_primeira_linha_nula_sem_intervalo_na_resposta():
+    class PlanilhaSemIntervalo(PlanilhaEmMemoria):
+        def append_rows(self, linhas, **kwargs):
+            super().append_rows(linhas, **kwargs)
+            return {}
+
+    assert anexar_em_lotes(PlanilhaSemIntervalo([CABECALHO]), linhas_de_teste(2))["primeira_linha"] is None